@@ -36,10 +36,12 @@ def main(global_config, **settings):
     config.add_route('getUserAbstraction', '/userAbstraction')
     config.add_route('sparqlquery', '/sparqlquery')
     config.add_route('getSparqlQueryInTextFormat', '/getSparqlQueryInTextFormat')
+    config.add_route('explainSparqlQuery', '/explainSparqlQuery')
 
     # Job persistance management
     config.add_route('listjob', '/listjob')
     config.add_route('deljob', '/deljob')
+    config.add_route('canceljob', '/canceljob')
 
     # Upload/integration routes
     config.add_route('source_files_overview', '/source_files_overview')
@@ -99,6 +101,7 @@ def main(global_config, **settings):
 
     config.add_route('serverinformations', '/serverinformations')
     config.add_route('cleantmpdirectory', '/cleantmpdirectory')
+    config.add_route('rebuild_statistics', '/rebuild_statistics')
 
     # TODO no absolute path to static files
     # TODO check what is cors (iframe redirect?)
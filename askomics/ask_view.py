@@ -20,6 +20,7 @@ from pygments.formatters import HtmlFormatter
 from askomics.libaskomics.ParamManager import ParamManager
 from askomics.libaskomics.JobManager import JobManager
 from askomics.libaskomics.EndpointManager import EndpointManager
+from askomics.libaskomics.StatisticsManager import StatisticsManager
 
 from askomics.libaskomics.TripleStoreExplorer import TripleStoreExplorer
 from askomics.libaskomics.SourceFileConvertor import SourceFileConvertor
@@ -29,9 +30,11 @@ from askomics.libaskomics.rdfdb.SparqlQueryGraph import SparqlQueryGraph
 from askomics.libaskomics.rdfdb.SparqlQueryStats import SparqlQueryStats
 from askomics.libaskomics.rdfdb.SparqlQueryAuth import SparqlQueryAuth
 
-from askomics.libaskomics.rdfdb.QueryLauncher import QueryLauncher
+from askomics.libaskomics.rdfdb.QueryLauncher import QueryLauncher, QueryCancelled
 from askomics.libaskomics.rdfdb.MultipleQueryLauncher import MultipleQueryLauncher
 from askomics.libaskomics.rdfdb.FederationQueryLauncher import FederationQueryLauncher
+from askomics.libaskomics.rdfdb.GraphAccessCache import GraphAccessCache
+from askomics.libaskomics.rdfdb.AbstractionSnapshot import AbstractionSnapshot
 
 from askomics.libaskomics.source_file.SourceFile import SourceFile
 from askomics.libaskomics.source_file.SourceFileURL import SourceFileURL
@@ -44,8 +47,10 @@ from pyramid.httpexceptions import (
     HTTPForbidden,
     HTTPFound,
     HTTPNotFound,
+    HTTPNotModified,
     exception_response
     )
+from webob.etag import ETagMatcher
 
 from validate_email import validate_email
 
@@ -102,17 +107,41 @@ class AskView(object):
             raise exception_response(403)
 
 
+    def checkNotModified(self, etag):
+        """
+        Answer 304 Not Modified if the client already has the version etag
+        of the response (If-None-Match), else send the etag with the response.
+        The client revalidates its copy each time (Cache-Control: no-cache).
+        """
+        cache_control = 'private, no-cache'
+
+        if_none_match = self.request.headers.get('If-None-Match')
+        if if_none_match and etag in ETagMatcher.parse(if_none_match, strong=False):
+            raise HTTPNotModified(headers={'ETag': '"' + etag + '"', 'Cache-Control': cache_control})
+
+        self.request.response.etag = etag
+        self.request.response.cache_control = cache_control
+
+    @staticmethod
+    def delete_graph_records(param_manager, graph):
+        """Delete the abstraction snapshot and the statistics of a deleted graph"""
+        store = AbstractionSnapshot.get_store(param_manager)
+        if store is not None:
+            store.delete(graph)
+        StatisticsManager(param_manager.settings, param_manager.session).delete_graph_statistics(graph)
+
     @view_config(route_name='start_point', request_method='GET')
     def start_points(self):
         """ Get the nodes being query starters """
         self.log.debug("== START POINT ==")
 
         try:
+            tse = TripleStoreExplorer(self.settings, self.request.session)
+            self.checkNotModified(tse.get_abstraction_version())
 
             sqb = SparqlQueryBuilder(self.settings, self.request.session)
             self.settings['graph'] = sqb.getGraphUser([])
 
-            tse = TripleStoreExplorer(self.settings, self.request.session)
             nodes = tse.get_start_points()
 
             self.data['nodes'] = {}
@@ -129,8 +158,11 @@ class AskView(object):
                 else:
                     self.data['nodes'][node['uri']] = node
 
+        except HTTPNotModified:
+            raise
         except Exception as e:
             self.request.response.status = 400
+            self.request.response.etag = None
             traceback.print_exc(file=sys.stdout)
             self.data['error'] = str(e)
 
@@ -148,96 +180,19 @@ class AskView(object):
 
         self.data['username'] = self.request.session['username']
 
-        sqs = SparqlQueryStats(self.settings, self.request.session)
-        qlaucher = QueryLauncher(self.settings, self.request.session)
-        qmlaucher = MultipleQueryLauncher(self.settings, self.request.session)
+        sm = StatisticsManager(self.settings, self.request.session)
         em = EndpointManager(self.settings, self.request.session)
 
-        public_stats = {}
-        private_stats = {}
-
-        lEndp = em.list_endpoints()
-        # Number of triples
-        results_pub = qmlaucher.process_query(sqs.get_number_of_triples('public'),lEndp)
-        results_priv = qlaucher.process_query(sqs.get_number_of_triples('private'))
-
-        public_stats['ntriples'] = results_pub[0]['number']
-        private_stats['ntriples'] = results_priv[0]['number']
-
-        # Number of entities
-        results_pub = qmlaucher.process_query(sqs.get_number_of_entities('public'),lEndp)
-        results_priv = qlaucher.process_query(sqs.get_number_of_entities('private'))
-
-        public_stats['nentities'] = results_pub[0]['number']
-        private_stats['nentities'] = results_priv[0]['number']
-
-        # Number of classes
-        results_pub = qmlaucher.process_query(sqs.get_number_of_classes('public'),lEndp)
-        results_priv = qlaucher.process_query(sqs.get_number_of_classes('private'))
-
-        public_stats['nclasses'] = results_pub[0]['number']
-        private_stats['nclasses'] = results_priv[0]['number']
-
-        # Number of graphs
-        results_pub = qmlaucher.process_query(sqs.get_number_of_subgraph('public'),lEndp)
-        results_priv = qlaucher.process_query(sqs.get_number_of_subgraph('private'))
-
-        public_stats['ngraphs'] = results_pub[0]['number']
-        private_stats['ngraphs'] = results_priv[0]['number']
-
-        # Graphs info
-        results_pub = qmlaucher.process_query(sqs.get_subgraph_infos('public'),lEndp)
-        results_priv = qlaucher.process_query(sqs.get_subgraph_infos('private'))
-
-        public_stats['graphs'] = results_pub
-        private_stats['graphs'] = results_priv
-
-        # Classes and relations
-        results_pub = qmlaucher.process_query(sqs.get_rel_of_classes('public'),lEndp)
-        results_priv = qlaucher.process_query(sqs.get_rel_of_classes('private'))
-
-        public_stats['class_rel'] = results_pub
-        private_stats['class_rel'] = results_priv
-
-        tmp = {}
+        # the graphs integrated before the statistics were recorded
+        if not sm.is_rebuilt():
+            sm.start_rebuild()
+        self.data['rebuilding'] = sm.is_rebuilding()
 
-        for result in results_pub:
-            if result['domain'] not in tmp.keys():
-                tmp[result['domain']] = []
-            if result['relname'] not in tmp[result['domain']]:
-                tmp[result['domain']].append({'relname': result['relname'], 'target': result['range']})
-        public_stats['class_rel'] = tmp
+        public_stats = sm.get_statistics('public')
+        private_stats = sm.get_statistics('private')
 
-        tmp = {}
-
-        for result in results_priv:
-            if result['domain'] not in tmp.keys():
-                tmp[result['domain']] = []
-            if result['relname'] not in tmp[result['domain']]:
-                tmp[result['domain']].append({'relname': result['relname'], 'target': result['range']})
-        private_stats['class_rel'] = tmp
-
-        # class and attributes
-        results_pub = qmlaucher.process_query(sqs.get_attr_of_classes('public'),lEndp)
-        results_priv = qlaucher.process_query(sqs.get_attr_of_classes('private'))
-
-        tmp = {}
-
-        for result in results_pub:
-            if result['class'] not in tmp.keys():
-                tmp[result['class']] = []
-            if result['attr'] not in tmp[result['class']]:
-                tmp[result['class']].append(result['attr'])
-        public_stats['class_attr'] = tmp
-
-        tmp = {}
-
-        for result in results_priv:
-            if result['class'] not in tmp.keys():
-                tmp[result['class']] = []
-            if result['attr'] not in tmp[result['class']]:
-                tmp[result['class']].append(result['attr'])
-        private_stats['class_attr'] = tmp
+        # the public graphs of the askomics endpoints
+        sm.add_endpoints_statistics(public_stats, em.list_endpoints())
 
         self.data['public'] = public_stats
         self.data['private'] = private_stats
@@ -254,8 +209,9 @@ class AskView(object):
 
         self.log.debug("=== DELETE ALL NAMED GRAPHS ===")
 
+        sqb = SparqlQueryBuilder(self.settings, self.request.session)
+
         try:
-            sqb = SparqlQueryBuilder(self.settings, self.request.session)
             ql = QueryLauncher(self.settings, self.request.session)
 
             named_graphs = self.list_user_graph()
@@ -266,11 +222,14 @@ class AskView(object):
                 ql.process_query(sqb.get_drop_named_graph(graph['g']))
                 #delete metadatas
                 ql.process_query(sqb.get_delete_metadatas_of_graph(graph['g']))
+                self.delete_graph_records(sqb, graph['g'])
 
         except Exception as e:
             traceback.print_exc(file=sys.stdout)
             self.data['error'] = str(e)
             self.request.response.status = 400
+        finally:
+            GraphAccessCache.get_cache(sqb).invalidate()
 
         return self.data
 
@@ -289,11 +248,15 @@ class AskView(object):
 
         #TODO: check if the graph belong to user
 
-        for graph in graphs:
-            self.log.debug("--- DELETE GRAPH : %s", graph)
-            ql.process_query(sqb.get_drop_named_graph(graph),parseResults=False)
-            #delete metadatas
-            ql.process_query(sqb.get_delete_metadatas_of_graph(graph),parseResults=False)
+        try:
+            for graph in graphs:
+                self.log.debug("--- DELETE GRAPH : %s", graph)
+                ql.process_query(sqb.get_drop_named_graph(graph),parseResults=False)
+                #delete metadatas
+                ql.process_query(sqb.get_delete_metadatas_of_graph(graph),parseResults=False)
+                self.delete_graph_records(sqb, graph)
+        finally:
+            GraphAccessCache.get_cache(sqb).invalidate()
 
 
     @view_config(route_name='delete_endpoints', request_method='POST')
@@ -375,7 +338,10 @@ class AskView(object):
         sqg = SparqlQueryGraph(self.settings, self.request.session)
         query_launcher = QueryLauncher(self.settings, self.request.session)
 
-        res = query_launcher.process_query(sqg.get_user_graph_infos_with_count())
+        res = query_launcher.process_query(sqg.get_user_graph_infos())
+
+        # the graphs integrated before their number of triples was recorded with them
+        counts = None
 
         named_graphs = []
 
@@ -394,11 +360,22 @@ class AskView(object):
             if 'endpoint' in res[index_result].keys():
                 endpt = res[index_result]['endpoint'],
 
+            count = res[index_result].get('co')
+            if count is None:
+                if counts is None:
+                    counts = StatisticsManager(self.settings, self.request.session).get_triple_counts()
+                count = counts.get(res[index_result]['g'], '')
+
+            size = ''
+            if res[index_result].get('size') is not None:
+                size = humanize.naturalsize(int(res[index_result]['size']), binary=True)
+
             named_graphs.append({
                 'endpoint' : endpt,
                 'g': res[index_result]['g'],
                 'name': res[index_result]['name'],
-                'count': res[index_result]['co'],
+                'count': count,
+                'size': size,
                 'date': res[index_result]['date'],
                 'readable_date': readable_date,
                 'access': res[index_result]['access'],
@@ -590,6 +567,8 @@ class AskView(object):
             src_file.set_key_columns(key_columns)
 
             cont_ttl = '\n'.join(src_file.get_turtle(preview_only=True))
+            abstraction_ttl = src_file.get_abstraction()
+            domain_knowledge_ttl = src_file.get_domain_knowledge()
             self.data = textwrap.dedent(
             """
             {header}
@@ -611,10 +590,10 @@ class AskView(object):
             ######################
 
             {domain_knowledge_ttl}
-            """).format(header=sfc.get_turtle_template(cont_ttl),
+            """).format(header=sfc.get_turtle_template('\n'.join([cont_ttl, abstraction_ttl, domain_knowledge_ttl])),
                     content_ttl = cont_ttl,
-                    abstraction_ttl = src_file.get_abstraction(),
-                    domain_knowledge_ttl = src_file.get_domain_knowledge()
+                    abstraction_ttl = abstraction_ttl,
+                    domain_knowledge_ttl = domain_knowledge_ttl
                     )
         except Exception as e:
             traceback.print_exc(file=sys.stdout)
@@ -782,6 +761,7 @@ class AskView(object):
                 query_laucher = QueryLauncher(self.settings, self.request.session)
                 query_laucher.process_query(sqb.get_drop_named_graph(graph))
                 query_laucher.process_query(sqb.get_delete_metadatas_of_graph(graph))
+                self.delete_graph_records(sqb, graph)
 
             traceback.print_exc(file=sys.stdout)
 
@@ -831,6 +811,7 @@ class AskView(object):
                 query_laucher = QueryLauncher(self.settings, self.request.session)
                 query_laucher.process_query(sqb.get_drop_named_graph(graph))
                 query_laucher.process_query(sqb.get_delete_metadatas_of_graph(graph))
+                self.delete_graph_records(sqb, graph)
 
             if jobid != -1:
                 jm.set_error_message('integration', str(e), jobid)
@@ -887,6 +868,7 @@ class AskView(object):
                 query_laucher = QueryLauncher(self.settings, self.request.session)
                 query_laucher.process_query(sqb.get_drop_named_graph(graph))
                 query_laucher.process_query(sqb.get_delete_metadatas_of_graph(graph))
+                self.delete_graph_records(sqb, graph)
 
             traceback.print_exc(file=sys.stdout)
             if jobid != -1:
@@ -897,13 +879,14 @@ class AskView(object):
         self.data['status'] = 'ok'
         return self.data
 
-    @view_config(route_name='getUserAbstraction', request_method='POST')
+    @view_config(route_name='getUserAbstraction', request_method='GET')
     def getUserAbstraction(self):
 
         """ Get the user asbtraction to manage relation inside javascript """
         self.log.debug("== getUserAbstraction ==")
 
         tse = TripleStoreExplorer(self.settings, self.request.session)
+        self.checkNotModified(tse.get_abstraction_version())
         self.data.update(tse.getUserAbstraction())
         return self.data
 
@@ -922,7 +905,7 @@ class AskView(object):
         body = self.request.json_body
         sqb = SparqlQueryBuilder(self.settings, self.request.session)
         ql = QueryLauncher(self.settings, self.request.session)
-        sparqlHeader = sqb.header_sparql_config("")
+        sparqlHeader = sqb.header_sparql_config(body["shortcut_def"])
 
         try:
             sparqlHeader += body["prefix"]+"\n"
@@ -985,6 +968,7 @@ class AskView(object):
                 persist = True
 
         jobid = -1
+        count = None
 
         try:
             if persist:
@@ -993,6 +977,8 @@ class AskView(object):
                 if 'requestGraph' in body:
                     rg = body['requestGraph']
                 jobid = jm.save_query_job(rg, body['variates'])
+                # the queries of the job stop when it is cancelled
+                self.request.sparql_cancel_check = jm.get_cancel_check(jobid)
 
 
             typeRequest = ''
@@ -1007,33 +993,94 @@ class AskView(object):
 
             if len(variates)<= 0 :
                 raise ValueError("No sparql variable was found !")
-            results, query, typeRequest = tse.build_sparql_query_from_json(
-                                                 body["endpoints"],
-                                                 body["type_endpoints"],
-                                                 body["graphs"],
-                                                 variates,
-                                                 body["constraintesRelations"],
-                                                 True)
-            # Remove prefixes in the results table
-            limit = int(body["limit"]) + 1
-            if body["limit"] != -1 and limit < len(results):
-                self.data['values'] = results[1:limit+1]
-            else:
-                self.data['values'] = results
 
-            self.data['nrow'] = len(results)
+            # with a limit, the results are paginated: page_token gives the next pages
+            limit = int(body.get("limit", -1))
+            offset = 0
+            reserved_file = None
+            fingerprint = tse.get_request_fingerprint(body)
+            if limit > 0 and body.get('page_token'):
+                page = tse.read_page_token(body['page_token'], fingerprint)
+                offset, reserved_file, count = page['offset'], page['file'], page['count']
+
+            # count-first: the number of results of a job, before querying them
+            count_timeout = tse.get_count_first_timeout()
+            if persist and offset == 0 and count_timeout is not None:
+                count = tse.count_sparql_query_from_json(body["endpoints"],
+                                                         body["type_endpoints"],
+                                                         body["graphs"],
+                                                         variates,
+                                                         body["constraintesRelations"],
+                                                         count_timeout)
+                self.data['count'] = count
+                if count is not None:
+                    jm.set_query_job_nrows(jobid, count)
+                    max_rows = tse.get_count_first_max_rows()
+                    if max_rows is not None and count > max_rows:
+                        raise ValueError("The query has " + str(count) + " results, more than the " +
+                                         str(max_rows) + " allowed. Add constraints to it.")
+
+            if offset > 0 and reserved_file:
+                # the next pages are read from the file of the whole results,
+                # which starts with the first page: the triplestore does not sort them
+                results = tse.read_results_page(reserved_file, offset, limit + 1)
+            else:
+                results, query, typeRequest = tse.build_sparql_query_from_json(
+                                                     body["endpoints"],
+                                                     body["type_endpoints"],
+                                                     body["graphs"],
+                                                     variates,
+                                                     body["constraintesRelations"],
+                                                     limit + 1 if limit > 0 else -1,
+                                                     True,
+                                                     offset)
+
+            # one more result tells if there is a next page
+            complete = True
+            if limit > 0 and len(results) > limit:
+                results = results[0:limit]
+                complete = False
+
+            if complete:
+                count = offset + len(results)
+            elif offset == 0:
+                # the file of the results is reserved with the first page for the next ones
+                reserved_file = tse.save_results_request(body, results)
+                if count is None:
+                    # the number of results of the first page is given to the next ones
+                    count = tse.count_sparql_query_from_json(body["endpoints"],
+                                                             body["type_endpoints"],
+                                                             body["graphs"],
+                                                             variates,
+                                                             body["constraintesRelations"],
+                                                             tse.get_count_timeout())
+
+            self.data['values'] = results
+            self.data['nrow'] = count
 
             # Provide results file
             if (not 'nofile' in body) or not body['nofile']:
-                query_laucher = QueryLauncher(self.settings, self.request.session)
-                self.data['file'] = query_laucher.format_results_csv(results)
+                if complete and offset == 0:
+                    query_laucher = QueryLauncher(self.settings, self.request.session)
+                    self.data['file'] = query_laucher.format_results_csv(results)
+                else:
+                    # the whole results are only queried if the file is used,
+                    # the file reserved by the first page is given to the next ones
+                    self.data['file'] = reserved_file or tse.save_results_request(body)
+
+            self.data['next_page_token'] = None
+            if not complete:
+                self.data['next_page_token'] = tse.make_page_token(fingerprint, offset + limit,
+                                                                   reserved_file, count)
 
             if persist:
-                npreview = 30
-                if "limit" in body:
-                    npreview = body["limit"]
+                jm.done_query_job(jobid, self.data['nrow'], self.data['values'], self.data.get('file'))
 
-                jm.done_query_job(jobid, len(results), self.data['values'][0:npreview], self.data['file'])
+        except QueryCancelled as e:
+            self.log.info("query job %s cancelled", jobid)
+            self.data['values'] = ""
+            self.data['file'] = ""
+            self.data['error'] = str(e)
 
         except Exception as e:
             #exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -1043,9 +1090,13 @@ class AskView(object):
             self.data['file'] = ""
 
             if persist:
-                jm.done_query_job(jobid, None, None, None)
+                jm.done_query_job(jobid, count, None, None)
                 jm.set_error_message('query', str(e), jobid)
 
+        finally:
+            if persist:
+                jm.end_query_job(jobid)
+
         self.data['galaxy'] = self.request.session['galaxy']
 
         return self.data
@@ -1073,6 +1124,19 @@ class AskView(object):
         jm.remove_job(body['table'], body['jobid'])
 
 
+    @view_config(route_name='canceljob', request_method='POST')
+    def canceljob(self):
+        ''' Cancel a running query job '''
+
+        self.checkAuthSession()
+
+        body = self.request.json_body
+
+        jm = JobManager(self.settings, self.request.session)
+        self.data['cancelled'] = jm.cancel_query_job(body['jobid'])
+
+        return self.data
+
     @view_config(route_name='getSparqlQueryInTextFormat', request_method='POST')
     def getSparqlQueryInTextFormat(self):
         """ Build a request from a json whith the following contents :variates,constraintesRelations"""
@@ -1101,6 +1165,36 @@ class AskView(object):
 
         return self.data
 
+    @view_config(route_name='explainSparqlQuery', request_method='POST')
+    def explainSparqlQuery(self):
+        """
+        Explain a request built from a json (see getSparqlQueryInTextFormat): its text,
+        the order of its patterns, its time and the plan of the triplestore
+        """
+        self.checkAuthSession()
+        self.checkAdminSession()
+
+        self.log.debug("== Explain Query ==")
+
+        try:
+            tse = TripleStoreExplorer(self.settings, self.request.session)
+
+            body = self.request.json_body
+            variates = []
+            [ variates.extend(listValues) for k,listValues in body["variates"].items()]
+
+            self.data.update(tse.explain_sparql_query_from_json(body.get('endpoints', []),
+                                                                body.get('type_endpoints', []),
+                                                                body.get('graphs', []),
+                                                                variates,
+                                                                body["constraintesRelations"]))
+        except Exception as e:
+            traceback.print_exc(file=sys.stdout)
+            self.data['error'] = str(e)
+            self.request.response.status = 400
+
+        return self.data
+
     @view_config(route_name='ttl', request_method='GET')
     def uploadTtl(self):
         param_manager = ParamManager(self.settings, self.request.session)
@@ -1118,9 +1212,9 @@ class AskView(object):
     @view_config(route_name='csv', request_method='GET')
     def uploadCsv(self):
 
-        pm = ParamManager(self.settings, self.request.session)
+        tse = TripleStoreExplorer(self.settings, self.request.session)
         response = FileResponse(
-            pm.get_user_csv_directory()+self.request.matchdict['name'],
+            tse.get_results_csv(self.request.matchdict['name']),
             content_type='text/csv'
             )
         return response
@@ -1130,8 +1224,13 @@ class AskView(object):
     def deletCsv(self):
 
         pm = ParamManager(self.settings, self.request.session)
+        path = pm.get_user_csv_directory()+self.request.matchdict['name']
         try:
-            os.remove(pm.get_user_csv_directory()+self.request.matchdict['name']),
+            if os.path.isfile(path + '.json'):
+                # a file reserved by a paginated query
+                os.remove(path + '.json')
+            else:
+                os.remove(path)
         except Exception as e:
             self.log.warn(str(e))
 
@@ -1613,11 +1712,14 @@ class AskView(object):
             try:
                 query_laucher.process_query(sqb.get_drop_named_graph(graph))
                 query_laucher.process_query(sqb.get_delete_metadatas_of_graph(graph))
+                self.delete_graph_records(sqb, graph)
             except Exception as e:
                 self.data['error'] = str(e)
                 self.log.error(str(e))
                 self.request.response.status = 400
                 return self.data
+            finally:
+                GraphAccessCache.get_cache(sqb).invalidate()
 
 
         # Delete user infos
@@ -1857,8 +1959,8 @@ class AskView(object):
             if 'json' in body:
                 galaxy.send_json_to_history(body['json'])
             else:
-                param_manager = ParamManager(self.settings, self.request.session)
-                path = param_manager.get_user_csv_directory() + body['path']
+                tse = TripleStoreExplorer(self.settings, self.request.session)
+                path = tse.get_results_csv(body['path'])
                 name = body['name']
                 galaxy.send_to_history(path, name, body['type'])
         except Exception as e:
@@ -1954,6 +2056,18 @@ class AskView(object):
 
         return self.data
 
+    @view_config(route_name='rebuild_statistics', request_method='POST')
+    def rebuild_statistics(self):
+        """
+        Record again the statistics of all the graphs, in the background
+        """
+        self.checkAdminSession()
+
+        sm = StatisticsManager(self.settings, self.request.session)
+        self.data['started'] = sm.start_rebuild(force=True)
+
+        return self.data
+
     @view_config(route_name='cleantmpdirectory', request_method='POST')
     def cleantmpdirectory(self):
         import os
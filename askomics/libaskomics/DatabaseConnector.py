@@ -21,8 +21,9 @@ class DatabaseConnector(ParamManager):
         self.create_integration_table()
         self.create_query_table()
         self.create_endpoints_table()
+        self.create_graph_statistics_table()
 
-    def execute_sql_query(self, query, variables=None, get_id=False):
+    def execute_sql_query(self, query, variables=None, get_id=False, get_rowcount=False):
         """
         execute a sql query
         """
@@ -41,6 +42,9 @@ class DatabaseConnector(ParamManager):
         if get_id:
             return cursor.lastrowid
 
+        if get_rowcount:
+            return cursor.rowcount
+
         return rows
 
     def create_user_table(self):
@@ -118,7 +122,39 @@ class DatabaseConnector(ParamManager):
             url text,
             auth text,
             enable boolean,
-            message text
+            message text,
+            circuit text DEFAULT 'closed',
+            failures int DEFAULT 0,
+            retry_at real
+        )
+        '''
+        self.execute_sql_query(query)
+
+        # circuit breaker columns, missing in the databases created before them
+        columns = [row[1] for row in self.execute_sql_query('PRAGMA table_info(endpoints)')]
+        for column, definition in (('circuit', "text DEFAULT 'closed'"),
+                                   ('failures', 'int DEFAULT 0'),
+                                   ('retry_at', 'real')):
+            if column not in columns:
+                self.execute_sql_query('ALTER TABLE endpoints ADD COLUMN ' + column + ' ' + definition)
+
+    def create_graph_statistics_table(self):
+
+        query = '''
+        CREATE TABLE IF NOT EXISTS graph_statistics (
+            graph text PRIMARY KEY,
+            name text,
+            owner text,
+            access text,
+            date text,
+            server text,
+            version text,
+            ntriples int,
+            nentities int,
+            classes text,
+            class_attr text,
+            class_rel text,
+            updated int
         )
         '''
         self.execute_sql_query(query)
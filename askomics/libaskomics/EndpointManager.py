@@ -1,20 +1,45 @@
 from askomics.libaskomics.ParamManager import ParamManager
 from askomics.libaskomics.DatabaseConnector import DatabaseConnector
+from askomics.libaskomics.rdfdb.GraphAccessCache import GraphAccessCache
 
 import logging
+import time
+import threading
 
 import platform
 
 class EndpointManager(ParamManager):
+    """
+    Manage the endpoints table, and the circuit breaker of each endpoint:
+        - closed: the endpoint is queried,
+        - open: the endpoint failed askomics.endpoint_failure_threshold times
+          in a row, it is skipped until retry_at. The delay doubles at each
+          new failure (askomics.endpoint_open_delay to askomics.endpoint_open_max_delay),
+        - half-open: the delay is over, one request probes the endpoint, the
+          circuit is closed if it succeeds, opened again if it fails.
+    The circuit is independent of enable, which is set by the administrator.
+    The circuits are read from the database at most every
+    askomics.endpoint_circuit_ttl seconds, and written only when they change.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    # the circuits read from the database, shared by the launchers of the process:
+    # {(database, id): ((circuit, failures, retry_at) or None, time read)}
+    _circuits = {}
+    _circuits_lock = threading.Lock()
 
     def __init__(self, settings, session):
         ParamManager.__init__(self, settings, session)
+        self.log = logging.getLogger(__name__)
 
     def save_endpoint(self, name, url, auth='BASIC', isenable=False):
 
         database = DatabaseConnector(self.settings, self.session)
         query = '''
-        INSERT INTO endpoints VALUES (
+        INSERT INTO endpoints (id, name, url, auth, enable, message) VALUES (
             NULL,
             ?,
             ?,
@@ -23,7 +48,10 @@ class EndpointManager(ParamManager):
             NULL
         )
         '''
-        return database.execute_sql_query(query, (name, url, auth.upper(), isenable), get_id=True)
+        id = database.execute_sql_query(query, (name, url, auth.upper(), isenable), get_id=True)
+        # the graphs of the new endpoint are visible
+        GraphAccessCache.get_cache(self).invalidate()
+        return id
 
     def enable(self, id):
 
@@ -31,10 +59,16 @@ class EndpointManager(ParamManager):
 
         query = '''
         UPDATE endpoints SET
-        enable=?
+        enable=?,
+        circuit=?,
+        failures=0,
+        retry_at=NULL
         WHERE id=?
         '''
-        database.execute_sql_query(query, (True, str(id)))
+        database.execute_sql_query(query, (True, self.CLOSED, str(id)))
+        self._set_circuit(id, (self.CLOSED, 0, None))
+        # the graphs of the endpoint are visible again
+        GraphAccessCache.get_cache(self).invalidate()
 
     def disable(self, id, message):
 
@@ -48,6 +82,7 @@ class EndpointManager(ParamManager):
         '''
 
         database.execute_sql_query(query, (False, message, str(id)))
+        GraphAccessCache.get_cache(self).invalidate()
 
     def disable_by_url(self, url, message):
 
@@ -61,55 +96,50 @@ class EndpointManager(ParamManager):
         '''
 
         database.execute_sql_query(query, (False, message, str(url)))
+        GraphAccessCache.get_cache(self).invalidate()
+
+
+    @staticmethod
+    def _endpoint_dict(endpoint):
 
+        dict_endpoint = {}
+        dict_endpoint['id'] = endpoint[0]
+        dict_endpoint['name'] = endpoint[1]
+        dict_endpoint['endpoint'] = endpoint[2]
+        dict_endpoint['auth'] = endpoint[3]
+        dict_endpoint['enable'] = (endpoint[4] == 1)
+        dict_endpoint['message'] = endpoint[5]
+        dict_endpoint['circuit'] = endpoint[6] or EndpointManager.CLOSED
+        dict_endpoint['failures'] = endpoint[7] or 0
+        dict_endpoint['retry_at'] = endpoint[8]
+
+        return dict_endpoint
 
     def list_endpoints(self):
 
         database=DatabaseConnector(self.settings, self.session)
 
         query = '''
-        SELECT *
+        SELECT id, name, url, auth, enable, message, circuit, failures, retry_at
         FROM endpoints
         '''
 
         rows = database.execute_sql_query(query)
-        result = []
-        for endpoint in rows:
-            dict_endpoint = {}
-            dict_endpoint['id'] = endpoint[0]
-            dict_endpoint['name'] = endpoint[1]
-            dict_endpoint['endpoint'] = endpoint[2]
-            dict_endpoint['auth'] = endpoint[3]
-            dict_endpoint['enable'] = (endpoint[4] == 1)
-            dict_endpoint['message'] = endpoint[5]
-            result.append(dict_endpoint)
-
-        return result
+        return [self._endpoint_dict(endpoint) for endpoint in rows]
 
     def list_active_endpoints(self):
 
         database=DatabaseConnector(self.settings, self.session)
 
         query = '''
-        SELECT *
+        SELECT id, name, url, auth, enable, message, circuit, failures, retry_at
         FROM endpoints
         WHERE enable=?
         '''
 
         rows = database.execute_sql_query(query, (True, ))
 
-        result = []
-        for endpoint in rows:
-            dict_endpoint = {}
-            dict_endpoint['id'] = endpoint[0]
-            dict_endpoint['name'] = endpoint[1]
-            dict_endpoint['endpoint'] = endpoint[2]
-            dict_endpoint['auth'] = endpoint[3]
-            dict_endpoint['enable'] = (endpoint[4] == 1)
-            dict_endpoint['message'] = endpoint[5]
-            result.append(dict_endpoint)
-
-        return result
+        return [self._endpoint_dict(endpoint) for endpoint in rows]
 
     def remove_endpoint(self, id):
 
@@ -121,3 +151,158 @@ class EndpointManager(ParamManager):
         '''
 
         database.execute_sql_query(query, (id, ))
+        self._set_circuit(id, None)
+        GraphAccessCache.get_cache(self).invalidate()
+
+    def _get_circuit(self, id):
+        """
+        Get the (circuit, failures, retry_at) of an endpoint, None if it does
+        not exist, from the database if the one known is older than
+        askomics.endpoint_circuit_ttl seconds
+        """
+
+        ttl = 5.0
+        if self.is_defined("askomics.endpoint_circuit_ttl"):
+            ttl = float(self.get_param("askomics.endpoint_circuit_ttl"))
+
+        key = (self.get_param("askomics.database_path"), str(id))
+        with self._circuits_lock:
+            known = self._circuits.get(key)
+        if known is not None and time.time() - known[1] < ttl:
+            return known[0]
+
+        database = DatabaseConnector(self.settings, self.session)
+        rows = database.execute_sql_query('SELECT circuit, failures, retry_at FROM endpoints WHERE id=?', (id, ))
+        state = None
+        if rows:
+            state = (rows[0][0] or self.CLOSED, rows[0][1] or 0, rows[0][2])
+        self._set_circuit(id, state)
+        return state
+
+    def _set_circuit(self, id, state):
+        """Record the circuit of an endpoint written to the database"""
+
+        key = (self.get_param("askomics.database_path"), str(id))
+        with self._circuits_lock:
+            self._circuits[key] = (state, time.time())
+
+    def _forget_circuit(self, id):
+        """Read the circuit of an endpoint from the database next time"""
+
+        key = (self.get_param("askomics.database_path"), str(id))
+        with self._circuits_lock:
+            self._circuits.pop(key, None)
+
+    def allow_request(self, id):
+        """
+        Check if the circuit of an endpoint lets a request go.
+        When the delay of an open circuit is over, the circuit becomes
+        half-open and only the caller getting it probes the endpoint.
+
+        :param id: id of the endpoint
+        :returns: the circuit state seen by the caller (closed or half-open),
+                  None if the endpoint must be skipped
+        """
+
+        state = self._get_circuit(id)
+        if state is None or state[0] == self.CLOSED:
+            return self.CLOSED
+
+        now = time.time()
+        if state[2] is not None and state[2] > now:
+            return None
+
+        database = DatabaseConnector(self.settings, self.session)
+
+        # only one caller switches the circuit, a probe that did not come back
+        # before retry_at is given up and a new one is sent
+        query = '''
+        UPDATE endpoints SET
+        circuit=?,
+        retry_at=?
+        WHERE id=? AND circuit=? AND (retry_at IS NULL OR retry_at<=?)
+        '''
+        probe = database.execute_sql_query(query, (self.HALF_OPEN, now + self._open_delay(1), id, state[0], now),
+                                           get_rowcount=True)
+        # the state has changed, here or in another process
+        self._forget_circuit(id)
+        if probe:
+            self.log.debug("endpoint %s: half-open, probe it", id)
+            return self.HALF_OPEN
+        return None
+
+    def record_success(self, id, circuit=CLOSED):
+        """
+        Close the circuit of an endpoint after a successful request, the
+        database is not written if it is closed without failures already
+
+        :param circuit: the state returned by allow_request
+        """
+
+        state = self._get_circuit(id)
+        if circuit == self.CLOSED and (state is None or state[:2] == (self.CLOSED, 0)):
+            return
+
+        database = DatabaseConnector(self.settings, self.session)
+
+        query = '''
+        UPDATE endpoints SET
+        circuit=?,
+        failures=0,
+        retry_at=NULL
+        WHERE id=? AND (circuit!=? OR failures!=0)
+        '''
+        database.execute_sql_query(query, (self.CLOSED, id, self.CLOSED))
+        self._set_circuit(id, (self.CLOSED, 0, None))
+        if circuit != self.CLOSED:
+            self.log.info("endpoint %s: circuit closed", id)
+
+    def record_failure(self, id, message):
+        """
+        Count a failed request (after retries) on an endpoint, open its circuit
+        at askomics.endpoint_failure_threshold consecutive failures or when
+        the half-open probe failed.
+        """
+
+        database = DatabaseConnector(self.settings, self.session)
+
+        rows = database.execute_sql_query('SELECT circuit, failures FROM endpoints WHERE id=?', (id, ))
+        if not rows:
+            return
+
+        circuit = rows[0][0] or self.CLOSED
+        failures = (rows[0][1] or 0) + 1
+
+        threshold = 3
+        if self.is_defined("askomics.endpoint_failure_threshold"):
+            threshold = int(self.get_param("askomics.endpoint_failure_threshold"))
+
+        retry_at = None
+        if circuit == self.HALF_OPEN or failures >= threshold:
+            circuit = self.OPEN
+            retry_at = time.time() + self._open_delay(max(failures - threshold + 1, 1))
+            self.log.warning("endpoint %s: circuit open after %d failure(s): %s", id, failures, message)
+
+        query = '''
+        UPDATE endpoints SET
+        circuit=?,
+        failures=?,
+        retry_at=?,
+        message=?
+        WHERE id=?
+        '''
+        database.execute_sql_query(query, (circuit, failures, retry_at, message, id))
+        self._set_circuit(id, (circuit, failures, retry_at))
+
+    def _open_delay(self, times_open):
+        """Delay before probing an endpoint whose circuit opened times_open times in a row"""
+
+        delay = 30.0
+        if self.is_defined("askomics.endpoint_open_delay"):
+            delay = float(self.get_param("askomics.endpoint_open_delay"))
+
+        max_delay = 3600.0
+        if self.is_defined("askomics.endpoint_open_max_delay"):
+            max_delay = float(self.get_param("askomics.endpoint_open_max_delay"))
+
+        return min(delay * 2 ** (times_open - 1), max_delay)
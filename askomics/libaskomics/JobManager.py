@@ -4,6 +4,8 @@ from askomics.libaskomics.Security import Security
 
 import logging
 import sqlite3
+import threading
+import time
 import urllib.parse
 import json
 
@@ -11,6 +13,9 @@ class JobManager(ParamManager):
     """
         Manage Askomics jobs inside a sqlite database
     """
+
+    # cancellation events of the query jobs running in the worker
+    running_query_jobs = {}
     def __init__(self, settings, session):
         ParamManager.__init__(self, settings, session)
 
@@ -81,19 +86,99 @@ class JobManager(ParamManager):
         database.execute_sql_query(query, (jobid, ))
 
     def done_query_job(self, jobid, nrows, data, file):
+        """Record the results of a query job, nrows None keeps the number recorded before"""
 
         database = DatabaseConnector(self.settings, self.session)
         query = '''
         UPDATE query SET
         state="done",
         end=strftime('%s', 'now'),
-        nrows=?,
+        nrows=COALESCE(?, nrows),
         data=?,
         file=?
+        WHERE id=? AND state!="cancelled"
+        '''
+
+        # data can be a ResultSet, serialized as the json renderer does
+        data = json.dumps(data, ensure_ascii=False, default=lambda obj: obj.__json__(None))
+        database.execute_sql_query(query, (nrows, self.encode(data), file, jobid))
+
+    def set_query_job_nrows(self, jobid, nrows):
+        """Record the number of results of a running query job, counted before it"""
+
+        database = DatabaseConnector(self.settings, self.session)
+        query = '''
+        UPDATE query SET
+        nrows=?
+        WHERE id=?
+        '''
+
+        database.execute_sql_query(query, (nrows, jobid))
+
+    def get_cancel_check(self, jobid, poll=2):
+        """
+        Register a running query job, and get the function telling if it was
+        cancelled: at once if cancelled by this worker, after at most poll
+        seconds if cancelled by another one (state read in the database)
+        """
+
+        event = threading.Event()
+        JobManager.running_query_jobs[jobid] = event
+        last_poll = [time.time()]
+
+        def is_cancelled():
+            if event.is_set():
+                return True
+            if time.time() - last_poll[0] >= poll:
+                last_poll[0] = time.time()
+                if self.get_query_job_state(jobid) == 'cancelled':
+                    event.set()
+            return event.is_set()
+
+        return is_cancelled
+
+    def end_query_job(self, jobid):
+        """Unregister a query job at the end of its run"""
+
+        JobManager.running_query_jobs.pop(jobid, None)
+
+    def get_query_job_state(self, jobid):
+
+        database = DatabaseConnector(self.settings, self.session)
+        query = '''
+        SELECT state
+        FROM query
         WHERE id=?
         '''
 
-        database.execute_sql_query(query, (nrows, self.encode(json.dumps(data, ensure_ascii=False)), file, jobid))
+        rows = database.execute_sql_query(query, (jobid, ))
+        return rows[0][0] if rows else None
+
+    def cancel_query_job(self, jobid):
+        """
+        Cancel a running query job of the user, its queries are stopped and
+        the worker running it is released
+
+        :returns: True if the job was running
+        """
+
+        # get userid
+        security = Security(self.settings, self.session, self.session['username'], '', '', '')
+        userid = security.get_user_id_by_username()
+
+        database = DatabaseConnector(self.settings, self.session)
+        query = '''
+        UPDATE query SET
+        state="cancelled",
+        end=strftime('%s', 'now')
+        WHERE id=? AND user_id=? AND state="wait"
+        '''
+
+        cancelled = database.execute_sql_query(query, (jobid, userid), get_rowcount=True) > 0
+        if cancelled and jobid in JobManager.running_query_jobs:
+            JobManager.running_query_jobs[jobid].set()
+
+        return cancelled
 
     def set_error_message(self, table, message, jobid):
 
@@ -4,16 +4,25 @@
 
 import os.path
 import re
-import requests
 import json
 import tempfile
 import logging
 import urllib.parse
 
+from askomics.libaskomics.PrefixRegistry import PrefixRegistry
+
 class ParamManager(object):
     """
         Manage static file and template sparql queries
     """
+
+    # prefixed names and the empty prefix, not the schemes of IRIs nor the blank nodes
+    RE_PREFIX = re.compile(r'(?<![\w.:/#?$<@%-])([A-Za-z][\w.-]*)?:(?!//)')
+
+    # rendered PREFIX/@prefix headers, keyed on their (prefix, namespace) pairs
+    prefix_headers = {}
+    MAX_PREFIX_HEADERS = 1024
+
     def __init__(self, settings, session):
         self.log = logging.getLogger(__name__)
         # User parameters
@@ -108,52 +117,82 @@ class ParamManager(object):
     def is_defined(self, key):
         return key in self.settings.keys()
 
+    def get_triplestore_type(self):
+        """
+            Get the type of the local triplestore: askomics.triplestore, or
+            guessed from askomics.hack_virtuoso and askomics.file_upload_url
+        """
+        if self.is_defined("askomics.triplestore"):
+            return self.get_param("askomics.triplestore").lower()
+        if self.is_defined("askomics.hack_virtuoso") and \
+           self.get_param("askomics.hack_virtuoso").lower() in ('ok', 'true'):
+            return 'virtuoso'
+        if self.is_defined("askomics.file_upload_url"):
+            return 'fuseki'
+        return 'generic'
+
     def update_list_prefix(self,listPrefix):
         self.log.warn("Deprecated, use __update_askomics_prefixes instead")
         self.__update_askomics_prefixes(listPrefix)
 
     def reverse_prefix(self,uri):
-        url = "http://prefix.cc/reverse?format=json&uri="
+        """Get the prefix of an uri ("" if unknown), see PrefixRegistry"""
 
         for prefix in self.ASKOMICS_prefix:
             if uri.startswith(self.ASKOMICS_prefix[prefix]):
                 return prefix
 
-        response = requests.get(url+uri)
-        if response.status_code != 200:
-            self.log.error("request:"+str(url+uri))
-            self.log.error("status_code:"+str(response.status_code))
-            self.log.error(response)
-            self.ASKOMICS_prefix[uri]=uri
+        registry = PrefixRegistry.get_registry(self)
+        prefix = registry.reverse_lookup(uri)
+        if prefix is None:
             return ""
 
-        dic = json.loads(response.text)
-        if (len(dic)>0):
-            v = list(dic.values())[0]
-            k = list(dic.keys())[0]
-            self.ASKOMICS_prefix[k]=v
-            self.log.info("add prefix:"+str(k)+":"+self.ASKOMICS_prefix[k])
-            return k
-
-        return uri
-
-    def get_sparql_prefixes(self,sparqlrequest):
-        # SLETORT: should be almost identical to get_turtle_prefixes,
-        # SLETORT:   and also elsewhere (but this one is used by more classes)
-        # SLETORT: why returning all askomics prefixes ? we only need those from the request.
-        header = ""
-        regex = re.compile('\s(\w+):')
-        listTermPref = regex.findall(sparqlrequest)
-        self.__update_askomics_prefixes(listTermPref)
+        namespace = registry.lookup(prefix)
+        if namespace is not None:
+            self.ASKOMICS_prefix[prefix] = namespace
+        return prefix
 
-        for key, value in self.ASKOMICS_prefix.items():
-            header += "PREFIX "+key+": <"+value+">\n"
+    def get_used_prefixes(self, text, used=None):
+        """Add the prefixes referenced in text to the set used (a new set if None)
 
+        Call it on each piece of a query or turtle while it is generated,
+        then give the set to get_sparql_prefixes/get_turtle_prefixes.
+        """
+        if used is None:
+            used = set()
+        used.update(self.RE_PREFIX.findall(text))
+        return used
+
+    def __get_prefix_header(self, kind, prefixes, render):
+        """Get the header of the known prefixes, rendered once per prefix set"""
+        self.__update_askomics_prefixes(prefixes)
+        pairs = tuple(sorted((prefix, self.ASKOMICS_prefix[prefix])
+                             for prefix in prefixes if prefix in self.ASKOMICS_prefix))
+
+        key = (kind, pairs)
+        header = ParamManager.prefix_headers.get(key)
+        if header is None:
+            header = render(pairs)
+            if len(ParamManager.prefix_headers) >= self.MAX_PREFIX_HEADERS:
+                ParamManager.prefix_headers.clear()
+            ParamManager.prefix_headers[key] = header
         return header
 
-    def header_sparql_config(self,sparqlrequest):
+    def get_sparql_prefixes(self,sparqlrequest,prefixes=None):
+        """Get the PREFIX header of the prefixes referenced by a query
+
+        :param prefixes: the prefixes tracked while the query was built
+                         (see get_used_prefixes), the query is not scanned then
+        """
+        if prefixes is None:
+            prefixes = self.get_used_prefixes(sparqlrequest)
+
+        return self.__get_prefix_header('sparql', prefixes,
+            lambda pairs: "".join("PREFIX "+key+": <"+value+">\n" for key, value in pairs))
+
+    def header_sparql_config(self,sparqlrequest,prefixes=None):
         self.log.warn( "deprecated, use get_sparql_prefixes" )
-        return self.get_sparql_prefixes(sparqlrequest)
+        return self.get_sparql_prefixes(sparqlrequest,prefixes)
 
     def remove_prefix(self, obj):
         for key, value in self.ASKOMICS_prefix.items():
@@ -167,51 +206,54 @@ class ParamManager(object):
     def __update_askomics_prefixes(self,l_prefixes):
         """removes duplicates,
             if the prefix is public, add it to ASKOMICS_prefix
-            else log it."""
+            else log it.
+            Prefixes are resolved by the PrefixRegistry: bundled prefixes,
+            on-disk cache, and prefix.cc if askomics.prefix_lookup_online is true."""
         self.log.debug("update_prefixes")
         l_prefixes = list(set(l_prefixes)) # remove duplicates
 
-        url = "http://prefix.cc/"
-        ext = ".file.json"
-
+        registry = None
         for prefix in l_prefixes:
             if not prefix in self.ASKOMICS_prefix:
-                # check that prefix correspond to public ontology
-                prefix_url = url + prefix + ext
-                response = requests.get(prefix_url)
-                if response.status_code != 200:
-                    self.log.error("request:"+str(prefix_url))
-                    self.log.error("status_code:"+str(response.status_code))
-                    self.log.error(response)
+                if registry is None:
+                    registry = PrefixRegistry.get_registry(self)
+                namespace = registry.lookup(prefix)
+                if namespace is None:
+                    self.log.debug("unknown prefix:" + str(prefix))
                     continue
-                dic = json.loads(response.text)
-                self.ASKOMICS_prefix[prefix]=dic[prefix]
-                msg = "add prefix:" + str(prefix) + ":" + self.ASKOMICS_prefix[prefix]
-                self.log.info(msg)
+                self.ASKOMICS_prefix[prefix] = namespace
     # __update_askomics_prefixes
 
-    def get_turtle_template(self,ttl):
+    def get_turtle_template(self,ttl,prefixes=None):
         self.log.warn("deprecatred use get_turtle_prefixes.")
-        return self.get_turtle_prefixes(ttl)
+        return self.get_turtle_prefixes(ttl,prefixes)
 
-    def get_turtle_prefixes(self,ttl):
+    def get_turtle_prefixes(self,ttl,prefixes=None):
         """Parse the ttl string, looking for prefix.
             add them to ASKOMICS_prefix if they exist.
-            Then return the prefixes as ttl header."""
+            Then return the prefixes referenced as ttl header.
+
+        :param prefixes: the prefixes tracked while the ttl was generated
+                         (see get_used_prefixes), the ttl is not scanned then
+        """
         #add new prefix if needed
         if ttl == None:
             raise ValueError("Turtle is empty.")
 
-        regex = re.compile('\s(\w+):')
-        listTermPref = regex.findall(ttl)
-        self.update_list_prefix(listTermPref)
-
-        header = ["@prefix {0}: <{1}> .".format(k,v) for k,v in self.ASKOMICS_prefix.items() ]
+        if prefixes is None:
+            prefixes = self.get_used_prefixes(ttl)
+        # the ontology declaration uses rdf and owl
+        prefixes = set(prefixes) | {'rdf', 'owl'}
 
         asko_prefix = self.get_param("askomics.prefix")
-        header.append("@base <{0}> .".format(asko_prefix))
-        header.append("<{0}> rdf:type owl:Ontology .".format(asko_prefix))
-        return '\n'.join(header)
+
+        def render(pairs):
+            header = ["@prefix {0}: <{1}> .".format(k,v) for k,v in pairs]
+            header.append("@base <{0}> .".format(asko_prefix))
+            header.append("<{0}> rdf:type owl:Ontology .".format(asko_prefix))
+            return '\n'.join(header)
+
+        return self.__get_prefix_header(('turtle', asko_prefix), prefixes, render)
 
     @staticmethod
     def encode(toencode):
@@ -0,0 +1,213 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+
+import requests
+
+class PrefixRegistry(object):
+    """
+    The PrefixRegistry resolves prefixes to namespaces (and back) without
+    the network:
+        - the prefixes bundled with AskOmics (prefixes.json) come first,
+        - then an on-disk cache (json file) shared by all the processes,
+          holding the answers of prefix.cc and the prefixes it does not know
+          (negative entries, kept negative_ttl seconds),
+        - prefix.cc is only asked if online is True, with a short timeout.
+    A registry is shared by all the ParamManager of the process (see get_registry).
+    """
+
+    PREFIX_URL = "http://prefix.cc/{0}.file.json"
+    REVERSE_URL = "http://prefix.cc/reverse"
+
+    _bundled = None
+    _registries = {}
+    _registries_lock = threading.Lock()
+
+    def __init__(self, cache_path=None, online=False, negative_ttl=86400, timeout=5):
+        self.log = logging.getLogger(__name__)
+        self.cache_path = cache_path
+        self.online = online
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+
+        self._cache = {'prefixes': {}, 'namespaces': {}, 'misses': {}}
+        self._cache_mtime = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_registry(cls, param_manager):
+        """Get the registry of the process for the settings of a ParamManager"""
+
+        cache_path = None
+        if param_manager.is_defined("askomics.prefix_cache_path"):
+            cache_path = param_manager.get_param("askomics.prefix_cache_path")
+        elif param_manager.is_defined("askomics.files_dir"):
+            cache_path = os.path.join(param_manager.get_param("askomics.files_dir"), "prefix_cache.json")
+
+        online = False
+        if param_manager.is_defined("askomics.prefix_lookup_online"):
+            online = param_manager.get_param("askomics.prefix_lookup_online").lower() in ('ok', 'true')
+
+        negative_ttl = 86400
+        if param_manager.is_defined("askomics.prefix_negative_ttl"):
+            negative_ttl = float(param_manager.get_param("askomics.prefix_negative_ttl"))
+
+        key = (cache_path, online, negative_ttl)
+        with cls._registries_lock:
+            if key not in cls._registries:
+                cls._registries[key] = cls(cache_path, online, negative_ttl)
+            return cls._registries[key]
+
+    @classmethod
+    def bundled(cls):
+        """Get the {prefix: namespace} dict bundled with AskOmics"""
+        if cls._bundled is None:
+            with open(os.path.join(os.path.dirname(__file__), 'prefixes.json')) as prefixes_file:
+                cls._bundled = json.load(prefixes_file)
+        return cls._bundled
+
+    def lookup(self, prefix):
+        """Get the namespace of a prefix, None if it is unknown"""
+
+        namespace = self.bundled().get(prefix)
+        if namespace is not None:
+            return namespace
+
+        return self._resolve('prefixes', prefix, self._fetch_prefix)
+
+    def reverse_lookup(self, uri):
+        """Get the prefix of the namespace of an uri, None if it is unknown"""
+
+        best = None
+        for prefix, namespace in self.bundled().items():
+            if uri.startswith(namespace) and (best is None or len(namespace) > len(self.bundled()[best])):
+                best = prefix
+        if best is not None:
+            return best
+
+        self._load()
+        for namespace, prefix in list(self._cache['namespaces'].items()):
+            if uri.startswith(namespace):
+                return prefix
+
+        return self._resolve('namespaces', uri, self._fetch_namespace)
+
+    def _resolve(self, kind, name, fetch):
+        """Look for name in the cache, then online, and cache the answer"""
+
+        self._load()
+        entries = self._cache[kind]
+        if name in entries:
+            return entries[name]
+
+        miss_key = kind + ':' + name
+        missed = self._cache['misses'].get(miss_key)
+        if missed is not None and time.time() - missed < self.negative_ttl:
+            return None
+
+        if not self.online:
+            return None
+
+        found = fetch(name)
+        if found is None:
+            self._save({'misses': {miss_key: time.time()}})
+            return None
+
+        key, value = found
+        self._save({kind: {key: value}})
+        return value
+
+    def _fetch_prefix(self, prefix):
+        """Ask prefix.cc the namespace of a prefix, return (prefix, namespace) or None"""
+
+        try:
+            response = requests.get(self.PREFIX_URL.format(prefix), timeout=self.timeout)
+            if response.status_code != 200:
+                return None
+            namespace = json.loads(response.text).get(prefix)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.log.warning("prefix.cc lookup of %s failed: %s", prefix, e)
+            return None
+
+        if namespace is None:
+            return None
+        self.log.info("add prefix:" + str(prefix) + ":" + namespace)
+        return prefix, namespace
+
+    def _fetch_namespace(self, uri):
+        """Ask prefix.cc the prefix of an uri, return (namespace, prefix) or None"""
+
+        try:
+            response = requests.get(self.REVERSE_URL, params={'format': 'json', 'uri': uri}, timeout=self.timeout)
+            if response.status_code != 200:
+                return None
+            answer = json.loads(response.text)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.log.warning("prefix.cc reverse lookup of %s failed: %s", uri, e)
+            return None
+
+        if not answer:
+            return None
+        prefix, namespace = list(answer.items())[0]
+        self.log.info("add prefix:" + str(prefix) + ":" + namespace)
+        return namespace, prefix
+
+    def _load(self):
+        """Read the on-disk cache again if another process changed it"""
+
+        if self.cache_path is None:
+            return
+        try:
+            mtime = os.stat(self.cache_path).st_mtime
+        except OSError:
+            return
+        if mtime == self._cache_mtime:
+            return
+
+        with self._lock:
+            try:
+                with open(self.cache_path) as cache_file:
+                    cache = json.load(cache_file)
+            except (OSError, ValueError) as e:
+                self.log.warning("prefix cache %s ignored: %s", self.cache_path, e)
+                return
+            for kind in self._cache:
+                self._cache[kind] = cache.get(kind, {})
+            self._cache_mtime = mtime
+
+    def _save(self, entries):
+        """Add entries to the cache, and write it atomically with the entries of the other processes"""
+
+        with self._lock:
+            for kind, values in entries.items():
+                self._cache[kind].update(values)
+
+            if self.cache_path is None:
+                return
+
+            cache = {}
+            try:
+                with open(self.cache_path) as cache_file:
+                    cache = json.load(cache_file)
+            except (OSError, ValueError):
+                pass
+            for kind in self._cache:
+                merged = cache.get(kind, {})
+                merged.update(self._cache[kind])
+                self._cache[kind] = merged
+
+            try:
+                directory = os.path.dirname(self.cache_path) or '.'
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                with tempfile.NamedTemporaryFile('w', dir=directory, delete=False, suffix='.tmp') as tmp_file:
+                    json.dump(self._cache, tmp_file)
+                os.replace(tmp_file.name, self.cache_path)
+                self._cache_mtime = os.stat(self.cache_path).st_mtime
+            except OSError as e:
+                self.log.warning("prefix cache %s not written: %s", self.cache_path, e)
@@ -0,0 +1,240 @@
+from askomics.libaskomics.ParamManager import ParamManager
+from askomics.libaskomics.DatabaseConnector import DatabaseConnector
+from askomics.libaskomics.rdfdb.SparqlQueryStats import SparqlQueryStats
+from askomics.libaskomics.rdfdb.QueryLauncher import QueryLauncher
+from askomics.libaskomics.rdfdb.MultipleQueryLauncher import MultipleQueryLauncher
+
+import logging
+import json
+import time
+import threading
+
+class StatisticsManager(ParamManager):
+    """
+    Manage the graph_statistics table: the statistics of each graph of the
+    local triplestore, so that the statistics view does not scan it:
+        - the statistics of a graph are recorded once its data are integrated
+          (see SourceFile.persist), and deleted with the graph,
+        - rebuild() records the statistics of the graphs integrated before,
+          start_rebuild() runs it in a background thread.
+    The statistics of several graphs are summed: an entity described in two
+    graphs is counted twice.
+    """
+
+    # the databases rebuilt, or being rebuilt, by the process
+    _rebuilt = set()
+    _running = set()
+    _rebuild_lock = threading.Lock()
+
+    def __init__(self, settings, session):
+        ParamManager.__init__(self, settings, session)
+        self.log = logging.getLogger(__name__)
+
+    def build(self, graph):
+        """Query the statistics of a graph, None if it has no metadatas"""
+
+        sqs = SparqlQueryStats(self.settings, self.session)
+        ql = QueryLauncher(self.settings, self.session)
+
+        results = {name: ql.process_query(query) for name, query in sqs.get_graph_statistics(graph).items()}
+        if not results['infos']:
+            return None
+
+        statistics = dict(results['infos'][0])
+        statistics['ntriples'] = int(results['ntriples'][0]['number'])
+        statistics['nentities'] = int(results['nentities'][0]['number'])
+        statistics['classes'] = sorted(set(row['class'] for row in results['classes']))
+        statistics['class_attr'] = [dict(row) for row in results['class_attr']]
+        statistics['class_rel'] = [dict(row) for row in results['class_rel']]
+        return statistics
+
+    def save_graph_statistics(self, graph):
+        """Record the statistics of a graph, return False if they could not be built"""
+
+        try:
+            statistics = self.build(graph)
+        except Exception as e:
+            self.log.warning("statistics of %s not recorded: %s", graph, e)
+            self.delete_graph_statistics(graph)
+            return False
+
+        if statistics is None:
+            self.delete_graph_statistics(graph)
+            return False
+
+        database = DatabaseConnector(self.settings, self.session)
+        query = '''
+        INSERT OR REPLACE INTO graph_statistics (graph, name, owner, access, date, server, version,
+                                                 ntriples, nentities, classes, class_attr, class_rel, updated)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        '''
+        database.execute_sql_query(query, (graph, statistics['graph'], statistics['owner'], statistics['access'],
+                                           statistics['date'], statistics['server'], statistics['version'],
+                                           statistics['ntriples'], statistics['nentities'],
+                                           json.dumps(statistics['classes']),
+                                           json.dumps(statistics['class_attr']),
+                                           json.dumps(statistics['class_rel']),
+                                           int(time.time())))
+        return True
+
+    def delete_graph_statistics(self, graph):
+
+        database = DatabaseConnector(self.settings, self.session)
+        database.execute_sql_query('DELETE FROM graph_statistics WHERE graph=?', (graph, ))
+
+    def list_recorded_graphs(self):
+
+        database = DatabaseConnector(self.settings, self.session)
+        return [row[0] for row in database.execute_sql_query('SELECT graph FROM graph_statistics')]
+
+    def get_triple_counts(self):
+        """The number of triples of the recorded graphs: {graph: ntriples}"""
+
+        database = DatabaseConnector(self.settings, self.session)
+        return dict(database.execute_sql_query('SELECT graph, ntriples FROM graph_statistics'))
+
+    def list_graphs(self):
+        """The graphs of the local triplestore"""
+
+        sqs = SparqlQueryStats(self.settings, self.session)
+        ql = QueryLauncher(self.settings, self.session)
+        return [row['g'] for row in ql.process_query(sqs.get_local_graphs())]
+
+    def get_statistics(self, access_level):
+        """
+        Aggregate the statistics of the graphs of an access level, the private
+        graphs are those of the user, all of them for an administrator
+        """
+
+        database = DatabaseConnector(self.settings, self.session)
+        query = '''
+        SELECT name, date, owner, server, version, ntriples, nentities, classes, class_attr, class_rel
+        FROM graph_statistics
+        WHERE access=?
+        '''
+        variables = (access_level, )
+        if access_level != 'public' and not self.session['admin']:
+            query += ' AND owner=?'
+            variables = (access_level, self.session['username'])
+        rows = database.execute_sql_query(query + ' ORDER BY date, name', variables)
+
+        stats = {'ntriples': 0, 'nentities': 0, 'ngraphs': len(rows),
+                 'graphs': [], 'class_rel': {}, 'class_attr': {}}
+        classes = set()
+        for row in rows:
+            stats['graphs'].append({'graph': row[0], 'date': row[1], 'owner': row[2],
+                                    'server': row[3], 'version': row[4]})
+            stats['ntriples'] += row[5]
+            stats['nentities'] += row[6]
+            classes.update(json.loads(row[7]))
+            self.add_class_attr(stats['class_attr'], json.loads(row[8]))
+            self.add_class_rel(stats['class_rel'], json.loads(row[9]))
+        stats['nclasses'] = len(classes)
+
+        return stats
+
+    def get_endpoints_launcher(self):
+        return MultipleQueryLauncher(self.settings, self.session)
+
+    def add_endpoints_statistics(self, stats, lendpoints):
+        """
+        Add the statistics of the public graphs of askomics endpoints, queried
+        from them, to the public statistics (see get_statistics)
+        """
+        if not lendpoints:
+            return stats
+
+        sqs = SparqlQueryStats(self.settings, self.session)
+        launcher = self.get_endpoints_launcher()
+
+        def query(sparql):
+            return [dict(row) for row in launcher.process_query(sparql, lendpoints, local=False)]
+
+        # one count per endpoint, the classes of several endpoints are summed too
+        for key, sparql in (('ntriples', sqs.get_number_of_triples('public')),
+                            ('nentities', sqs.get_number_of_entities('public')),
+                            ('nclasses', sqs.get_number_of_classes('public')),
+                            ('ngraphs', sqs.get_number_of_subgraph('public'))):
+            stats[key] += sum(int(row['number']) for row in query(sparql) if 'number' in row)
+
+        for row in query(sqs.get_subgraph_infos('public')):
+            stats['graphs'].append({'graph': row.get('graph', row.get('g', '')),
+                                    'date': row.get('date', ''), 'owner': row.get('owner', ''),
+                                    'server': row.get('server', ''), 'version': row.get('version', '')})
+        self.add_class_rel(stats['class_rel'], query(sqs.get_rel_of_classes('public')))
+        self.add_class_attr(stats['class_attr'], query(sqs.get_attr_of_classes('public')))
+
+        return stats
+
+    @staticmethod
+    def add_class_attr(class_attr, rows):
+        """Add the attributes of rows (class, attr) to {class: [attr]}"""
+
+        for row in rows:
+            attributes = class_attr.setdefault(row['class'], [])
+            if row['attr'] not in attributes:
+                attributes.append(row['attr'])
+
+    @staticmethod
+    def add_class_rel(class_rel, rows):
+        """Add the relations of rows (domain, relname, range) to {domain: [{relname, target}]}"""
+
+        for row in rows:
+            relation = {'relname': row['relname'], 'target': row['range']}
+            relations = class_rel.setdefault(row['domain'], [])
+            if relation not in relations:
+                relations.append(relation)
+
+    def rebuild(self, force=False):
+        """
+        Record the statistics of the graphs without any (of all the graphs if
+        force), and delete those of the graphs no longer in the triplestore.
+        Return the number of graphs recorded.
+        """
+
+        graphs = self.list_graphs()
+        recorded = set(self.list_recorded_graphs())
+
+        for graph in recorded - set(graphs):
+            self.delete_graph_statistics(graph)
+
+        count = 0
+        for graph in graphs:
+            if force or graph not in recorded:
+                if self.save_graph_statistics(graph):
+                    count += 1
+
+        self.log.info("statistics of %d graphs recorded", count)
+        return count
+
+    def is_rebuilt(self):
+        return self.get_param("askomics.database_path") in self._rebuilt
+
+    def is_rebuilding(self):
+        return self.get_param("askomics.database_path") in self._running
+
+    def start_rebuild(self, force=False):
+        """Run rebuild in a background thread, return False if one is running"""
+
+        key = self.get_param("askomics.database_path")
+        with self._rebuild_lock:
+            if key in self._running:
+                return False
+            self._running.add(key)
+
+        # the session of the request is not used after it
+        manager = self.__class__(self.settings, dict(self.session))
+
+        def run():
+            try:
+                manager.rebuild(force)
+                with self._rebuild_lock:
+                    self._rebuilt.add(key)
+            except Exception as e:
+                self.log.error("statistics not rebuilt: %s", e)
+            finally:
+                with self._rebuild_lock:
+                    self._running.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
@@ -2,18 +2,36 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import re
+import csv
+import json
+import base64
+import time
+import hashlib
 import logging
+from pkg_resources import get_distribution
+
+import requests
 
 from askomics.libaskomics.ParamManager import ParamManager
 
+from askomics.libaskomics.rdfdb.SparqlAst import Block
+from askomics.libaskomics.rdfdb.CardinalityEstimator import CardinalityEstimator
+from askomics.libaskomics.rdfdb.AbstractionSnapshot import AbstractionSnapshot
+from askomics.libaskomics.rdfdb.GraphAccessCache import GraphAccessCache
 from askomics.libaskomics.rdfdb.SparqlQueryBuilder import SparqlQueryBuilder
 from askomics.libaskomics.rdfdb.SparqlQueryGraph import SparqlQueryGraph
-from askomics.libaskomics.rdfdb.QueryLauncher import QueryLauncher
+from askomics.libaskomics.rdfdb.QueryLauncher import QueryLauncher, QueryTimeout
+from askomics.libaskomics.rdfdb.ResultSet import ResultSet
 from askomics.libaskomics.rdfdb.MultipleQueryLauncher import MultipleQueryLauncher
 from askomics.libaskomics.rdfdb.FederationQueryLauncher import FederationQueryLauncher
 
 from askomics.libaskomics.EndpointManager import EndpointManager
 
+# part of the abstraction version, get_distribution scans the installed packages
+ASKOMICS_VERSION = get_distribution('Askomics').version
+
 class TripleStoreExplorer(ParamManager):
     """
     Use the different Sparql template queries in order to:
@@ -26,6 +44,12 @@ class TripleStoreExplorer(ParamManager):
         - get the neighbor nodes and the attributes of a node.
     """
 
+    # the names of the csv files of results, see QueryLauncher.get_results_csv_name
+    RE_CSV_NAME = re.compile(r'^data_\d+\.csv$')
+    # the seconds a csv file of results can take to be written, and between two checks of it
+    CSV_WRITE_MAX_TIME = 3600
+    CSV_WAIT_INTERVAL = 0.5
+
     def __init__(self, settings, session, dico={}):
         ParamManager.__init__(self, settings, session)
 
@@ -75,6 +99,9 @@ class TripleStoreExplorer(ParamManager):
     def getUserAbstraction(self):
         """
         Get the user abstraction (relation and entity as subject and object)
+        The abstraction of the local graphs is merged from their snapshots
+        (see AbstractionSnapshot), the triplestore is queried if one is missing
+        while the missing snapshots are written in the background.
 
         :return:
         :rtype:
@@ -87,56 +114,124 @@ class TripleStoreExplorer(ParamManager):
         em = EndpointManager(self.settings, self.session)
         lEndp = em.list_active_endpoints()
 
-        data['relations'] = ql.process_query(sqg.get_public_abstraction_relation('owl:ObjectProperty'),lEndp)
-        data['relations'] += ql.process_query(sqg.get_user_abstraction_relation('owl:ObjectProperty'),lEndp)
-        data['subclassof'] = ql.process_query(sqg.get_isa_relation_entities(),lEndp)
-        data['entities'] = ql.process_query(sqg.get_public_abstraction_entity(),lEndp)
-        data['entities'] += ql.process_query(sqg.get_user_abstraction_entity(),lEndp)
-        data['attributes'] = ql.process_query(sqg.get_public_abstraction_attribute_entity(),lEndp)
-        data['attributes'] += ql.process_query(sqg.get_user_abstraction_attribute_entity(),lEndp)
-        data['categories'] = ql.process_query(sqg.get_public_abstraction_category_entity(),lEndp)
-        data['categories'] += ql.process_query(sqg.get_user_abstraction_category_entity(),lEndp)
-        data['positionable'] = ql.process_query(sqg.get_abstraction_positionable_entity(),lEndp)
         data['endpoints'] = sqg.getGraphUser()
         data['endpoints_ext'] = sqg.getExternalServiceEndpoint()
 
+        snapshot = None
+        store = AbstractionSnapshot.get_store(self)
+        if store is not None:
+            graphs = data['endpoints'].get(self.get_param("askomics.endpoint"), {})
+            graphs = graphs.get('private', []) + graphs.get('public', [])
+            snapshot = store.merge(graphs)
+            if snapshot is None:
+                # queried below this time, merged from the snapshots once written
+                store.start_backfill(graphs, self.settings, self.session)
+
+        if snapshot is None:
+            data.update(self.query_abstraction(sqg, ql, lEndp))
+        else:
+            self.log.debug("abstraction of the local graphs from their snapshots")
+            data.update(snapshot)
+            if lEndp:
+                # the other endpoints have no snapshot
+                for facet, rows in self.query_abstraction(sqg, ql, lEndp, local=False).items():
+                    data[facet] += rows
+
         self.log.debug("============== ENDPOINTS AND GRAPH =====================================")
         self.log.debug(data['endpoints'])
         return data
 
-    def build_recursive_block(self, tabul, constraints):
+    def get_abstraction_version(self):
+        """
+        Get the version tag of the abstraction and the start points of the user.
+        It changes with the graphs visible by the user, the data version of the
+        local graphs (see GraphAccessCache.version) and the active endpoints,
+        whose data change without notice: their tag expires with the graphs cache.
+        """
+        sqb = SparqlQueryBuilder(self.settings, self.session)
+        em = EndpointManager(self.settings, self.session)
+        cache = GraphAccessCache.get_cache(self)
+        endpoints = em.list_active_endpoints()
+
+        version = {
+            'user': [self.session['username'], self.session['admin']],
+            'askomics': ASKOMICS_VERSION,
+            'data': cache.version(),
+            'graphs': sqb.getGraphUser(),
+            'endpoints': [[es['id'], es['endpoint']] for es in endpoints]
+        }
+        if endpoints:
+            version['period'] = int(time.time() // max(1, cache.ttl))
+
+        return hashlib.sha1(json.dumps(version, sort_keys=True).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def query_abstraction(cls, sqg, ql, lEndp, local=True):
+        """
+        Query the facets of the abstraction on the endpoints (and the local
+        triplestore unless local is False), in a single query per endpoint
+        """
+        return cls.group_abstraction(ql.process_query(sqg.get_user_abstraction(), lEndp, local=local))
+
+    @staticmethod
+    def group_abstraction(rows):
+        """Group the rows of SparqlQueryGraph.get_user_abstraction by facet: {facet: [rows without ?facet]}"""
+
+        data = {facet: [] for facet in AbstractionSnapshot.FACETS}
+        for row in rows:
+            row = dict(row)
+            facet = row.pop('facet', None)
+            if facet in data:
+                data[facet].append(row)
+        return data
+
+    def build_recursive_block(self, tabul, constraints, graphs=None, estimate=None):
         """
         build SPARQL Block following this grammar :
         B ==> [ A , KEYWORKD ] . KEYWORKD is a string prefix for BLOCK (ex: OPTIONAL, SERVICE)
         A ==> [ ((B|F),)+ ] . a list of Block or constraints leafs
         F ==> [ CONSTRAINT1, CONSTRAINT2,.... ] an array contains only constraints
-        """
-        if len(constraints) == 2 and isinstance(
-                constraints[0], list) and isinstance(constraints[1], str):
-            return tabul + constraints[1] + "{\n" + self.build_recursive_block(
-                tabul + '\t', constraints[0]) + tabul + "}\n"
-        else:
-            req = ""
-            for elt in constraints:
-                if isinstance(elt, str):
-                    req += tabul + elt + ".\n"
-                elif len(elt) == 2 and isinstance(elt[0], list) and isinstance(
-                        elt[1], str):
-                    if elt[1] != "":
-                        req += tabul + elt[1] + " {\n" + self.build_recursive_block(
-                            tabul + '\t', elt[0]) + tabul + "}\n"
-                    else:
-                        req += self.build_recursive_block(tabul, elt[0])
 
-                else:
-                    raise ValueError("build_recursive_block:: constraint malformed :"
-                                     + str(elt))
-            return req
-        return ""
+        The constraints are compiled in a SparqlAst.Block, and serialized in
+        its canonical order.
+        With graphs, each triple pattern is scoped by its own
+        GRAPH ?askomics_graphN { ... } VALUES ?askomics_graphN { graphs }
+        (not in the SERVICE blocks), the query needs no FROM clause.
+        With estimate (see get_pattern_estimate), the triple patterns are
+        ordered by their estimated number of results.
+        """
+        return Block.from_json(constraints).to_sparql(tabul, graphs, estimate=estimate)
 
-    def build_sparql_query_from_json(self,list_endpoints, typeEndpoints, fromgraphs, variates, constraintes_relations,limit, send_request_to_tps=True):
+    def get_pattern_estimate(self):
+        """
+        Get the function estimating the number of results of a triple pattern
+        on the local triplestore, None if askomics.reorder_patterns is not set
+        """
+        if not self.is_defined("askomics.reorder_patterns") or \
+           self.get_param("askomics.reorder_patterns").lower() not in ('ok', 'true'):
+            return None
+
+        estimator = CardinalityEstimator.get_estimator(self)
+        # in the background, the previous counts are used meanwhile
+        estimator.refresh(self.settings, self.session)
+        prefixes = dict(self.ASKOMICS_prefix)
+        return lambda pattern, bound: estimator.estimate(pattern, bound, prefixes)
+
+    def is_local_query(self, list_endpoints, typeEndpoints):
+        """Check if a query is sent to the local triplestore only"""
+        return len(list_endpoints) == 0 or (
+            len(list_endpoints) == 1 and typeEndpoints[0] == 'askomics' and
+            list_endpoints[0] == self.get_param("askomics.endpoint"))
+
+    def build_sparql_query_from_json(self,list_endpoints, typeEndpoints, fromgraphs, variates, constraintes_relations,limit, send_request_to_tps=True, offset=0, count=False, timeout=None, stream=False):
         """
         Build a sparql query from JSON constraints
+        With a limit > 0, the query gets the limit first results, or the limit
+        results from offset ordered by the variates so that the pages are stable
+        (the triplestore sorts all the results for it).
+        With count, the query counts the results instead (?count), see count_sparql_query_from_json.
+        With timeout, the query is stopped after timeout seconds (QueryTimeout).
+        With stream, the results are an iterator (see QueryLauncher.process_query).
         """
         if len(typeEndpoints) != len(list_endpoints):
             self.log.warn("list_endpoints:"+str(list_endpoints))
@@ -146,11 +241,28 @@ class TripleStoreExplorer(ParamManager):
         select = ' '.join(variates)
 
         sqb = SparqlQueryBuilder(self.settings, self.session)
-        query = self.build_recursive_block('', constraintes_relations)
 
+        # the queries on many graphs of the local triplestore can be scoped
+        # without FROM clauses, see SparqlQueryBuilder.get_graph_scoping,
+        # unless a constraint can not be split in triples (Block.is_scopable)
+        local = self.is_local_query(list_endpoints, typeEndpoints)
+        scoped = bool(local and fromgraphs and
+                      sqb.get_graph_scoping(len(set(fromgraphs))) == 'values' and
+                      Block.from_json(constraintes_relations).is_scopable())
+
+        estimate = self.get_pattern_estimate() if local else None
+        query = self.build_recursive_block('', constraintes_relations,
+                                           fromgraphs if scoped else None, estimate)
+
+        post_action = None
+        if count:
+            select = "(COUNT(*) AS ?count)"
+            query = "{ SELECT DISTINCT " + ' '.join(variates) + " WHERE {\n" + query + "} }"
+        elif not isinstance(limit, bool) and limit is not None and int(limit) > 0:
+            post_action = "LIMIT " + str(int(limit))
+            if offset:
+                post_action = "ORDER BY " + select + "\n" + post_action + "\nOFFSET " + str(int(offset))
 
-        # if limit != None and limit > 0:
-        #     query += ' LIMIT ' + str(limit)
         self.log.debug("============ build_sparql_query_from_json ========")
         self.log.debug("type_endpoints:"+str(typeEndpoints))
         self.log.debug("endpoints:"+str(list_endpoints))
@@ -196,12 +308,223 @@ class TripleStoreExplorer(ParamManager):
 
 
                 query_launcher = FederationQueryLauncher(self.settings, self.session,lE)
-            req = sqb.custom_query(fromgraphs, select, query,externalrequest=extreq)
-            results = query_launcher.process_query(req)
+
+            if timeout is not None:
+                deadline = time.time() + timeout
+                if query_launcher.deadline is None or deadline < query_launcher.deadline:
+                    query_launcher.deadline = deadline
+            req = sqb.custom_query(fromgraphs, select, query,externalrequest=extreq,scoped=scoped,post_action=post_action)
+            results = query_launcher.process_query(req, stream=stream)
         else:
             results = []
 
-        return results, sqb.custom_query(fromgraphs, select, query),typeQuery
+        return results, sqb.custom_query(fromgraphs, select, query,scoped=scoped,post_action=post_action),typeQuery
+
+    def get_count_timeout(self):
+        """Get the seconds allowed to count the results of a user query (askomics.count_first_timeout)"""
+        timeout = 5.0
+        if self.is_defined("askomics.count_first_timeout"):
+            timeout = float(self.get_param("askomics.count_first_timeout"))
+        return timeout
+
+    def get_count_first_timeout(self):
+        """Get the seconds allowed to count the results of a user query before it, None if they are not counted"""
+        if not self.is_defined("askomics.count_first") or \
+           self.get_param("askomics.count_first").lower() not in ('ok', 'true'):
+            return None
+        return self.get_count_timeout()
+
+    def get_count_first_max_rows(self):
+        """Get the number of results above which a counted query is not run, None if no limit"""
+        if self.is_defined("askomics.count_first_max_rows"):
+            max_rows = int(self.get_param("askomics.count_first_max_rows"))
+            if max_rows > 0:
+                return max_rows
+        return None
+
+    def count_sparql_query_from_json(self, list_endpoints, typeEndpoints, fromgraphs, variates, constraintes_relations, timeout):
+        """
+        Count the results of a query from JSON constraints, before running it
+        :param timeout: the count is given up after timeout seconds
+        :return: the number of results, None if it was not counted in time
+        """
+        try:
+            results, query, typeQuery = self.build_sparql_query_from_json(
+                list_endpoints, typeEndpoints, fromgraphs, variates, constraintes_relations,
+                -1, count=True, timeout=timeout)
+        except (QueryTimeout, requests.exceptions.RequestException) as e:
+            self.log.info("results not counted: %s", e)
+            return None
+
+        if len(results) == 0 or 'count' not in results[0]:
+            return None
+        return int(results[0]['count'])
+
+    def explain_sparql_query_from_json(self, list_endpoints, typeEndpoints, fromgraphs, variates, constraintes_relations):
+        """
+        Explain a query built from JSON constraints: its text, the order and
+        the estimates of its patterns, its time and the execution plan of the
+        local triplestore when it gives one (see QueryLauncher.explain_query)
+        """
+        results, query, typeQuery = self.build_sparql_query_from_json(list_endpoints, typeEndpoints, fromgraphs,
+                                                                      variates, constraintes_relations, -1,
+                                                                      send_request_to_tps=False)
+
+        local = self.is_local_query(list_endpoints, typeEndpoints)
+        estimate = self.get_pattern_estimate() if local else None
+        explanation = {
+            'query': query,
+            'patterns': Block.from_json(constraintes_relations).plan(estimate)
+        }
+
+        if local:
+            ql = QueryLauncher(self.settings, self.session)
+            explanation.update(ql.explain_query(query))
+        else:
+            time0 = time.time()
+            results, query, typeQuery = self.build_sparql_query_from_json(list_endpoints, typeEndpoints, fromgraphs,
+                                                                          variates, constraintes_relations, -1)
+            explanation.update({'time': time.time() - time0, 'nrows': len(results),
+                                'plan': None, 'plan_source': None})
+
+        return explanation
+
+    @staticmethod
+    def get_request_fingerprint(body):
+        """Get the fingerprint of the query of a sparqlquery request, whatever its page"""
+        request = {key: body.get(key) for key in ('endpoints', 'type_endpoints', 'graphs', 'variates',
+                                                  'constraintesRelations', 'from', 'removeGraph', 'limit')}
+        return hashlib.sha1(json.dumps(request, sort_keys=True).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def make_page_token(fingerprint, offset, filename=None, count=None):
+        """
+        Get the token of the page starting at offset of a request, with the
+        csv file reserved and the number of results given by its first page
+        """
+        token = json.dumps({'query': fingerprint, 'offset': offset, 'file': filename, 'count': count})
+        return base64.urlsafe_b64encode(token.encode('utf-8')).decode('ascii')
+
+    @classmethod
+    def read_page_token(cls, token, fingerprint):
+        """
+        Read a page token, which must come from the same request:
+        {'offset': int, 'file': csv file name or None, 'count': int or None}
+        """
+        try:
+            page = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+            offset = int(page['offset'])
+            count = None if page.get('count') is None else int(page['count'])
+        except (ValueError, TypeError, KeyError) as e:
+            raise ValueError("Invalid page token: " + str(e))
+
+        if page.get('query') != fingerprint or offset < 0:
+            raise ValueError("The page token does not belong to this query")
+        filename = page.get('file')
+        if filename is not None and not cls.RE_CSV_NAME.match(str(filename)):
+            raise ValueError("Invalid page token: bad file name")
+        return {'offset': offset, 'file': filename, 'count': count}
+
+    def save_results_request(self, body, first_rows=None):
+        """
+        Reserve the csv file of the results of a sparqlquery request, without
+        querying them: the request is saved beside, the file is written on its
+        first use (see get_results_csv)
+        :param first_rows: the results of the first page, the file starts with them
+        """
+        filename = QueryLauncher.get_results_csv_name()
+        request = {key: body.get(key) for key in ('endpoints', 'type_endpoints', 'graphs',
+                                                  'variates', 'constraintesRelations')}
+        request['first_rows'] = [dict(row) for row in first_rows or []]
+        with open(self.get_user_csv_directory() + filename + '.json', 'w') as request_file:
+            json.dump(request, request_file)
+        return filename
+
+    def get_results_csv(self, filename):
+        """
+        Get the path of a csv file of results, writing it if it was only reserved.
+        A file is written by one request at a time (its .lock marker), the
+        others wait for it.
+        """
+
+        path = self.get_user_csv_directory() + filename
+        request_path = path + '.json'
+        if os.path.isfile(path) or not os.path.isfile(request_path):
+            return path
+
+        marker = path + '.lock'
+        if not self.acquire_csv_marker(marker):
+            # written by another request
+            deadline = time.time() + self.CSV_WRITE_MAX_TIME
+            while os.path.isfile(marker) and not os.path.isfile(path) and time.time() < deadline:
+                time.sleep(self.CSV_WAIT_INTERVAL)
+            return path
+
+        try:
+            if os.path.isfile(path) or not os.path.isfile(request_path):
+                return path
+
+            with open(request_path) as request_file:
+                request = json.load(request_file)
+
+            results, query, typeQuery = self.build_sparql_query_from_json(
+                request['endpoints'], request['type_endpoints'], request['graphs'],
+                request['variates'], request['constraintesRelations'], -1, stream=True)
+
+            headers = [variate.lstrip('?$') for variate in request['variates']]
+            rows = self.iter_results_after(request.get('first_rows') or [], results, headers)
+            query_launcher = QueryLauncher(self.settings, self.session)
+            query_launcher.format_results_csv(rows, filename, headers)
+            os.remove(request_path)
+        finally:
+            os.remove(marker)
+        return path
+
+    @staticmethod
+    def iter_results_after(first_rows, results, headers):
+        """Iterate over the first rows, then over the other results (distinct rows)"""
+        first = set()
+        for row in first_rows:
+            first.add(tuple(row.get(header) for header in headers))
+            yield row
+        for row in results:
+            if tuple(row.get(header) for header in headers) not in first:
+                yield row
+
+    def read_results_page(self, filename, offset, limit):
+        """
+        Read the limit results from offset of a csv file of results, writing
+        it if it was only reserved (see get_results_csv)
+        """
+        results = None
+        with open(self.get_results_csv(filename), newline='') as csv_file:
+            reader = csv.reader(csv_file, delimiter='\t')
+            for index, row in enumerate(reader):
+                if results is None:
+                    results = ResultSet(variables=row)
+                    headers = row
+                elif index > offset + limit:
+                    break
+                elif index > offset:
+                    # the unbound variables are empty in the file
+                    results.append({header: value for header, value in zip(headers, row) if value != ''})
+        return results if results is not None else ResultSet()
+
+    def acquire_csv_marker(self, marker):
+        """Create the marker of a csv file being written, False if it exists"""
+        for attempt in range(2):
+            try:
+                os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    # left by a request which did not end
+                    if time.time() - os.stat(marker).st_mtime < self.CSV_WRITE_MAX_TIME:
+                        return False
+                    os.remove(marker)
+                except OSError:
+                    pass
+        return False
 
     def get_prefix_uri(self):
         sqg = SparqlQueryGraph(self.settings, self.session)
@@ -0,0 +1,190 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+
+from askomics.libaskomics.rdfdb.SparqlQueryGraph import SparqlQueryGraph
+from askomics.libaskomics.rdfdb.QueryLauncher import QueryLauncher
+
+class AbstractionSnapshot(object):
+    """
+    The AbstractionSnapshot keeps the abstraction of each graph of the local
+    triplestore (the facets of TripleStoreExplorer.getUserAbstraction) in a
+    json file, so that opening the query builder does not query it again:
+        - the snapshot of a graph is written once its data are integrated
+          (see SourceFile.persist), and deleted with the graph,
+        - merge() gets the abstraction of the graphs visible by a user from
+          their snapshots, kept in memory until their file changes,
+        - start_backfill() writes in the background the snapshots missing,
+          e.g. of the graphs integrated before the snapshots existed.
+    A store is shared by all the requests of the process (see get_store).
+    """
+
+    FACETS = ('relations', 'entities', 'attributes', 'categories', 'subclassof', 'positionable')
+
+    _stores = {}
+    _stores_lock = threading.Lock()
+
+    def __init__(self, directory):
+        self.log = logging.getLogger(__name__)
+        self.directory = directory
+
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self._running = False
+
+    @classmethod
+    def get_store(cls, param_manager):
+        """Get the store of the process for the settings of a ParamManager, None if the snapshots are disabled"""
+
+        if param_manager.is_defined("askomics.abstraction_snapshots") and \
+           param_manager.get_param("askomics.abstraction_snapshots").lower() not in ('ok', 'true'):
+            return None
+        if not param_manager.is_defined("askomics.files_dir"):
+            return None
+
+        directory = os.path.join(param_manager.get_param("askomics.files_dir"), "abstraction")
+        with cls._stores_lock:
+            if directory not in cls._stores:
+                cls._stores[directory] = cls(directory)
+            return cls._stores[directory]
+
+    def get_path(self, graph):
+        return os.path.join(self.directory, hashlib.sha1(graph.encode('utf-8')).hexdigest() + '.json')
+
+    @staticmethod
+    def build(graph, settings, session):
+        """Query the abstraction of a graph: {facet: [rows]}"""
+
+        sqg = SparqlQueryGraph(settings, session)
+        ql = QueryLauncher(settings, session)
+
+        snapshot = {}
+        for facet, query in sqg.get_graph_abstraction(graph).items():
+            snapshot[facet] = [dict(row) for row in ql.process_query(query)]
+        return snapshot
+
+    def save(self, graph, settings, session):
+        """Write the snapshot of a graph, return False if it could not be built"""
+
+        path = self.get_path(graph)
+        try:
+            snapshot = self.build(graph, settings, session)
+
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', dir=self.directory, delete=False, suffix='.tmp') as tmp_file:
+                json.dump({'graph': graph, 'abstraction': snapshot}, tmp_file)
+            os.replace(tmp_file.name, path)
+        except Exception as e:
+            # getUserAbstraction queries the triplestore for this graph
+            self.log.warning("abstraction snapshot of %s not written: %s", graph, e)
+            self.delete(graph)
+            return False
+
+        with self._lock:
+            self._snapshots[path] = (os.stat(path).st_mtime, snapshot)
+        self.log.debug("abstraction snapshot of %s written", graph)
+        return True
+
+    def delete(self, graph):
+        """Delete the snapshot of a graph"""
+
+        path = self.get_path(graph)
+        with self._lock:
+            self._snapshots.pop(path, None)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def load(self, graph):
+        """Get the snapshot of a graph, None if there is none"""
+
+        path = self.get_path(graph)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+
+        with self._lock:
+            cached = self._snapshots.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        try:
+            with open(path) as snapshot_file:
+                content = json.load(snapshot_file)
+        except (OSError, ValueError) as e:
+            self.log.warning("abstraction snapshot of %s not read: %s", graph, e)
+            return None
+        if content.get('graph') != graph:
+            return None
+
+        snapshot = content['abstraction']
+        with self._lock:
+            self._snapshots[path] = (mtime, snapshot)
+        return snapshot
+
+    def missing(self, graphs):
+        """Get the graphs without snapshot"""
+
+        return [graph for graph in sorted(set(graphs)) if self.load(graph) is None]
+
+    def start_backfill(self, graphs, settings, session):
+        """Write the missing snapshots of graphs in a background thread, return False if one is running"""
+
+        with self._lock:
+            if self._running:
+                return False
+            self._running = True
+
+        # the session of the request is not used after it
+        session = dict(session)
+
+        def run():
+            try:
+                count = 0
+                for graph in self.missing(graphs):
+                    if self.save(graph, settings, session):
+                        count += 1
+                self.log.info("abstraction snapshots of %d graphs written", count)
+            finally:
+                with self._lock:
+                    self._running = False
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def merge(self, graphs):
+        """
+        Get the abstraction of graphs from their snapshots, None if a graph has none.
+        The subclasses are kept between the entities of the graphs only.
+        """
+        abstraction = {facet: [] for facet in self.FACETS}
+        for graph in sorted(set(graphs)):
+            snapshot = self.load(graph)
+            if snapshot is None:
+                return None
+            for facet in self.FACETS:
+                abstraction[facet].extend(dict(row) for row in snapshot.get(facet, []))
+
+        entities = {row['entity'] for row in abstraction['entities']}
+        subclassof = [row for row in abstraction['subclassof']
+                      if row.get('uri') in entities and row.get('urisub') in entities]
+
+        # these facets are not per graph, keep them distinct
+        for facet, rows in (('subclassof', subclassof), ('positionable', abstraction['positionable'])):
+            distinct = {}
+            for row in rows:
+                distinct.setdefault(tuple(sorted(row.items())), row)
+            abstraction[facet] = list(distinct.values())
+
+        return abstraction
+
+    def __len__(self):
+        return len(self._snapshots)
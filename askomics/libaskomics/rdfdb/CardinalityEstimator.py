@@ -0,0 +1,177 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import logging
+import threading
+
+from askomics.libaskomics.rdfdb.SparqlAst import Pattern
+from askomics.libaskomics.rdfdb.SparqlQueryStats import SparqlQueryStats
+from askomics.libaskomics.rdfdb.QueryLauncher import QueryLauncher
+
+class CardinalityEstimator(object):
+    """
+    The CardinalityEstimator estimates the number of solutions of a triple
+    pattern, to reorder the patterns of the queries (see SparqlAst.Block.to_sparql)
+    for the triplestores which evaluate them in the written order:
+        - the number of instances of each class and the number of triples,
+          subjects and objects of each predicate come from SparqlQueryStats,
+        - they are refreshed after ttl seconds, in a background thread started
+          by the first request seeing them expired, the requests use the
+          previous counts meanwhile (no counts at first: the patterns keep
+          their order).
+    An estimator is shared by all the requests of the process (see get_estimator).
+    """
+
+    TYPE_PREDICATES = ('a', 'rdf:type', '<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>')
+
+    _estimators = {}
+    _estimators_lock = threading.Lock()
+
+    def __init__(self, ttl=3600):
+        self.log = logging.getLogger(__name__)
+        self.ttl = ttl
+        self.updated = None
+
+        self.total = 0
+        self.classes = {}
+        self.predicates = {}
+
+        self._refresh_lock = threading.Lock()
+
+    @classmethod
+    def get_estimator(cls, param_manager):
+        """Get the estimator of the process for the endpoint of a ParamManager"""
+
+        endpoint = param_manager.get_param("askomics.endpoint")
+
+        ttl = 3600
+        if param_manager.is_defined("askomics.reorder_patterns_ttl"):
+            ttl = float(param_manager.get_param("askomics.reorder_patterns_ttl"))
+
+        with cls._estimators_lock:
+            if endpoint not in cls._estimators:
+                cls._estimators[endpoint] = cls(ttl)
+            estimator = cls._estimators[endpoint]
+        estimator.ttl = ttl
+        return estimator
+
+    def is_expired(self):
+        return self.updated is None or time.time() - self.updated >= self.ttl
+
+    def refresh(self, settings, session, force=False, background=True):
+        """
+        Query the counts again if they expired, in a background thread unless
+        background is False. Return False if they are being refreshed already.
+        """
+
+        if not force and not self.is_expired():
+            return True
+        if not self._refresh_lock.acquire(blocking=False):
+            # another request is refreshing them
+            return False
+
+        if not background:
+            self._refresh(settings, session)
+            return True
+
+        # the session of the request is not used after it
+        thread = threading.Thread(target=self._refresh, args=(settings, dict(session)), daemon=True)
+        try:
+            thread.start()
+        except Exception:
+            self._refresh_lock.release()
+            raise
+        return True
+
+    def _refresh(self, settings, session):
+        """Query the counts, the refresh lock is held and released"""
+
+        try:
+            sqs = SparqlQueryStats(settings, session)
+            ql = QueryLauncher(settings, session)
+
+            classes = {}
+            for row in ql.process_query(sqs.get_class_cardinalities()):
+                classes[row['class']] = int(row['count'])
+
+            predicates = {}
+            for row in ql.process_query(sqs.get_predicate_cardinalities()):
+                predicates[row['predicate']] = (int(row['count']), int(row['subjects']), int(row['objects']))
+
+            self.set_counts(classes, predicates)
+        except Exception as e:
+            # the queries are still sent, in the previous order
+            self.log.warning("pattern statistics not refreshed: %s", e)
+            self.updated = time.time()
+        finally:
+            self._refresh_lock.release()
+
+    def set_counts(self, classes, predicates):
+        """
+        Set the counts
+        :param classes: {class uri: number of instances}
+        :param predicates: {predicate uri: (number of triples, of subjects, of objects)}
+        """
+        self.classes = classes
+        self.predicates = predicates
+        self.total = sum(count for count, subjects, objects in predicates.values())
+        self.updated = time.time()
+        self.log.debug("pattern statistics: %d classes, %d predicates", len(classes), len(predicates))
+
+    @staticmethod
+    def expand(term, prefixes):
+        """Get the uri of an IRI or a prefixed name, None for the variables and literals"""
+        if term.startswith('<') and term.endswith('>'):
+            return term[1:-1]
+        if term[0] in '?$"\'' or ':' not in term:
+            return None
+        prefix, name = term.split(':', 1)
+        if prefix not in prefixes:
+            return None
+        return prefixes[prefix] + name
+
+    def estimate(self, pattern, bound=(), prefixes=None):
+        """
+        Estimate the number of solutions of a triple pattern
+        :param bound: the variables bound by the patterns evaluated before
+        :param prefixes: {prefix: namespace} of the prefixed names of the pattern
+        :return: the estimate, None without statistics
+        """
+        if not self.predicates:
+            return None
+        prefixes = prefixes or {}
+
+        terms = Pattern.RE_TOKEN.findall(pattern)
+        if len(terms) != 3:
+            return self.total
+
+        subject, predicate, obj = terms
+
+        def is_bound(term):
+            return term[0] not in '?$' or term in bound
+
+        if predicate in self.TYPE_PREDICATES:
+            if is_bound(subject):
+                return 1
+            uri = self.expand(obj, prefixes)
+            if uri is not None:
+                return self.classes.get(uri, 0)
+            return sum(self.classes.values())
+
+        if not is_bound(predicate):
+            count, subjects, objects = self.total, 1, 1
+        else:
+            uri = self.expand(predicate, prefixes)
+            if uri is None:
+                # bound by another pattern
+                count, subjects, objects = self.total // max(1, len(self.predicates)), 1, 1
+            else:
+                count, subjects, objects = self.predicates.get(uri, (0, 1, 1))
+
+        if is_bound(subject) and is_bound(obj):
+            return min(count, 1)
+        if is_bound(subject):
+            return count / max(1, subjects)
+        if is_bound(obj):
+            return count / max(1, objects)
+        return count
@@ -50,9 +50,10 @@ class FederationQueryLauncher(QueryLauncher):
         self.auth = 'Basic'
         self.allowUpdate = False
 
-    def process_query(self, query):
+    def process_query(self, query, stream=False):
         '''
             Execute query and parse the results if exist
+            With stream=True, return an iterator over the results instead of a list
         '''
         self.log.debug("================================================================================")
         self.log.debug(" =================== Federation Request : process_query  ====================")
@@ -61,5 +62,7 @@ class FederationQueryLauncher(QueryLauncher):
         # Federation Request case
         #------------------------------------------------------
         query = self.commentsForFed + query
-        json_query = self._execute_query(query,log_raw_results=False)
+        json_query = self._execute_query(query,log_raw_results=False,coalesce=not stream)
+        if stream:
+            return self.iter_results(json_query)
         return self.parse_results(json_query)
@@ -0,0 +1,135 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import copy
+import time
+import uuid
+import logging
+import tempfile
+import threading
+
+class GraphAccessCache(object):
+    """
+    The GraphAccessCache keeps the graphs visible by each user (the map of
+    SparqlQueryBuilder.getGraphUser), so that a user query does not first
+    query every endpoint to know its FROM graphs, and the external services
+    they describe (SparqlQueryBuilder.getExternalServiceEndpoint):
+        - invalidate() drops all the entries. It must be called when a graph
+          is created or deleted, when its access level changes, or when an
+          endpoint is added or removed,
+        - invalidate() also rewrites a version file shared by the processes,
+          the other processes drop their entries when they see it changed,
+        - entries expire after ttl seconds, as the public graphs of the other
+          AskOmics endpoints change without notice.
+    A cache is shared by all the SparqlQueryBuilder of the process (see get_cache).
+    """
+
+    _caches = {}
+    _caches_lock = threading.Lock()
+
+    def __init__(self, version_path=None, ttl=300):
+        self.log = logging.getLogger(__name__)
+        self.version_path = version_path
+        self.ttl = ttl
+        self.generation = 0
+
+        self._entries = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_cache(cls, param_manager):
+        """Get the cache of the process for the settings of a ParamManager"""
+
+        version_path = None
+        if param_manager.is_defined("askomics.files_dir"):
+            version_path = os.path.join(param_manager.get_param("askomics.files_dir"), "graph_acl.version")
+
+        ttl = 300
+        if param_manager.is_defined("askomics.graph_acl_ttl"):
+            ttl = float(param_manager.get_param("askomics.graph_acl_ttl"))
+
+        with cls._caches_lock:
+            if version_path not in cls._caches:
+                cls._caches[version_path] = cls(version_path, ttl)
+            cache = cls._caches[version_path]
+        cache.ttl = ttl
+        return cache
+
+    def _read_version(self):
+        if self.version_path is None:
+            return None
+        try:
+            with open(self.version_path) as version_file:
+                return version_file.read()
+        except OSError:
+            return None
+
+    def version(self):
+        """Get the version shared by the processes: it changes at each invalidate, None before the first one"""
+        return self._read_version()
+
+    def stamp(self):
+        """
+        Get the state of the cache, to give to put once the graphs are known.
+        The entries of the other processes are dropped if they changed a graph.
+        """
+        version = self._read_version()
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            return (version, self.generation)
+
+    def get(self, key):
+        """Get a copy of the graphs of a key, None if they are not cached"""
+
+        self.stamp()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, graphs = entry
+            if expires <= time.time():
+                del self._entries[key]
+                return None
+            return copy.deepcopy(graphs)
+
+    def put(self, key, graphs, stamp):
+        """
+        Store the graphs of a key
+        :param stamp: the stamp read before querying the graphs,
+                      nothing is stored if a graph was changed since
+        """
+        if self.ttl <= 0 or self.stamp() != stamp:
+            return False
+
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, copy.deepcopy(graphs))
+        return True
+
+    def invalidate(self):
+        """Drop the entries of all the processes"""
+
+        version = None
+        if self.version_path is not None:
+            version = uuid.uuid4().hex
+            try:
+                directory = os.path.dirname(self.version_path) or '.'
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                with tempfile.NamedTemporaryFile('w', dir=directory, delete=False, suffix='.tmp') as tmp_file:
+                    tmp_file.write(version)
+                os.replace(tmp_file.name, self.version_path)
+            except OSError as e:
+                self.log.warning("graph access version %s not written: %s", self.version_path, e)
+
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._version = version
+
+        self.log.debug("graph access cache invalidated")
+
+    def __len__(self):
+        return len(self._entries)
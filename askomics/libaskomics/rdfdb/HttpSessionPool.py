@@ -0,0 +1,134 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import socket
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+class HttpSessionPool(object):
+    """
+    The HttpSessionPool keeps one requests.Session per endpoint configuration
+    (url, credentials, proxy) for the whole worker process.
+        - Each session owns a keep-alive connection pool of pool_size connections,
+          so consecutive SPARQL calls do not pay a new TCP/TLS handshake.
+        - A session unused for more than idle_timeout seconds is closed and
+          rebuilt on the next call, the server has probably dropped its sockets.
+        - Proxy and auth settings are set on the session by the setup callback,
+          nothing is installed on the process-global urllib opener.
+    """
+
+    def __init__(self):
+        self.log = logging.getLogger(__name__)
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get_session(self, key, setup, pool_size=10, idle_timeout=60):
+        """Return the session associated to key, create it if needed
+
+        :param key: hashable identifier of the endpoint configuration
+        :param setup: callable receiving the new session to set proxies and auth
+        :param pool_size: maximum number of keep-alive connections to the endpoint
+        :param idle_timeout: number of seconds after which an unused session is dropped
+        :returns: the pooled session
+        :rtype: requests.Session
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is not None and now - entry[1] > idle_timeout:
+                self.log.debug("drop idle http session for %s", key[0])
+                entry[0].close()
+                entry = None
+
+            if entry is None:
+                self.log.debug("new http session for %s", key[0])
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                setup(session)
+            else:
+                session = entry[0]
+
+            self._sessions[key] = (session, now)
+
+        return session
+
+    @staticmethod
+    def get_abortable_session(session):
+        """
+        Get a session for a single request, with the settings of a pooled session
+        and an AbortableAdapter: return (session, adapter), the adapter being None
+        if session is not a requests.Session (then it is returned as is)
+        """
+        if not isinstance(session, requests.Session):
+            return session, None
+
+        call = requests.Session()
+        for attr in ('auth', 'proxies', 'headers', 'verify', 'cert', 'trust_env'):
+            setattr(call, attr, getattr(session, attr))
+        adapter = AbortableAdapter()
+        call.mount('http://', adapter)
+        call.mount('https://', adapter)
+        return call, adapter
+
+    def close(self):
+        """Close all the pooled sessions"""
+        with self._lock:
+            for session, last_use in self._sessions.values():
+                session.close()
+            self._sessions = {}
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class AbortableAdapter(HTTPAdapter):
+    """
+    An adapter whose connections can be closed from another thread: abort()
+    shuts down their sockets, the request waiting for the response fails at
+    once and the server sees the client is gone.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._connections = []
+        self._aborted = False
+        self._connections_lock = threading.Lock()
+        HTTPAdapter.__init__(self, *args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+
+        adapter = self
+        pool_classes = {}
+        for scheme, pool_class in self.poolmanager.pool_classes_by_scheme.items():
+            def new_conn(pool, pool_class=pool_class):
+                return adapter.track(pool_class._new_conn(pool))
+            pool_classes[scheme] = type('Abortable' + pool_class.__name__, (pool_class,), {'_new_conn': new_conn})
+        self.poolmanager.pool_classes_by_scheme = pool_classes
+
+    def track(self, connection):
+        """Keep a new connection to close it on abort"""
+        with self._connections_lock:
+            if self._aborted:
+                raise requests.exceptions.ConnectionError("The request was aborted.")
+            self._connections.append(connection)
+        return connection
+
+    def abort(self):
+        """Close the connections opened by the adapter, now"""
+        with self._connections_lock:
+            self._aborted = True
+            connections, self._connections = self._connections, []
+
+        for connection in connections:
+            sock = getattr(connection, 'sock', None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            connection.close()
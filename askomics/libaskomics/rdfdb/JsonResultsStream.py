@@ -0,0 +1,141 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import codecs
+import logging
+
+class JsonResultsStream(object):
+    """
+    The JsonResultsStream reads a SPARQL 1.1 JSON results document
+    (application/sparql-results+json) incrementally:
+        - the body is read chunk by chunk from the http response,
+        - each binding is decoded and yielded as a {variable: value} dict,
+          only the current chunk and the current binding are kept in memory.
+    The variable names of the "head" part are available in vars once read
+    (the head comes before the results in all the triplestores we know).
+    The stream can be iterated only once.
+    """
+
+    def __init__(self, chunks, response=None):
+        """
+        :param chunks: iterable of bytes (or str) chunks of the document
+        :param response: the http response to close at the end of the iteration
+        """
+        self.log = logging.getLogger(__name__)
+        self.vars = []
+        self.boolean = None
+
+        self._chunks = iter(chunks)
+        self._response = response
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    @classmethod
+    def from_response(cls, response, chunk_size=65536):
+        """Build a stream on a requests response opened with stream=True"""
+        return cls(response.iter_content(chunk_size=chunk_size), response)
+
+    def close(self):
+        """Release the http connection"""
+        self._eof = True
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+    def __iter__(self):
+        try:
+            if self._next_char() is None:
+                return
+            self._expect('{')
+            while self._next_char() != '}':
+                key = self._read_key()
+                if key == 'results':
+                    yield from self._iter_results()
+                else:
+                    value = self._read_value()
+                    if key == 'head':
+                        self.vars = value.get('vars', [])
+                    elif key == 'boolean':
+                        self.boolean = value
+                self._skip_comma()
+        finally:
+            self.close()
+
+    def _iter_results(self):
+        self._expect('{')
+        while self._next_char() != '}':
+            key = self._read_key()
+            if key == 'bindings':
+                self._expect('[')
+                while self._next_char() != ']':
+                    entry = self._read_value()
+                    yield {
+                        sparql_variable: entry[sparql_variable]["value"]
+                        for sparql_variable in entry.keys()
+                    }
+                    self._skip_comma()
+                self._expect(']')
+            else:
+                self._read_value()
+            self._skip_comma()
+        self._expect('}')
+
+    def _fill(self):
+        """Read the next chunk, return False at the end of the document"""
+        if self._eof:
+            return False
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._eof = True
+            return False
+        if isinstance(chunk, bytes):
+            chunk = self._utf8.decode(chunk)
+        # drop the consumed part of the buffer
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _next_char(self):
+        """Skip the whitespaces and return the next significant char (None at the end)"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\n\r':
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return None
+
+    def _expect(self, char):
+        if self._next_char() != char:
+            raise ValueError("Malformed SPARQL JSON results: '" + char + "' expected at: " +
+                             self._buffer[self._pos:self._pos+50])
+        self._pos += 1
+
+    def _skip_comma(self):
+        if self._next_char() == ',':
+            self._pos += 1
+
+    def _read_value(self):
+        """Decode the next JSON value, reading more chunks until it is complete"""
+        self._next_char()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # a number may continue in the next chunk
+            if end == len(self._buffer) and not isinstance(value, (dict, list, str)) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _read_key(self):
+        key = self._read_value()
+        self._expect(':')
+        return key
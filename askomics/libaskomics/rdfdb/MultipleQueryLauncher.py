@@ -4,12 +4,13 @@ import os, time, tempfile
 import re
 import csv
 from pprint import pformat
-from SPARQLWrapper import SPARQLWrapper, JSON
 import requests
 import logging
-import urllib.request
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 
 from askomics.libaskomics.rdfdb.QueryLauncher import QueryLauncher
+from askomics.libaskomics.rdfdb.ResultSet import ResultSet
 
 class MultipleQueryLauncher(QueryLauncher):
     """
@@ -21,54 +22,83 @@ class MultipleQueryLauncher(QueryLauncher):
         QueryLauncher.__init__(self, settings, session)
         self.log = logging.getLogger(__name__)
         self.log.debug(" =================== Multiple Query Lancher Request ====================")
+        self.unreachable_endpoints = []
 
-    def process_query(self,query,lendpoints,indexByEndpoint=False):
+    def get_endpoint_launcher(self, es):
+        """
+            Get a QueryLauncher on an askomics endpoint defined by the user
+        """
+        if 'name' not in es :
+            raise ValueError("Devel error : define 'name' Attribute :"+str(es))
+        if 'endpoint' not in es :
+            raise ValueError("Devel error : define 'endpoint' Attribute :"+str(es))
+
+        auth = 'Basic'
+        if es.get('auth'):
+            # auth is stored in upper case in the endpoints table
+            auth = es['auth'].capitalize()
+
+        ql = QueryLauncher(self.settings, self.session,
+                           name=es['name'], endpoint=es['endpoint'],
+                           username=es.get('username'), password=es.get('password'),
+                           auth=auth)
+        ql.allowUpdate = False
+
+        return ql
+
+    def process_query(self,query,lendpoints,indexByEndpoint=False,stream=False,local=True):
         '''
             Execute query and parse the results if exist
+            The local askomics (unless local is False) and the endpoints of lendpoints
+            are queried concurrently, by at most askomics.endpoints_max_parallel threads.
+            With stream=True, the results of each endpoint are iterators, they
+            are chained together if they are not indexed by endpoint.
+            The endpoints that could not be reached are listed in unreachable_endpoints.
         '''
         self.log.debug("================================================================================")
         self.log.debug(" =================== MultipleQueryLauncher : process_query  ====================")
         self.log.debug("================================================================================")
         # Request on local Askomics
         self.setUserDatastore()
-        json_query = self._execute_query(query, log_raw_results=False)
-        if indexByEndpoint:
-            results = {}
-            results[self.endpoint] = self.parse_results(json_query)
-        else:
-            results = self.parse_results(json_query)
+        launchers = [(self, None)] if local else []
+        self.unreachable_endpoints = []
 
         # then other askomics endpoint defined by the user
         for es in lendpoints:
-            if 'name' not in es :
-                raise ValueError("Devel error : define 'name' Attribute :"+str(es))
-            if 'endpoint' not in es :
-                raise ValueError("Devel error : define 'endpoint' Attribute :"+str(es))
+            # the endpoints of the endpoints table have a circuit breaker
+            launchers.append((self.get_endpoint_launcher(es), es if 'id' in es else None))
 
-            self.log.debug(es['name']+"::"+es['endpoint'])
-            self.name = es['name']
-            self.endpoint = es['endpoint']
-            self.auth = 'Basic'
-            self.username = None
-            self.password = None
-            self.auth = 'Basic'
+        def run(launcher):
+            ql, externalService = launcher
+            self.log.debug(str(ql.name)+"::"+str(ql.endpoint))
+            json_query = ql._execute_query(query, log_raw_results=False,
+                                           externalService=externalService, coalesce=not stream)
+            if ql.unreachable:
+                self.unreachable_endpoints.append(ql.endpoint)
+            if stream:
+                return ql.endpoint, ql.iter_results(json_query)
+            return ql.endpoint, ql.parse_results(json_query)
 
-            if 'username' in es :
-                self.username = es['username']
-            if 'password' in es :
-                self.password = es['password']
-            if 'auth' in es :
-                self.auth = es['auth']
+        max_parallel = 8
+        if self.is_defined("askomics.endpoints_max_parallel"):
+            max_parallel = int(self.get_param("askomics.endpoints_max_parallel"))
 
-            self.urlupdate = None
-
-            self.allowUpdate = False
-
-            json_query = self._execute_query(query,log_raw_results=False)
+        if max_parallel > 1 and len(launchers) > 1:
+            with ThreadPoolExecutor(max_workers=min(max_parallel, len(launchers))) as executor:
+                # map keeps the endpoints order and raises the first error
+                lresults = list(executor.map(run, launchers))
+        else:
+            lresults = [run(ql) for ql in launchers]
 
-            if indexByEndpoint:
-                results[self.endpoint] = self.parse_results(json_query)
-            else:
-                results += self.parse_results(json_query)
+        if indexByEndpoint:
+            results = {}
+            for endpoint, result in lresults:
+                results[endpoint] = result
+        elif stream:
+            results = itertools.chain.from_iterable(result for endpoint, result in lresults)
+        else:
+            results = ResultSet()
+            for endpoint, result_set in lresults:
+                results.extend(result_set)
 
         return results
@@ -3,14 +3,24 @@
 import os, time, tempfile
 import re
 import csv
+import gzip
 from pprint import pformat
-from SPARQLWrapper import SPARQLWrapper, JSON
 import requests
+import urllib3
 import logging
-import urllib.request
+import threading
+import urllib.parse
+import uuid
+from pyramid.threadlocal import get_current_request
 
 from askomics.libaskomics.ParamManager import ParamManager
 from askomics.libaskomics.EndpointManager import EndpointManager
+from askomics.libaskomics.rdfdb.HttpSessionPool import HttpSessionPool
+from askomics.libaskomics.rdfdb.JsonResultsStream import JsonResultsStream
+from askomics.libaskomics.rdfdb.TabularResultsStream import TabularResultsStream
+from askomics.libaskomics.rdfdb.ResultSet import ResultSet, ChainedResultsStream
+from askomics.libaskomics.rdfdb.SingleFlight import SingleFlight
+from askomics.libaskomics.rdfdb.ResultCache import ResultCache
 
 class SPARQLError(RuntimeError):
     """
@@ -20,6 +30,18 @@ class SPARQLError(RuntimeError):
         self.status_code = response.status_code
         super().__init__(response.text)
 
+class QueryTimeout(RuntimeError):
+    """
+    The QueryTimeout is raised when a query takes more than its deadline.
+    """
+    pass
+
+class QueryCancelled(RuntimeError):
+    """
+    The QueryCancelled is raised when the job of a query was cancelled.
+    """
+    pass
+
 class EndpointError(RuntimeError):
     def __init__(self, ep_uri, msg=''):
         msg_ = "There was a pb with Endpoint {}.\n".format(ep_uri)
@@ -42,6 +64,43 @@ class QueryLauncher_(ParamManager):
           from these preformated results using a ResultsBuilder instance.
     It is a generalization of QueryLauncher, but that fit any endpoint
     """
+    # keep-alive http sessions, shared by all the launchers of the worker
+    session_pool = HttpSessionPool()
+
+    # mime types of the sparql results formats we can parse
+    RESULTS_FORMATS = {
+        'tsv': 'text/tab-separated-values',
+        'csv': 'text/csv',
+        'json': 'application/sparql-results+json',
+    }
+
+    # the part of the Fuseki log read to explain a query, in bytes
+    EXPLAIN_LOG_MAX_SIZE = 1024 * 1024
+
+    # results format negotiated with each endpoint, shared by all the launchers of the worker
+    endpoint_formats = {}
+
+    # update urls which applied, or refused, a compressed request body
+    compressed_urls = set()
+    uncompressed_urls = set()
+    _compression_lock = threading.Lock()
+
+    # the graph of the triple inserted to check that an url applies compressed updates
+    COMPRESSION_PROBE_GRAPH = 'urn:askomics:compression-probe'
+
+    # select queries in flight, shared by all the launchers of the worker
+    single_flight = SingleFlight()
+
+    # results of the select queries, shared by all the launchers of the worker
+    result_cache = ResultCache()
+
+    # errors raised while reading a response body
+    READ_ERRORS = (requests.exceptions.RequestException, urllib3.exceptions.HTTPError, OSError)
+
+    UPDATE_KEYWORDS = ('INSERT', 'DELETE', 'LOAD', 'CLEAR', 'DROP', 'CREATE',
+                       'ADD', 'MOVE', 'COPY', 'WITH')
+    RE_PROLOGUE = re.compile(r'(?is)^\s*((PREFIX\s+[^:\s]*:\s*<[^>]*>|BASE\s+<[^>]*>)\s*)+')
+
     def __init__(self, settings, session,
                  name = None, endpoint = None,
                  username=None, password=None,
@@ -56,6 +115,12 @@ class QueryLauncher_(ParamManager):
         self.urlupdate = urlupdate
         self.allowUpdate = False
 
+        # deadline and cancellation of the current web request, if any
+        self.deadline, self.cancel_check = self.get_request_context()
+
+        # True if the last select could not reach the endpoint (its results are [])
+        self.unreachable = False
+
     def setUserDatastore(self):
         """
             initialize endpoint with user configuration file
@@ -77,75 +142,600 @@ class QueryLauncher_(ParamManager):
         if self.is_defined("askomics.endpoint_passwd"):
             self.password = self.get_param("askomics.endpoint_passwd")
 
-    def setup_opener(self, proxy_config):
+    def get_proxies(self, proxy_config):
         """
-        Sets up a urllib OpenerDirector to be used for requests behind a proxy.
+        Get the proxies to set on the http session of the endpoint.
         :param proxy_config:
-          - Nothing to do if proxy_config == "auto" (use the system's proxy if any).
-          - Set an empty ProxyHandler if proxy_config == "noproxy".
-          - Specify the proxy parameters according to the configuration ini file if proxy_config == "custom".
-            We handle Basic and Digest Auth.
+          - None if proxy_config == "auto" (use the system's proxy if any).
+          - An empty dict if proxy_config == "noproxy".
+          - The proxy parameters of the configuration ini file if proxy_config == "custom".
+            The credentials are sent with Basic Auth.
             No ntlm support, try "noproxy" if the triplestore runs on the same server as AskOmics.
         """
         if proxy_config == "noproxy":
-            proxy_handler = urllib.request.ProxyHandler({})
-            self.opener = urllib.request.build_opener(proxy_handler)
-            urllib.request.install_opener(self.opener)
+            return {}
 
-        elif proxy_config == "custom":
+        if proxy_config == "custom":
             if self.is_defined("askomics.proxy_http") and self.is_defined("askomics.proxy_https") and \
                self.is_defined("askomics.proxy_username") and self.is_defined("askomics.proxy_password"):
                 http_proxy = self.get_param("askomics.proxy_http")
                 https_proxy = self.get_param("askomics.proxy_https")
-                proxy_username = self.get_param("askomics.proxy_username")
-                proxy_password = self.get_param("askomics.proxy_password")
+                proxy_username = urllib.parse.quote(self.get_param("askomics.proxy_username"), safe='')
+                proxy_password = urllib.parse.quote(self.get_param("askomics.proxy_password"), safe='')
             else:
                 raise ValueError("Proxy is set as custom in the configuration file but parameters are missing.")
-            proxies = {'http': http_proxy, 'https': https_proxy}
-            proxy_handler = urllib.request.ProxyHandler(proxies)
-            password_manager = urllib.request.HTTPPasswordMgrWithDefaultRealm()
-            password_manager.add_password(None, http_proxy, proxy_username, proxy_password)
-            password_manager.add_password(None, https_proxy, proxy_username, proxy_password)
-            handlers = [proxy_handler]
-            basic_auth_handler = urllib.request.ProxyBasicAuthHandler(password_manager)
-            digest_auth_handler = urllib.request.ProxyDigestAuthHandler(password_manager)
-            handlers.extend([digest_auth_handler, basic_auth_handler])
-            self.opener = urllib.request.build_opener(*handlers)
-            urllib.request.install_opener(self.opener)
-
-    def setupSPARQLWrapper(self):
-        """
-            Setup SPARQLWrapper to reach url endpoint
-        """
-        self.log.debug("================================================================================")
-        self.log.debug(" Query ON : " + str(self.endpoint))
-        self.log.debug(" update   : " + str(self.urlupdate))
-        self.log.debug("================================================================================")
 
-        data_endpoint = SPARQLWrapper(self.endpoint,self.urlupdate)
+            proxies = {}
+            for scheme, proxy in (('http', http_proxy), ('https', https_proxy)):
+                proxy = urllib.parse.urlsplit(proxy)
+                netloc = proxy_username + ':' + proxy_password + '@' + proxy.netloc
+                proxies[scheme] = urllib.parse.urlunsplit(proxy._replace(netloc=netloc))
+            return proxies
 
+        return None
+
+    def get_http_auth(self):
+        """
+            Get the requests auth object to reach url endpoint
+        """
         if self.username and self.password:
-            data_endpoint.setCredentials(self.username, self.password)
+            return requests.auth.HTTPBasicAuth(self.username, self.password)
         elif self.username:
             raise ValueError("passwd is not defined")
         elif self.password:
             raise ValueError("username is not defined")
 
-        return data_endpoint
+        return None
 
-    def _execute_query(self, query, log_raw_results=True, externalService=None):
-        """Params:
-            - sparql query string
-            - log_raw_results: if True the raw json response is logged. Set to False
-            if you're doing a select and parsing the results with parse_results.
+    def get_http_session(self):
         """
+            Get the pooled keep-alive http session of the endpoint.
+            Sessions are shared by all the launchers of the worker.
+        """
+        self.log.debug("================================================================================")
+        self.log.debug(" Query ON : " + str(self.endpoint))
+        self.log.debug(" update   : " + str(self.urlupdate))
+        self.log.debug("================================================================================")
 
         # Proxy handling
         if self.is_defined("askomics.proxy"):
             proxy_config = self.get_param("askomics.proxy")
         else:
             proxy_config = "auto"
-        self.setup_opener(proxy_config)
+
+        pool_size = 10
+        if self.is_defined("askomics.http_pool_size"):
+            pool_size = int(self.get_param("askomics.http_pool_size"))
+
+        idle_timeout = 60
+        if self.is_defined("askomics.http_pool_idle_timeout"):
+            idle_timeout = float(self.get_param("askomics.http_pool_idle_timeout"))
+
+        auth = self.get_http_auth()
+        proxies = self.get_proxies(proxy_config)
+
+        def setup(session):
+            session.auth = auth
+            # requests accepts compressed responses, the results streams
+            # decode them on the fly
+            if proxies is not None:
+                session.trust_env = False
+                session.proxies = proxies
+
+        key = (self.endpoint, self.urlupdate, self.username, self.password,
+               type(auth).__name__, proxy_config)
+        return QueryLauncher_.session_pool.get_session(key, setup, pool_size, idle_timeout)
+
+    def get_request_context(self):
+        """
+            Get the deadline (absolute time, None if no limit) of the queries
+            of the current web request, set by askomics.request_timeout, and
+            the cancellation check of the job it runs (see JobManager.get_cancel_check).
+        """
+        request = get_current_request()
+        if request is None:
+            return None, None
+
+        if not hasattr(request, 'sparql_deadline'):
+            timeout = 0
+            if self.is_defined("askomics.request_timeout"):
+                timeout = float(self.get_param("askomics.request_timeout"))
+            request.sparql_deadline = time.time() + timeout if timeout > 0 else None
+
+        return request.sparql_deadline, getattr(request, 'sparql_cancel_check', None)
+
+    def get_select_timeout(self):
+        """
+            Get the number of seconds a select query can take (None if no limit):
+            askomics.query_timeout, bounded by the deadline of the web request
+        """
+        timeout = 300.0
+        if self.is_defined("askomics.query_timeout"):
+            timeout = float(self.get_param("askomics.query_timeout"))
+        if timeout <= 0:
+            timeout = None
+
+        if self.deadline is not None:
+            remaining = self.deadline - time.time()
+            if remaining <= 0:
+                raise QueryTimeout("The time allowed to the queries of the request is over.")
+            timeout = remaining if timeout is None else min(timeout, remaining)
+
+        return timeout
+
+    def is_local_endpoint(self):
+        """Check if the launcher queries the local triplestore (askomics.endpoint)"""
+        return self.is_defined("askomics.endpoint") and self.endpoint == self.get_param("askomics.endpoint")
+
+    def get_endpoint_timeout_params(self, timeout):
+        """
+            Get the request parameters asking the local triplestore to stop a
+            query after timeout seconds (Virtuoso and Fuseki only)
+        """
+        if timeout is None or not self.is_local_endpoint():
+            return {}
+
+        triplestore = self.get_triplestore_type()
+        if triplestore == 'virtuoso':
+            return {'timeout': str(int(timeout * 1000))}
+        if triplestore == 'fuseki':
+            return {'timeout': '%.3f' % timeout}
+        return {}
+
+    def _post(self, session, url, **kwargs):
+        """
+            Post a request, the wait for the response is abandoned as soon as
+            the job of the query is cancelled (see cancel_check): the request
+            is sent on its own connection, closed then, so that neither the
+            thread waiting for the response nor a connection of the pool are
+            kept until the triplestore answers (it stops the query at the
+            timeout parameter, see get_endpoint_timeout_params, or when it
+            sees the connection closed).
+        """
+        if self.cancel_check is None:
+            return session.post(url, **kwargs)
+
+        session, adapter = HttpSessionPool.get_abortable_session(session)
+        outcome = {}
+
+        def post():
+            try:
+                outcome['response'] = session.post(url, **kwargs)
+            except Exception as e:
+                outcome['error'] = e
+            if outcome.get('cancelled') and 'response' in outcome:
+                outcome['response'].close()
+
+        thread = threading.Thread(target=post, daemon=True)
+        thread.start()
+        while thread.is_alive():
+            thread.join(0.2)
+            if thread.is_alive() and self.cancel_check():
+                outcome['cancelled'] = True
+                if adapter is not None:
+                    adapter.abort()
+                raise QueryCancelled("The query was cancelled.")
+
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome['response']
+
+    def is_compression_enabled(self):
+        """Check if the request bodies can be compressed (askomics.http_compression, false by default)"""
+        if self.is_defined("askomics.http_compression"):
+            return self.get_param("askomics.http_compression").lower() in ('ok', 'true')
+        return False
+
+    def compress_body(self, url, size):
+        """
+            Check if a request body of size bytes sent to url should be
+            compressed: above askomics.http_compression_min_size bytes, and
+            if the url did not refuse it before
+        """
+        if not self.is_compression_enabled() or url in QueryLauncher_.uncompressed_urls:
+            return False
+
+        min_size = 65536
+        if self.is_defined("askomics.http_compression_min_size"):
+            min_size = int(self.get_param("askomics.http_compression_min_size"))
+
+        return size >= min_size
+
+    def accepts_compressed_update(self, session, url, key):
+        """
+            Check once per url that it applies a compressed update: an endpoint
+            ignoring Content-Encoding may answer 200 without updating anything,
+            so the triple inserted by a compressed body must be found by a select.
+        """
+        with QueryLauncher_._compression_lock:
+            if url in QueryLauncher_.compressed_urls:
+                return True
+            if url in QueryLauncher_.uncompressed_urls:
+                return False
+            return self._probe_compressed_update(session, url, key)
+
+    def _probe_compressed_update(self, session, url, key):
+        """Insert a triple by a compressed update, check it and drop it"""
+
+        graph = self.COMPRESSION_PROBE_GRAPH
+        triple = '<%s> <%s> "%s"' % (graph, graph, uuid.uuid4().hex)
+        body = urllib.parse.urlencode({key: 'INSERT DATA { GRAPH <%s> { %s } }' % (graph, triple)})
+
+        accepted = False
+        try:
+            response = session.post(url, data=gzip.compress(body.encode('utf-8'), 6),
+                                    headers={'Content-Type': 'application/x-www-form-urlencoded',
+                                             'Content-Encoding': 'gzip'})
+            if response.status_code < 400:
+                response = session.post(self.endpoint, data={'query': 'ASK { GRAPH <%s> { %s } }' % (graph, triple)},
+                                        headers={'Accept': self.RESULTS_FORMATS['json']})
+                accepted = response.status_code == 200 and response.json().get('boolean') is True
+        except (requests.RequestException, ValueError) as e:
+            self.log.debug("compressed update not checked on %s: %s", url, e)
+        finally:
+            try:
+                session.post(url, data={key: 'DROP SILENT GRAPH <%s>' % graph})
+            except requests.RequestException as e:
+                self.log.debug("%s not dropped: %s", graph, e)
+
+        if accepted:
+            QueryLauncher_.compressed_urls.add(url)
+        else:
+            self.log.debug("%s does not apply compressed updates, send them uncompressed", url)
+            QueryLauncher_.uncompressed_urls.add(url)
+        return accepted
+
+    def _post_update(self, session, url, data):
+        """
+            Post an update request, gzip compressed if it is large and the url
+            applies compressed updates (see accepts_compressed_update). An url
+            answering 400 or 415 to a compressed body gets it again uncompressed,
+            and will not be sent compressed bodies any more if it succeeds.
+        """
+        body = urllib.parse.urlencode(data).encode('utf-8')
+        if not self.compress_body(url, len(body)) or \
+           not self.accepts_compressed_update(session, url, next(iter(data))):
+            return session.post(url, data=body,
+                                headers={'Content-Type': 'application/x-www-form-urlencoded'})
+
+        response = session.post(url, data=gzip.compress(body, 6),
+                                headers={'Content-Type': 'application/x-www-form-urlencoded',
+                                         'Content-Encoding': 'gzip'})
+        if response.status_code not in (400, 415):
+            return response
+
+        self.log.debug("%s refused a compressed body (%d), send it uncompressed", url, response.status_code)
+        response = session.post(url, data=body,
+                                headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        if response.status_code < 400:
+            QueryLauncher_.compressed_urls.discard(url)
+            QueryLauncher_.uncompressed_urls.add(url)
+        return response
+
+    def get_results_format(self):
+        """
+            Get the results format to ask to the endpoint: the one negotiated
+            before with this endpoint, or askomics.results_format (tsv by default)
+        """
+        if self.endpoint in QueryLauncher_.endpoint_formats:
+            return QueryLauncher_.endpoint_formats[self.endpoint]
+
+        results_format = 'tsv'
+        if self.is_defined("askomics.results_format"):
+            results_format = self.get_param("askomics.results_format").lower()
+        if results_format not in self.RESULTS_FORMATS:
+            raise ValueError("askomics.results_format must be tsv, csv or json.")
+
+        return results_format
+
+    def _post_select(self, session, query, results_format):
+        """
+            Send a select query, json is always accepted as a fallback format.
+            Return the results stream, or None if the endpoint answered in a
+            format we can not parse.
+        """
+        accept = self.RESULTS_FORMATS[results_format]
+        if results_format != 'json':
+            accept += ', ' + self.RESULTS_FORMATS['json'] + ';q=0.5'
+
+        timeout = self.get_select_timeout()
+        data = {'query': query}
+        data.update(self.get_endpoint_timeout_params(timeout))
+
+        response = self._post(session, self.endpoint, data=data,
+                              headers={'Accept': accept},
+                              stream=True,
+                              timeout=None if timeout is None else (min(timeout, 10), timeout))
+
+        if response.status_code == 406:
+            response.close()
+            return None
+        if response.status_code == 503 and 'timeout' in data and self.get_triplestore_type() == 'fuseki':
+            # Fuseki answers 503 when the query is stopped at its timeout
+            response.close()
+            raise QueryTimeout("The query took more than %.0fs." % timeout)
+        if response.status_code >= 400:
+            raise SPARQLError(response)
+        if 'timeout' in data and 'X-SQL-State' in response.headers:
+            # Virtuoso stopped the query at its timeout, the results are partial
+            response.close()
+            raise QueryTimeout("The query took more than %.0fs." % timeout)
+
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type in ('text/tab-separated-values', 'text/tsv'):
+            results_format = 'tsv'
+            results = TabularResultsStream.from_response(response, 'tsv')
+        elif content_type in ('text/csv', 'text/comma-separated-values'):
+            results_format = 'csv'
+            results = TabularResultsStream.from_response(response, 'csv')
+        elif 'json' in content_type:
+            results_format = 'json'
+            results = JsonResultsStream.from_response(response)
+        else:
+            response.close()
+            return None
+
+        # remember what the endpoint answered, no need to negotiate again
+        QueryLauncher_.endpoint_formats[self.endpoint] = results_format
+        return results
+
+    @staticmethod
+    def is_update_query(query):
+        """Check if a sparql query is an update request (INSERT, DELETE, LOAD, ...)"""
+        query = re.sub(r'(?m)^\s*#.*$', '', query)
+        query = QueryLauncher_.RE_PROLOGUE.sub('', query)
+        keyword = query.lstrip().split(None, 1)
+        return len(keyword) > 0 and keyword[0].upper() in QueryLauncher_.UPDATE_KEYWORDS
+
+    def is_query_coalescing(self):
+        """Check if identical select queries running at the same time are coalesced"""
+        if self.is_defined("askomics.query_coalescing"):
+            return self.get_param("askomics.query_coalescing").lower() in ('ok', 'true')
+        return True
+
+    def _execute_select(self, session, query, externalService=None):
+        """
+            Send a select query, return the results stream ([] if the endpoint
+            can not be reached or does not answer a format we can parse).
+            For an external service of the endpoints table:
+                - its circuit (see EndpointManager) is checked before and updated
+                  after the request, an open circuit gives [] at once,
+                - connection errors and 502/503/504 answers are retried
+                  askomics.endpoint_retries times with an exponential backoff,
+                - its results are read here, in a ResultSet, so that an error
+                  while reading them counts as a failure too.
+        """
+        circuit = None
+        retries = 0
+        if externalService is not None and 'id' in externalService:
+            em = EndpointManager(self.settings, self.session)
+            circuit = em.allow_request(externalService['id'])
+            if circuit is None:
+                self.log.debug("circuit of %s is open, skip it", self.endpoint)
+                return []
+
+            retries = 2
+            if self.is_defined("askomics.endpoint_retries"):
+                retries = int(self.get_param("askomics.endpoint_retries"))
+            if circuit == EndpointManager.HALF_OPEN:
+                # a single probe
+                retries = 0
+
+        delay = 0.5
+        if self.is_defined("askomics.endpoint_retry_delay"):
+            delay = float(self.get_param("askomics.endpoint_retry_delay"))
+
+        attempt = 0
+        while True:
+            try:
+                results = self._try_select(session, query)
+                if circuit is not None:
+                    results = ResultSet(rows=self.iter_results(results))
+                break
+            except requests.exceptions.ReadTimeout as e:
+                # too slow, not worth a retry
+                if circuit is not None:
+                    em.record_failure(externalService['id'], str(e))
+                    return []
+                raise QueryTimeout("The query took too long: " + str(e))
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as URLError:
+                error = URLError
+            except SPARQLError as e:
+                if e.status_code not in (502, 503, 504):
+                    raise
+                error = e
+            except self.READ_ERRORS as e:
+                # the response body could not be read
+                if circuit is None:
+                    raise
+                error = e
+
+            if attempt >= retries:
+                if circuit is not None:
+                    em.record_failure(externalService['id'], str(error))
+                if isinstance(error, SPARQLError):
+                    raise error
+                return []
+
+            self.log.debug("%s failed (%s), retry in %.1fs", self.endpoint, error, delay * 2 ** attempt)
+            time.sleep(delay * 2 ** attempt)
+            attempt += 1
+
+        if circuit is not None:
+            em.record_success(externalService['id'], circuit)
+
+        return results
+
+    def _try_select(self, session, query):
+        """
+            Send a select query once, negotiating the results format
+        """
+        results_format = self.get_results_format()
+        results = self._post_select(session, query, results_format)
+
+        if results is None and results_format != 'json':
+            # tabular formats are not supported, fallback to json for good
+            self.log.debug("%s does not support %s results, use json", self.endpoint, results_format)
+            QueryLauncher_.endpoint_formats[self.endpoint] = 'json'
+            results = self._post_select(session, query, 'json')
+
+        if results is None:
+            error = "JSON is not supported by the sparql endpoint. Askomics can not support this format results."
+            em = EndpointManager(self.settings, self.session)
+            em.disable_by_url(self.endpoint,error)
+            results = []
+
+        return results
+
+    def get_result_cache(self):
+        """
+            Get the result cache of the worker, None if the results of the
+            endpoint are not cached: only the local triplestore is, the data
+            of the other endpoints can change without AskOmics knowing it.
+        """
+        if not self.is_local_endpoint():
+            return None
+
+        max_entries = 512
+        if self.is_defined("askomics.result_cache_size"):
+            max_entries = int(self.get_param("askomics.result_cache_size"))
+        if max_entries <= 0:
+            return None
+
+        max_bytes = 64
+        if self.is_defined("askomics.result_cache_memory"):
+            max_bytes = float(self.get_param("askomics.result_cache_memory"))
+
+        cache = QueryLauncher_.result_cache
+        cache.version_path = self.get_result_cache_version_path()
+        cache.resize(max_entries, int(max_bytes * 1024 * 1024))
+        return cache
+
+    def get_result_cache_version_path(self):
+        """Get the version file of the result caches shared by the processes (see ResultCache)"""
+        if self.is_defined("askomics.files_dir"):
+            return os.path.join(self.get_param("askomics.files_dir"), "result_cache.version")
+        return None
+
+    def invalidate_results(self, graphs):
+        """Drop the cached results depending on the graphs, in all the processes"""
+        cache = QueryLauncher_.result_cache
+        cache.version_path = self.get_result_cache_version_path()
+        cache.invalidate(graphs)
+
+    def get_buffer_limit(self, cache):
+        """
+            Get the estimated size, in bytes, up to which the results of a select
+            are read in a ResultSet to be cached or shared with the identical
+            queries: the memory of the result cache (askomics.result_cache_memory
+            megabytes, 64 by default), 0 if they can be neither.
+        """
+        if cache is not None:
+            return cache.max_bytes
+        if not self.is_query_coalescing():
+            return 0
+
+        max_bytes = 64
+        if self.is_defined("askomics.result_cache_memory"):
+            max_bytes = float(self.get_param("askomics.result_cache_memory"))
+        return int(max_bytes * 1024 * 1024)
+
+    def buffer_results(self, stream, limit):
+        """
+            Read the results of a stream in a ResultSet while their estimated
+            size is below limit bytes. Above, return a ChainedResultsStream of
+            the rows read and of the rest of the stream, read on demand.
+        """
+        if isinstance(stream, ResultSet):
+            return stream
+
+        rows = iter(self.iter_results(stream))
+        results = ResultSet()
+        size = ResultCache.estimate_size(results)
+        for row in rows:
+            results.append(row)
+            size += ResultCache.estimate_row_size(row)
+            if size > limit:
+                self.log.debug("results above %d bytes, streamed", limit)
+                return ChainedResultsStream(results, rows, stream)
+        return results
+
+    def _execute_shared_select(self, session, query, externalService=None):
+        """
+            Send a select query, the results are read in a ResultSet that can
+            be shared, up to the size of the result cache (see buffer_results):
+                - the results of the local triplestore are cached (see get_result_cache),
+                - an identical query already running on the endpoint is waited
+                  for instead of being sent again (see is_query_coalescing).
+            Larger results are streamed, as they are when they can be neither
+            cached nor shared.
+        """
+        cache = self.get_result_cache()
+        if cache is not None:
+            key = cache.make_key(self.endpoint, query)
+            results = cache.get(key)
+            if results is not None:
+                self.log.debug("results found in cache")
+                self.unreachable = False
+                return results
+            generation = cache.stamp()
+
+        limit = self.get_buffer_limit(cache)
+        if limit <= 0:
+            results = self._execute_select(session, query, externalService)
+            self.unreachable = isinstance(results, list)
+            return results
+
+        def execute_select():
+            stream = self._execute_select(session, query, externalService)
+            # an unreachable endpoint gives [], not worth caching
+            unreachable = isinstance(stream, list)
+            results = self.buffer_results(stream, limit)
+            if cache is not None and not unreachable and isinstance(results, ResultSet):
+                cache.put(key, results, generation)
+            return results, unreachable
+
+        if not self.is_query_coalescing():
+            results, self.unreachable = execute_select()
+            return results
+
+        flight_key = (self.endpoint, self.username, self.password, query)
+        # the cancellation and the deadline of the query that runs are its own,
+        # a stream is read by the leader only
+        results, self.unreachable = QueryLauncher_.single_flight.do(flight_key, execute_select,
+                                                                    private_errors=(QueryCancelled, QueryTimeout),
+                                                                    check=self.check_wait,
+                                                                    shareable=lambda result: isinstance(result[0], ResultSet))
+        return results
+
+    def check_wait(self):
+        """
+            Check the query waiting for an identical one (see SingleFlight.do):
+            raise if its job was cancelled or its deadline is over, return the
+            seconds it can still wait (None if no limit)
+        """
+        if self.cancel_check is not None and self.cancel_check():
+            raise QueryCancelled("The query was cancelled.")
+        if self.deadline is None:
+            return None
+
+        remaining = self.deadline - time.time()
+        if remaining <= 0:
+            raise QueryTimeout("The time allowed to the queries of the request is over.")
+        return remaining
+
+    def _execute_query(self, query, log_raw_results=True, externalService=None, coalesce=True):
+        """Params:
+            - sparql query string
+            - log_raw_results: if True the raw json response is logged. Set to False
+            if you're doing a select and parsing the results with parse_results.
+            - coalesce: if True, the results of a select query can be shared with
+            the identical queries (see _execute_shared_select).
+        A select query returns a JsonResultsStream or a TabularResultsStream
+        (see get_results_format) reading the response body on demand, or a
+        ResultSet when it is shared (a ChainedResultsStream if it is too large
+        for that). An update query returns the http response.
+        """
 
         if self.log.isEnabledFor(logging.DEBUG):
             # Prefixes should always be the same, so drop them for logging
@@ -156,41 +746,34 @@ class QueryLauncher_(ParamManager):
 
         time0 = time.time()
 
-        data_endpoint = self.setupSPARQLWrapper()
-        data_endpoint.setQuery(query)
-        data_endpoint.method = 'POST'
+        session = self.get_http_session()
 
-        if data_endpoint.isSparqlUpdateRequest():
+        if self.is_update_query(query):
             if not self.allowUpdate :
                 raise ValueError("Can not perform an update sparql request on an external endpoint.")
 
-            data_endpoint.setMethod('POST')
+            url = self.urlupdate or self.endpoint
+            data = {'update': query}
             # Hack for Virtuoso to LOAD a turtle file
             if self.is_defined("askomics.hack_virtuoso"):
                 hack_virtuoso = self.get_param("askomics.hack_virtuoso")
                 if hack_virtuoso.lower() == "ok" or hack_virtuoso.lower() == "true":
-                    data_endpoint.queryType = 'SELECT'
-
-            results = data_endpoint.query()
+                    url = self.endpoint
+                    data = {'query': query}
+
+            results = self._post_update(session, url, data)
+            # the graphs may have changed (even partially on error), drop the
+            # cached results depending on them
+            self.invalidate_results(ResultCache.get_updated_graphs(query))
+            if results.status_code >= 400:
+                raise SPARQLError(results)
+            time1 = time.time()
+        elif coalesce:
+            results = self._execute_shared_select(session, query, externalService)
             time1 = time.time()
         else:
-            data_endpoint.setReturnFormat(JSON)
-            try:
-                results = data_endpoint.query().convert()
-                if type(results) != dict :
-                    error = "JSON is not supported by the sparql endpoint. Askomics can not support this format results :"+type(results).__module__+"."+type(results).__name__
-                    em = EndpointManager(self.settings, self.session)
-                    em.disable_by_url(self.endpoint,error)
-                    results = []
-
-            except urllib.error.URLError as URLError:
-                #url error, we disable the endpoint
-                #raise ValueError(URLError.reason)
-                if externalService != None :
-                    em = EndpointManager(self.settings, self.session)
-                    em.disable(externalService['id'],str(URLError.reason))
-                results = []
-                #raise ValueError(URLError.reason)
+            results = self._execute_select(session, query, externalService)
+            self.unreachable = isinstance(results, list)
             time1 = time.time()
 
         queryTime = time1 - time0
@@ -202,31 +785,53 @@ class QueryLauncher_(ParamManager):
                 self.log.debug("------- QUERY DONE ------------ (t=%.3fs)", queryTime)
         return results
 
-    def parse_results(self, json_res):
+    def iter_results(self, json_res):
         '''
-            parse answer results from TPS
+            iterate over answer results from TPS, one binding at a time
         '''
 
         if json_res is None:
             raise ValueError("Unable to get a response from the datastore.")
 
+        if isinstance(json_res, (JsonResultsStream, TabularResultsStream, ResultSet, ChainedResultsStream)):
+            return json_res
+
         if type(json_res) is not dict:
             self.log.debug(str(json_res))
-            return []
+            return iter([])
             #raise ValueError("Unable to get a response from the datastore.<br/>"+str(json_res))
 
         if "results" not in json_res:
-            return []
+            return iter([])
 
         if "bindings" not in json_res["results"]:
-            return []
+            return iter([])
 
-        parsed = [
+        return (
                 {
                     sparql_variable: entry[sparql_variable]["value"]
                     for sparql_variable in entry.keys()
                 } for entry in json_res["results"]["bindings"]
-            ]
+            )
+
+    def _iter_cancellable(self, rows):
+        """Stop reading the results when the job of the query is cancelled"""
+        for count, row in enumerate(rows, 1):
+            if count % 10000 == 0 and self.cancel_check():
+                if hasattr(rows, 'close'):
+                    rows.close()
+                raise QueryCancelled("The query was cancelled.")
+            yield row
+
+    def parse_results(self, json_res):
+        '''
+            parse answer results from TPS into a ResultSet
+        '''
+
+        rows = self.iter_results(json_res)
+        if self.cancel_check is not None:
+            rows = self._iter_cancellable(rows)
+        parsed = ResultSet(rows=rows)
 
         # debug log is guarded since formatting is time consuming
         if self.log.isEnabledFor(logging.DEBUG):
@@ -241,20 +846,78 @@ class QueryLauncher_(ParamManager):
                 self.log.debug("----------- RESULTS --------------\n%s", log_res)
         return parsed
 
-    def process_query(self, query, parseResults=True):
+    def explain_query(self, query):
+        '''
+            Run a select query to explain it, return:
+                - time: the seconds to get all its results, not read from the cache,
+                - nrows: the number of results,
+                - plan: the execution plan of the local triplestore, None if unknown:
+                    - Virtuoso: the compilation report of its sparql endpoint (explain=on),
+                    - Fuseki: the lines written to its log (askomics.fuseki_query_log)
+                      while the query ran, it logs the plans with arq:logExec
+                - plan_source: virtuoso, fuseki or None
+        '''
+        if not self.endpoint:
+            self.setUserDatastore()
+
+        plan = None
+        plan_source = None
+        triplestore = self.get_triplestore_type() if self.is_local_endpoint() else None
+
+        if triplestore == 'virtuoso':
+            timeout = self.get_select_timeout()
+            response = self._post(self.get_http_session(), self.endpoint,
+                                  data={'query': query, 'explain': 'on'},
+                                  timeout=None if timeout is None else (min(timeout, 10), timeout))
+            if response.status_code >= 400:
+                raise SPARQLError(response)
+            plan = response.text
+            plan_source = triplestore
+
+        log_path = None
+        log_offset = 0
+        if triplestore == 'fuseki' and self.is_defined("askomics.fuseki_query_log"):
+            log_path = self.get_param("askomics.fuseki_query_log")
+            try:
+                log_offset = os.path.getsize(log_path)
+            except OSError as e:
+                self.log.warning("fuseki log %s can not be read: %s", log_path, e)
+                log_path = None
+
+        time0 = time.time()
+        nrows = 0
+        for row in self.process_query(query, stream=True):
+            nrows += 1
+        query_time = time.time() - time0
+
+        if log_path is not None:
+            with open(log_path, 'rb') as log_file:
+                log_file.seek(log_offset)
+                plan = log_file.read(self.EXPLAIN_LOG_MAX_SIZE).decode('utf-8', errors='replace')
+            plan_source = triplestore
+
+        return {'time': query_time, 'nrows': nrows, 'plan': plan, 'plan_source': plan_source}
+
+    def process_query(self, query, parseResults=True, stream=False):
         '''
             Execute query and parse the results if exist
+            With stream=True, return an iterator over the results instead of a list
         '''
 
         # if no endpoint are configured, set local datastore
         if not self.endpoint:
             self.setUserDatastore()
 
-        json_query = self._execute_query(query, log_raw_results=False)
+        # a stream is read only once, it can not be shared
+        json_query = self._execute_query(query, log_raw_results=False, coalesce=not stream)
         results = []
 
-        if parseResults:
+        if stream:
+            results = self.iter_results(json_query)
+        elif parseResults:
             results = self.parse_results(json_query)
+        elif isinstance(json_query, (JsonResultsStream, TabularResultsStream, ChainedResultsStream)):
+            json_query.close()
 
         return results
 
@@ -278,11 +941,18 @@ class QueryLauncher_(ParamManager):
         except IndexError as e:
             raise NotEndpoint(self.endpoint)
 
-    def format_results_csv(self, data):
-        """write the csv result file from a data ist
+    @staticmethod
+    def get_results_csv_name():
+        """Get a new name of csv result file"""
+        return 'data_' + str(time.time()).replace('.', '') + '.csv'
+
+    def format_results_csv(self, data, filename=None, headers=None):
+        """write the csv result file from a data list
 
-        :param data: the data to process
-        :type data: list
+        :param data: the data to process, rows are read one by one
+        :type data: ResultSet, list or iterator (see process_query with stream=True)
+        :param filename: the name of the file, a new one if None
+        :param headers: the columns, the variables of data by default
         :returns: The path of the created file
         :rtype: string
         """
@@ -292,24 +962,46 @@ class QueryLauncher_(ParamManager):
             os.mkdir(dircsv)
 
         # Open the CSV File
-        filename = 'data_' + str(time.time()).replace('.', '') + '.csv'
-        with open(dircsv + '/' + filename, 'w') as csvfile:
-            writer = csv.writer(csvfile, delimiter='\t')
-            # Write header
-            headers = []
-            if len(data)>0:
-                for header in data[0]:
-                    headers.append(header)
-                writer.writerow(headers)
-            # Write rows
-            for value in data:
-                row = []
-                for header in value:
-                    row.append(value[header])
-                writer.writerow(row)
+        if filename is None:
+            filename = self.get_results_csv_name()
+        # written beside, the file is complete as soon as it exists
+        with tempfile.NamedTemporaryFile('w', dir=dircsv, delete=False, suffix='.tmp') as csvfile:
+            try:
+                self.write_results_csv(csvfile, data, headers)
+            except BaseException:
+                csvfile.close()
+                os.remove(csvfile.name)
+                raise
+        os.replace(csvfile.name, dircsv + '/' + filename)
 
         return filename
 
+    @staticmethod
+    def write_results_csv(csvfile, data, headers=None):
+        """write the rows of data in an open csv file, see format_results_csv"""
+
+        writer = csv.writer(csvfile, delimiter='\t')
+        if isinstance(data, ResultSet) and headers is None:
+            # write the columns directly, without building the row views
+            if len(data) > 0:
+                writer.writerow(data.vars)
+                columns = [data.column(header) for header in data.vars]
+                writer.writerows(['' if value is None else value for value in row]
+                                 for row in zip(*columns))
+            return
+
+        # Write header
+        rows = iter(data)
+        first = next(rows, None)
+        if first is not None:
+            # the variables of the head include the unbound ones of the first row
+            headers = headers or getattr(data, 'vars', None) or list(first)
+            writer.writerow(headers)
+            writer.writerow([first.get(header, '') for header in headers])
+        # Write rows
+        for value in rows:
+            writer.writerow([value.get(header, '') for header in headers])
+
 
     def debug( self ):
         self.log.debug( self.endpoint )
@@ -346,14 +1038,15 @@ class QueryLauncher(QueryLauncher_):
         if self.is_defined("askomics.endpoint.auth"):
             self.auth = self.get_param("askomics.endpoint.auth")
 
-    def setupSPARQLWrapper(self):
+    def get_http_auth(self):
         """
-            Setup SPARQLWrapper to reach url endpoint
+            Get the requests auth object to reach url endpoint (Basic or Digest)
         """
-        data_endpoint = super().setupSPARQLWrapper()
-        data_endpoint.setHTTPAuth(self.auth) # Basic or Digest
+        auth = super().get_http_auth()
+        if auth is not None and self.auth.upper() == 'DIGEST':
+            auth = requests.auth.HTTPDigestAuth(self.username, self.password)
 
-        return data_endpoint
+        return auth
 
 
     # TODO see if we can make a rollback in case of malformed data
@@ -385,13 +1078,32 @@ class QueryLauncher(QueryLauncher_):
         """
         self.log.debug("Loading into triple store (HTTP method) the content of: %s", filename)
 
+        url = self.get_param("askomics.file_upload_url")
         data = {'graph': graphName}
-        files = [('file', (os.path.basename(filename), open(filename), 'text/turtle'))]
 
         time0 = time.time()
-        response = requests.post(self.get_param("askomics.file_upload_url"), data=data, files=files)
+        response = None
+        refused = False
+        if self.compress_body(url, os.path.getsize(filename)):
+            # Fuseki reads a .gz file as gzip compressed
+            with open(filename, 'rb') as ttl_file:
+                content = gzip.compress(ttl_file.read(), 6)
+            files = [('file', (os.path.basename(filename) + '.gz', content, 'text/turtle'))]
+            response = requests.post(url, data=data, files=files)
+            if response.status_code in (400, 415):
+                self.log.debug("%s refused a compressed file (%d), send it uncompressed", url, response.status_code)
+                response = None
+                refused = True
+
+        if response is None:
+            with open(filename) as ttl_file:
+                files = [('file', (os.path.basename(filename), ttl_file, 'text/turtle'))]
+                response = requests.post(url, data=data, files=files)
         if response.status_code != 200:
             raise SPARQLError(response)
+        if refused:
+            QueryLauncher_.uncompressed_urls.add(url)
+        self.invalidate_results([graphName])
 
         self.log.debug("---------- RESPONSE FROM HTTP : %s", response.raw.read())
 
@@ -0,0 +1,204 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import re
+import uuid
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+class ResultCache(object):
+    """
+    The ResultCache keeps the ResultSet of the last select queries (LRU):
+        - entries are keyed on the endpoint, the normalized query text and the
+          set of FROM graphs of the query (see make_key),
+        - the oldest entries are evicted above max_entries entries or above
+          max_bytes (estimated size of the values),
+        - invalidate(graphs) drops the entries depending on one of the graphs.
+          A query without FROM may read any graph, it depends on all of them,
+        - invalidate() also rewrites a version file shared by the processes
+          (version_path), the other processes drop all their entries when they
+          see it changed, before serving one.
+    The generation counter is incremented by each invalidation: results
+    computed while a graph was changed are not stored (see put).
+    """
+
+    RE_FROM = re.compile(r'(?i)\bFROM\s+(NAMED\s+)?<([^>]*)>')
+    # GRAPH/WITH keywords, not the ones inside IRIs, prefixed names or variables
+    RE_GRAPH = re.compile(r'(?i)(?<![\w:/#<.?$-])(?:GRAPH|WITH)(?=[\s<?$])\s*(<[^>]*>)?')
+
+    def __init__(self, max_entries=512, max_bytes=64*1024*1024, version_path=None):
+        self.log = logging.getLogger(__name__)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.version_path = version_path
+        self.generation = 0
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(query):
+        """Drop the indentation, comment lines and empty lines of a query"""
+        lines = (line.strip() for line in query.splitlines())
+        return '\n'.join(line for line in lines if line and not line.startswith('#'))
+
+    @classmethod
+    def get_dependencies(cls, query):
+        """
+        Get the frozenset of the graphs read by a select query, None if the
+        query may read any graph (no FROM, or GRAPH patterns without FROM NAMED)
+        """
+        graphs = cls.RE_FROM.findall(query)
+        if not graphs:
+            return None
+        if cls.RE_GRAPH.search(query) and not any(named for named, graph in graphs):
+            return None
+        return frozenset(graph for named, graph in graphs)
+
+    @classmethod
+    def get_updated_graphs(cls, query):
+        """
+        Get the graphs modified by an update query (GRAPH <g>, WITH <g>),
+        None if they can not be found in the query text
+        """
+        graphs = []
+        for graph in cls.RE_GRAPH.findall(query):
+            if not graph:
+                return None
+            graphs.append(graph[1:-1])
+        return graphs or None
+
+    @classmethod
+    def make_key(cls, endpoint, query):
+        """Get the cache key of a select query sent to an endpoint"""
+        return (endpoint, cls.normalize(query), cls.get_dependencies(query))
+
+    @staticmethod
+    def estimate_size(result_set):
+        """Estimate the memory used by a ResultSet, in bytes"""
+        size = 64
+        for variable in result_set.vars:
+            column = result_set.column(variable)
+            size += 8 * len(column) + sum(len(value) + 49 for value in column if value is not None)
+        return size
+
+    @staticmethod
+    def estimate_row_size(row):
+        """Estimate the memory used by a row ({variable: value} dict) in a ResultSet, in bytes"""
+        return 8 * len(row) + sum(len(value) + 49 for value in row.values() if value is not None)
+
+    def resize(self, max_entries, max_bytes):
+        """Change the limits, evict the entries above them"""
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _read_version(self):
+        if self.version_path is None:
+            return None
+        try:
+            with open(self.version_path) as version_file:
+                return version_file.read()
+        except OSError:
+            return None
+
+    def stamp(self):
+        """
+        Get the generation, to give to put once the results are known.
+        The entries are dropped if another process changed a graph.
+        """
+        version = self._read_version()
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._bytes = 0
+                self._version = version
+                self.generation += 1
+            return self.generation
+
+    def get(self, key):
+        """Get the ResultSet of a key, None if it is not cached"""
+        self.stamp()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, result_set, generation):
+        """
+        Store the ResultSet of a key
+        :param generation: the generation read before sending the query,
+                           nothing is stored if a graph was changed since
+        """
+        size = self.estimate_size(result_set)
+        self.stamp()
+        with self._lock:
+            if generation != self.generation or size > self.max_bytes or self.max_entries <= 0:
+                return False
+
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (result_set, size)
+            self._bytes += size
+            self._evict()
+        return True
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            key, (result_set, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+
+    def invalidate(self, graphs=None):
+        """
+        Drop the entries depending on one of the graphs
+        :param graphs: the graphs that changed, None if any graph may have changed
+        """
+        version = self._write_version()
+        with self._lock:
+            self.generation += 1
+            self._version = version
+            if graphs is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+
+            graphs = set(graphs)
+            for key in list(self._entries):
+                dependencies = key[2]
+                if dependencies is None or not dependencies.isdisjoint(graphs):
+                    self._bytes -= self._entries.pop(key)[1]
+
+        self.log.debug("result cache invalidated for %s", graphs)
+
+    def _write_version(self):
+        """Write a new version for the other processes, return it"""
+        if self.version_path is None:
+            return None
+
+        version = uuid.uuid4().hex
+        try:
+            directory = os.path.dirname(self.version_path) or '.'
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with tempfile.NamedTemporaryFile('w', dir=directory, delete=False, suffix='.tmp') as tmp_file:
+                tmp_file.write(version)
+            os.replace(tmp_file.name, self.version_path)
+        except OSError as e:
+            self.log.warning("result cache version %s not written: %s", self.version_path, e)
+            return self._read_version()
+        return version
+
+    def clear(self):
+        """Drop all the entries"""
+        self.invalidate(None)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,170 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+from collections.abc import Mapping
+
+class ResultRow(Mapping):
+    """
+    Read-only view on a row of a ResultSet.
+    It behaves like the {variable: value} dict of the row, unbound
+    variables are not part of it.
+    """
+    __slots__ = ('_result_set', '_index')
+
+    def __init__(self, result_set, index):
+        self._result_set = result_set
+        self._index = index
+
+    def __getitem__(self, variable):
+        value = self._result_set._columns[variable][self._index]
+        if value is None:
+            raise KeyError(variable)
+        return value
+
+    def __iter__(self):
+        columns = self._result_set._columns
+        for variable in self._result_set.vars:
+            if columns[variable][self._index] is not None:
+                yield variable
+
+    def __len__(self):
+        return sum(1 for variable in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class ResultSet(object):
+    """
+    The ResultSet stores the results of a SELECT query by column:
+        - the variable names are stored once in vars,
+        - each variable has a list of values, None when the variable is unbound.
+    Rows are accessed as ResultRow views (read-only dict-like objects), slicing
+    returns a new ResultSet. It is serialized as a list of {variable: value}
+    dicts, as the query results used to be (see __json__ for the Pyramid renderer).
+    """
+    __slots__ = ('vars', '_columns', '_length')
+
+    def __init__(self, variables=None, rows=None):
+        """
+        :param variables: the variable names
+        :param rows: iterable of {variable: value} dicts to append
+        """
+        self.vars = []
+        self._columns = {}
+        self._length = 0
+
+        for variable in variables or []:
+            self._add_variable(variable)
+
+        if rows is not None:
+            self.extend(rows)
+
+    def _add_variable(self, variable):
+        if variable not in self._columns:
+            self.vars.append(variable)
+            self._columns[variable] = [None] * self._length
+
+    def append(self, row):
+        """Add a row ({variable: value} dict or ResultRow)"""
+        for variable in row:
+            if variable not in self._columns:
+                self._add_variable(variable)
+
+        for variable in self.vars:
+            self._columns[variable].append(row.get(variable))
+        self._length += 1
+
+    def extend(self, rows):
+        """Add all the rows of an iterable (or of another ResultSet)"""
+        if isinstance(rows, ResultSet):
+            for variable in rows.vars:
+                self._add_variable(variable)
+            for variable in self.vars:
+                if variable in rows._columns:
+                    self._columns[variable].extend(rows._columns[variable])
+                else:
+                    self._columns[variable].extend([None] * len(rows))
+            self._length += len(rows)
+        else:
+            for row in rows:
+                self.append(row)
+
+    def column(self, variable):
+        """Get the list of values of a variable"""
+        return self._columns[variable]
+
+    def to_list(self):
+        """Get the rows as a list of {variable: value} dicts"""
+        return [dict(row) for row in self]
+
+    def __json__(self, request):
+        return self.to_list()
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for index in range(self._length):
+            yield ResultRow(self, index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            result_set = ResultSet()
+            result_set.vars = list(self.vars)
+            result_set._columns = {variable: column[index] for variable, column in self._columns.items()}
+            result_set._length = len(range(*index.indices(self._length)))
+            return result_set
+
+        if index < 0:
+            index += self._length
+        if index < 0 or index >= self._length:
+            raise IndexError("ResultSet index out of range")
+        return ResultRow(self, index)
+
+    def __add__(self, other):
+        result_set = ResultSet(rows=self)
+        result_set.extend(other)
+        return result_set
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __eq__(self, other):
+        if not isinstance(other, (ResultSet, list)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __repr__(self):
+        return repr(self.to_list())
+
+
+class ChainedResultsStream(object):
+    """
+    The rows of a ResultSet followed by the rest of a results stream: the
+    results read before knowing they were too large to be kept in memory
+    (see QueryLauncher.buffer_results)
+    """
+
+    def __init__(self, head, rows, stream=None):
+        """
+        :param head: the ResultSet of the rows already read
+        :param rows: the iterator of the other rows
+        :param stream: the results stream of rows, closed by close()
+        """
+        self.head = head
+        self.rows = rows
+        self.stream = stream
+        self.vars = head.vars
+
+    def close(self):
+        if hasattr(self.stream, 'close'):
+            self.stream.close()
+
+    def __iter__(self):
+        head, self.head = self.head, ResultSet()
+        for row in head:
+            yield row
+        del head
+        for row in self.rows:
+            yield row
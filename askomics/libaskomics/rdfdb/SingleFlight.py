@@ -0,0 +1,99 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import threading
+
+class SingleFlight(object):
+    """
+    The SingleFlight coalesces identical calls running at the same time:
+        - the first caller of a key (the leader) runs the function,
+        - the callers arriving with the same key while it runs wait for it,
+          and get the same result (or the same exception).
+    The errors proper to the leader (its cancellation, its deadline...) are
+    not shared: a waiter calls again, as the new leader if none is running.
+    A result that can not be shared (see do) is not either: each waiter
+    runs the function then.
+    Nothing is kept once the leader is done, this is not a cache.
+    """
+
+    # the seconds between two checks of a waiter
+    WAIT_INTERVAL = 0.2
+
+    class _Call(object):
+        __slots__ = ('done', 'result', 'error', 'waiters')
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.waiters = 0
+
+    def __init__(self):
+        self.log = logging.getLogger(__name__)
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, private_errors=(), check=None, shareable=None):
+        """Run function, or wait for the running call of the same key
+
+        :param key: hashable identifier of the call
+        :param function: callable without argument computing the result
+        :param private_errors: the exception types of the leader not given to the waiters
+        :param check: callable run by a waiter between two waits, it raises to
+                      stop waiting, and returns the seconds it can still wait
+                      (None if no limit)
+        :param shareable: callable checking that a result of the leader can be
+                          given to the waiters, all of them can if None
+        :returns: the result of function
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = SingleFlight._Call()
+                    self._calls[key] = call
+                else:
+                    call.waiters += 1
+
+            if leader:
+                break
+
+            self.log.debug("wait for the identical call in flight")
+            self._wait(call, check)
+            if call.error is None:
+                if shareable is None or shareable(call.result):
+                    return call.result
+                self.log.debug("result of the identical call not shared, call again")
+                return function()
+            if not isinstance(call.error, private_errors):
+                raise call.error
+            self.log.debug("identical call failed on its own (%s), call again", type(call.error).__name__)
+
+        try:
+            call.result = function()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            if call.waiters:
+                self.log.debug("result shared with %d identical call(s)", call.waiters)
+
+        return call.result
+
+    def _wait(self, call, check):
+        """Wait for a call, checking the waiter between slices of WAIT_INTERVAL at most"""
+        if check is None:
+            call.done.wait()
+            return
+
+        while not call.done.is_set():
+            remaining = check()
+            interval = self.WAIT_INTERVAL if remaining is None else max(0, min(self.WAIT_INTERVAL, remaining))
+            call.done.wait(interval)
+
+    def __len__(self):
+        return len(self._calls)
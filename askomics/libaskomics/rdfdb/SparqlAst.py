@@ -0,0 +1,334 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A small SPARQL syntax tree, serialized to a canonical text:
+the same logical query gives the same text, whatever the order in which
+its constraints were built (see Block), and the same fingerprint.
+
+    Pattern: a constraint (triple pattern, FILTER, BIND, VALUES...)
+    Block: a group of Pattern and Block, with a keyword (OPTIONAL, SERVICE <e>...)
+    SelectQuery: SELECT DISTINCT ... FROM ... WHERE { Block } post action
+"""
+import re
+import hashlib
+import itertools
+
+class Pattern(object):
+    """A constraint of a group, its text is normalized (single spaces)"""
+
+    TRIPLE, FILTER, VALUES, BIND, OTHER = 'triple', 'filter', 'values', 'bind', 'other'
+
+    # quoted strings and IRIs are kept as is, spaces are collapsed elsewhere
+    RE_TOKEN = re.compile(r'(?:"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|<[^>\s]*>|[^\s"\'])+')
+    RE_KIND = re.compile(r'(?i)^(FILTER|VALUES|BIND|OPTIONAL|MINUS|SERVICE|GRAPH|UNION|[{}#])')
+    RE_VARIABLE = re.compile(r'[?$]\w+')
+    # the comments, outside the quoted strings and the IRIs
+    RE_COMMENT = re.compile(r'''("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|<[^>\s]*>)|#[^\n]*''')
+    # the terms of the triple patterns: quoted strings (with their language
+    # or datatype), IRIs, separators, and the other terms, whose dots are not
+    # followed by a space
+    RE_TERM = re.compile(r'''(?:"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')(?:@[\w-]+|\^\^(?:<[^>\s]*>|[^\s.;,]+))?'''
+                         r'''|<[^>\s]*>|[.;,]|(?:[^\s.;,"'<]|\.(?=[^\s.;,]))+''')
+    # a predicate which is not a property path
+    RE_PREDICATE = re.compile(r'^(?:a|<[^>\s]*>|[?$]\w+|[\w-]*:[^\s/|^*+?!()<>]*)$')
+
+    def __init__(self, text):
+        # the comments would hide the next lines once the spaces are collapsed
+        uncommented = self.RE_COMMENT.sub(lambda match: match.group(1) or '', text)
+        if uncommented.strip():
+            text = uncommented
+
+        tokens = self.RE_TOKEN.findall(text)
+        if ''.join(tokens) != ''.join(text.split()):
+            # unbalanced quotes, the text is kept as is
+            tokens = [text.strip()]
+        self.text = self.strip_terminator(' '.join(tokens))
+
+        match = self.RE_KIND.match(self.text)
+        if match is None:
+            self.kind = self.TRIPLE
+        else:
+            self.kind = {'FILTER': self.FILTER, 'VALUES': self.VALUES,
+                         'BIND': self.BIND}.get(match.group(1).upper(), self.OTHER)
+
+    @staticmethod
+    def strip_terminator(text):
+        """Remove the final . of a constraint, not the one of a number (1.)"""
+        text = text.rstrip()
+        while text.endswith('.') and not text[:-1].endswith(tuple('0123456789')):
+            text = text[:-1].rstrip()
+        return text
+
+    def variables(self):
+        return set(self.RE_VARIABLE.findall(self.text))
+
+    def triples(self):
+        """
+        Get the triples of a triple pattern constraint ('?a :p ?b ; :q ?c'
+        gives '?a :p ?b' and '?a :q ?c'), None if it can not be split: property
+        paths, blank nodes [...] and collections (...)
+        """
+        terms = self.RE_TERM.findall(self.text)
+        if ''.join(''.join(terms).split()) != ''.join(self.text.split()):
+            return None
+
+        triples = []
+        subject = predicate = None
+        expected = 'subject'
+        for term in terms + ['.']:
+            if expected == 'separator':
+                expected = {'.': 'subject', ';': 'predicate', ',': 'object'}.get(term)
+                if expected is None:
+                    return None
+            elif term == '.' and expected in ('subject', 'predicate') and (triples or expected == 'subject'):
+                # an empty statement, or a ; before the end of the statement
+                expected = 'subject'
+            elif term in '.;,' or term[0] in '[(' or term[-1] in '])':
+                return None
+            elif expected == 'subject':
+                subject, expected = term, 'predicate'
+            elif expected == 'predicate':
+                if not self.RE_PREDICATE.match(term):
+                    return None
+                predicate, expected = term, 'object'
+            else:
+                triples.append(' '.join((subject, predicate, term)))
+                expected = 'separator'
+
+        return triples if expected == 'subject' and triples else None
+
+    def to_sparql(self, tabul='', graphs=None, counter=None, estimate=None, bound=None):
+        """
+        Serialize the constraint
+        :param graphs: the graphs scoping the triple patterns (see Block.to_sparql),
+                       each triple of the constraint gets its own GRAPH
+        """
+        if graphs is not None and self.kind == self.TRIPLE:
+            req = ''
+            for triple in self.triples() or [self.text]:
+                var = "?askomics_graph" + str(next(counter))
+                req += (tabul + "GRAPH " + var + " { " + triple + " }\n" +
+                        tabul + "VALUES " + var + " { " + graphs + " }\n")
+            return req
+        if self.text.endswith('.'):
+            # a number ending with a dot (1.) is read with the dot as its end
+            return tabul + self.text + "\n"
+        return tabul + self.text + ".\n"
+
+class Block(object):
+    """
+    A group of constraints. In the canonical text, the triple patterns, FILTER,
+    VALUES and nested groups between two order dependent elements (OPTIONAL,
+    MINUS, BIND, SERVICE...) are sorted, as their order does not change
+    the results.
+    """
+
+    # the keywords of the blocks joined with the group, they are sorted too
+    JOINED = ('', 'GRAPH')
+
+    def __init__(self, children=None, keyword=''):
+        self.children = children if children is not None else []
+        self.keyword = ' '.join(keyword.split())
+
+    @classmethod
+    def from_json(cls, constraints):
+        """
+        Compile the constraints of the AskOmics graph:
+        B ==> [ A , KEYWORKD ] . KEYWORKD is a string prefix for BLOCK (ex: OPTIONAL, SERVICE)
+        A ==> [ ((B|F),)+ ] . a list of Block or constraints leafs
+        F ==> [ CONSTRAINT1, CONSTRAINT2,.... ] an array contains only constraints
+        """
+        if len(constraints) == 2 and isinstance(constraints[0], list) and isinstance(constraints[1], str):
+            return cls(cls.from_json(constraints[0]).children, constraints[1])
+
+        children = []
+        for elt in constraints:
+            if isinstance(elt, str):
+                children.append(Pattern(elt))
+            elif isinstance(elt, list) and len(elt) == 2 and isinstance(elt[0], list) and isinstance(elt[1], str):
+                block = cls.from_json(elt[0])
+                if elt[1] != "":
+                    children.append(cls(block.children, elt[1]))
+                else:
+                    # a group without keyword is joined with its parent
+                    children.extend(block.children)
+            else:
+                raise ValueError("build_recursive_block:: constraint malformed :" + str(elt))
+        return cls(children)
+
+    def is_joined(self):
+        return self.keyword.split(' ', 1)[0].upper() in self.JOINED
+
+    def is_scopable(self):
+        """
+        Check if the triples can be scoped each by its own GRAPH (see to_sparql).
+        The constraints that can not be split in triples (see Pattern.triples)
+        may join several graphs, as with FROM, the query must keep FROM then.
+        """
+        if self.keyword.upper().startswith('SERVICE'):
+            return True
+        for child in self.children:
+            if isinstance(child, Block):
+                if not child.is_scopable():
+                    return False
+            elif child.kind == Pattern.TRIPLE and child.triples() is None:
+                return False
+            elif child.kind == Pattern.OTHER and child.text.split(' ', 1)[0].upper() not in ('GRAPH', 'SERVICE', '#'):
+                # a group given as text
+                return False
+        return True
+
+    def variables(self):
+        return set().union(*[child.variables() for child in self.children])
+
+    @staticmethod
+    def order_segment(segment, estimate, bound):
+        """
+        Order the triple patterns of a segment by their estimated number of
+        solutions, each one given the variables bound by the previous ones
+        """
+        triples = [child for child in segment if isinstance(child, Pattern) and child.kind == Pattern.TRIPLE]
+        if estimate is None or len(triples) < 2:
+            return segment
+
+        bound = set(bound)
+        ordered = []
+        while triples:
+            estimates = [estimate(triple.text, bound) for triple in triples]
+            if None in estimates:
+                # no statistics
+                return segment
+            best = min(range(len(triples)), key=lambda i: (estimates[i], triples[i].text))
+            ordered.append(triples.pop(best))
+            bound |= ordered[-1].variables()
+
+        return ordered + [child for child in segment if child not in ordered]
+
+    def canonical_children(self, estimate=None, bound=None):
+        """
+        Get the children in canonical order
+        :param estimate: function (triple pattern, bound variables) giving its
+                         estimated number of solutions, or None if unknown.
+                         The triple patterns are then ordered by selectivity.
+        :param bound: the variables bound before the block
+        """
+        ordered = []
+        segment = []
+        bound = set(bound or ())
+
+        def sort_key(child):
+            if isinstance(child, Pattern):
+                rank = {Pattern.TRIPLE: 0, Pattern.VALUES: 1, Pattern.FILTER: 3}[child.kind]
+                return (rank, child.text)
+            return (2, child.to_sparql())
+
+        def flush():
+            ordered.extend(self.order_segment(sorted(segment, key=sort_key), estimate, bound))
+            for child in segment:
+                bound.update(child.variables())
+
+        for child in self.children:
+            if (isinstance(child, Pattern) and child.kind in (Pattern.TRIPLE, Pattern.VALUES, Pattern.FILTER)) or \
+               (isinstance(child, Block) and child.is_joined()):
+                segment.append(child)
+            else:
+                flush()
+                ordered.append(child)
+                bound.update(child.variables())
+                segment = []
+        flush()
+        return ordered
+
+    def to_sparql(self, tabul='', graphs=None, counter=None, estimate=None, bound=None):
+        """
+        Serialize the group in canonical order (see canonical_children)
+        :param graphs: graphs scoping each triple pattern, in its own
+                       GRAPH ?askomics_graphN { ... } VALUES ?askomics_graphN { graphs }
+                       (not in the SERVICE blocks)
+        """
+        if graphs is not None and not isinstance(graphs, str):
+            graphs = ' '.join('<' + graph + '>' for graph in sorted(set(graphs)))
+            counter = itertools.count(1)
+
+        if self.keyword.upper().startswith('SERVICE'):
+            # the graphs of the local triplestore do not scope a remote endpoint,
+            # neither do its statistics
+            graphs = None
+            estimate = None
+
+        inner = tabul + '\t' if self.keyword else tabul
+        req = ''
+        bound = set(bound or ())
+        for child in self.canonical_children(estimate, bound):
+            req += child.to_sparql(inner, graphs, counter, estimate, bound)
+            bound.update(child.variables())
+        if self.keyword:
+            return tabul + self.keyword + " {\n" + req + tabul + "}\n"
+        return req
+
+    def plan(self, estimate=None, bound=None, depth=0):
+        """
+        Get the constraints in the order of the canonical text, with the
+        estimated number of solutions of the triple patterns (None if unknown):
+        [{'depth': 0, 'pattern': '?s rdf:type :gene', 'estimate': 120}, ...]
+        A nested block is its keyword followed by its constraints at depth + 1.
+        """
+        if self.keyword.upper().startswith('SERVICE'):
+            estimate = None
+
+        steps = []
+        bound = set(bound or ())
+        for child in self.canonical_children(estimate, bound):
+            if isinstance(child, Block):
+                steps.append({'depth': depth, 'pattern': child.keyword or '{}', 'estimate': None})
+                steps.extend(child.plan(estimate, bound, depth + 1))
+            else:
+                steps.append({'depth': depth, 'pattern': child.text,
+                              'estimate': estimate(child.text, bound)
+                                          if estimate is not None and child.kind == Pattern.TRIPLE else None})
+            bound.update(child.variables())
+        return steps
+
+class SelectQuery(object):
+    """
+    A SELECT DISTINCT query. The projection keeps its order (the columns of the
+    results), the FROM graphs are sorted. where is a Block or a text.
+    """
+
+    def __init__(self, select, where, graphs=None, post_action=None):
+        self.select = select
+        self.where = where
+        self.graphs = sorted(set(graphs)) if graphs else []
+        self.post_action = post_action
+
+    def get_select(self):
+        """The projection, without spaces differences nor duplicated variables"""
+        if not isinstance(self.select, str):
+            variables = self.select
+        elif '(' in self.select:
+            # expressions, kept as is
+            return ' '.join(self.select.split())
+        else:
+            variables = self.select.split()
+        return ' '.join(variable for i, variable in enumerate(variables) if variable not in variables[:i])
+
+    def get_where(self):
+        if isinstance(self.where, Block):
+            return self.where.to_sparql()
+        return self.where + "\n"
+
+    def to_sparql(self):
+        """Serialize the query in its canonical text"""
+        query = "SELECT DISTINCT " + self.get_select() + "\n"
+        for graph in self.graphs:
+            query += "FROM <" + graph + ">\n"
+        query += "WHERE {\n"
+        query += self.get_where()
+        query += "}\n"
+        if self.post_action:
+            query += self.post_action + "\n"
+        return query
+
+    def fingerprint(self):
+        """Get the sha1 of the canonical text, for the caches and the metrics"""
+        return hashlib.sha1(self.to_sparql().encode('utf-8')).hexdigest()
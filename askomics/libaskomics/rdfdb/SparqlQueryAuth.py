@@ -5,240 +5,324 @@ import random
 
 # from askomics.libaskomics.ParamManager import ParamManager
 from askomics.libaskomics.rdfdb.SparqlQueryBuilder import SparqlQueryBuilder
+from askomics.libaskomics.rdfdb.SparqlTemplate import SparqlTemplate
 
 class SparqlQueryAuth(SparqlQueryBuilder):
     """
     This class contain method to build a sparql query to
     extract data from the users graph
+    The queries are SparqlTemplate, compiled once.
     """
 
+    CHECK_USERNAME_PRESENCE = SparqlTemplate.select(
+        '?status',
+        'GRAPH $users_graph {' +
+        'BIND(EXISTS {$user rdf:type foaf:Person} AS ?status)' +
+        '}',
+        users_graph='iri', user='local')
+
+    CHECK_EMAIL_PRESENCE = SparqlTemplate.select(
+        '?status',
+        'GRAPH $users_graph {' +
+        'BIND(EXISTS { ?uri foaf:mbox $email } AS ?status)' +
+        '}',
+        users_graph='iri', email='iri')
+
+    USERNAME_BY_EMAIL = SparqlTemplate.select(
+        '?username',
+        '?URIusername rdf:type foaf:Person .\n' +
+        '?URIusername foaf:name ?username .\n' +
+        '?URIusername foaf:mbox $email .',
+        email='iri')
+
+    PASSWORD_WITH_EMAIL = SparqlTemplate.select(
+        '?salt ?shapw',
+        'GRAPH $users_graph {' +
+        '\t?URIusername rdf:type foaf:Person .\n' +
+        '\t?URIusername foaf:mbox $email .\n' +
+        '\t?URIusername :randomsalt ?salt .\n' +
+        '\t?URIusername :password ?shapw .\n' +
+        '}',
+        users_graph='iri', email='iri')
+
+    PASSWORD_WITH_USERNAME = SparqlTemplate.select(
+        '?salt ?shapw',
+        'GRAPH $users_graph {' +
+        '\t?URIusername rdf:type foaf:Person .\n' +
+        '\t?URIusername foaf:name $username .\n' +
+        '\t?URIusername :randomsalt ?salt .\n' +
+        '\t?URIusername :password ?shapw .\n' +
+        '}',
+        users_graph='iri', username='literal')
+
+    NUMBER_OF_USERS = SparqlTemplate.select(
+        '(count(*) AS ?count)',
+        'GRAPH $users_graph {' +
+        '?s rdf:type foaf:Person .\n' +
+        '}',
+        users_graph='iri')
+
+    ADMIN_BLOCKED_BY_USERNAME = SparqlTemplate.select(
+        '?admin ?blocked',
+        'GRAPH $users_graph {' +
+        '\t?URIusername rdf:type foaf:Person .\n' +
+        '\t?URIusername foaf:name $username .\n' +
+        '\t?URIusername :isadmin ?admin .\n' +
+        '\t?URIusername :isblocked ?blocked .' +
+        '}',
+        users_graph='iri', username='literal')
+
+    OWNER_APIKEY = SparqlTemplate.select(
+        '?username',
+        'GRAPH $users_graph {' +
+        '\t?URIusername rdf:type foaf:Person .\n' +
+        '\t?URIusername :keyid ?keyid .\n' +
+        '\t?keyid :key $key .\n' +
+        '\t?URIusername foaf:name ?username .\n' +
+        '}',
+        users_graph='iri', key='literal')
+
+    KEY_BELONG_USER = SparqlTemplate.select(
+        '(COUNT(*) AS ?count)',
+        'GRAPH $users_graph {' +
+        '\n?URIusername rdf:type foaf:Person .\n' +
+        '\t?URIusername foaf:name $username .\n' +
+        '\t?URIusername :keyid ?URIkeyid .\n' +
+        '\t?URIkeyid :key $key' +
+        '}',
+        users_graph='iri', username='literal', key='literal')
+
+    ADMIN_BLOCKED_BY_EMAIL = SparqlTemplate.select(
+        '?admin ?blocked',
+        'GRAPH $users_graph {' +
+        '\n?URIusername rdf:type foaf:Person .\n' +
+        '\t?URIusername foaf:mbox $email .\n' +
+        '\t?URIusername :isadmin ?admin .\n' +
+        '\t?URIusername :isblocked ?blocked .' +
+        '}',
+        users_graph='iri', email='iri')
+
+    USERS_INFOS = SparqlTemplate.select(
+        '?username ?email ?admin ?blocked',
+        'GRAPH $users_graph {' +
+        '\t?URIusername rdf:type foaf:Person .\n' +
+        '\t?URIusername foaf:name ?username .\n' +
+        '\t?URIusername foaf:mbox ?email .\n' +
+        '\t?URIusername :isadmin ?admin .\n' +
+        '\t?URIusername :isblocked ?blocked .' +
+        '\tFILTER NOT EXISTS { ?URIusername foaf:name $username . }\n' +
+        '}',
+        users_graph='iri', username='literal')
+
+    USER_INFOS = SparqlTemplate.select(
+        '?email ?admin ?blocked ?keyname ?apikey ?Gurl ?Gkey',
+        'GRAPH $users_graph {' +
+        '\t?URIusername rdf:type foaf:Person .\n' +
+        '\t?URIusername foaf:name $username .\n' +
+        '\t?URIusername foaf:mbox ?email .\n' +
+        '\t?URIusername :isadmin ?admin .\n' +
+        '\t?URIusername :isblocked ?blocked .\n\n' +
+        '\tOPTIONAL {\n' +
+        '\t?URIusername :keyid ?URIkeyid .\n' +
+        '\t?URIkeyid rdfs:label ?keyname .\n' +
+        '\t?URIkeyid :key ?apikey .\n' +
+        '\t}\n' +
+        '\tOPTIONAL {\n' +
+        '\t?URIusername :galaxy_instance ?Ginstance .\n' +
+        '\t?Ginstance rdf:type :galaxy .\n' +
+        '\t?Ginstance :galaxy_url ?Gurl .\n' +
+        '\t?Ginstance :galaxy_key ?Gkey .\n' +
+        '\t}\n' +
+        '}',
+        users_graph='iri', username='literal')
+
+    GALAXY_INFOS = SparqlTemplate.select(
+        '?url ?key',
+        'GRAPH $users_graph {\n' +
+        '\t?URIusername rdf:type foaf:Person .\n' +
+        '\t?URIusername foaf:name $username .\n' +
+        '\t?URIusername :galaxy_instance ?Ginstance .\n' +
+        '\t?Ginstance rdf:type :galaxy .\n' +
+        '\t?Ginstance :galaxy_url ?url .\n' +
+        '\t?Ginstance :galaxy_key ?key .\n' +
+        '}',
+        users_graph='iri', username='literal')
+
+    ADMINS_EMAILS = SparqlTemplate.select(
+        '?email',
+        'GRAPH $users_graph {' +
+        '\t?URIusername rdf:type foaf:Person .\n' +
+        '\t?URIusername foaf:mbox ?email .\n' +
+        '\t?URIusername :isadmin "true"^^xsd:boolean .\n' +
+        '}',
+        users_graph='iri')
+
+    CHECK_GALAXY = SparqlTemplate.select(
+        '?status',
+        'GRAPH $users_graph {' +
+        'BIND(EXISTS {$user :galaxy_instance ?Ginstance} AS ?status)' +
+        '}',
+        users_graph='iri', user='local')
+
+    UPDATE_MAIL = SparqlTemplate("""
+            WITH GRAPH $users_graph
+            DELETE { $user foaf:mbox ?email }
+            INSERT { $user foaf:mbox $email }
+            WHERE { $user foaf:mbox ?email }
+            """, users_graph='iri', user='local', email='iri')
+
+    UPDATE_PASSWD = SparqlTemplate("""
+            WITH GRAPH $users_graph
+            DELETE { $user :password ?passwd .
+                     $user :randomsalt ?salt . }
+            INSERT { $user :password $shapw .
+                     $user :randomsalt $salt . }
+            WHERE { $user :password ?passwd .
+                    $user :randomsalt ?salt . }
+            """, users_graph='iri', user='local', shapw='literal', salt='literal')
+
+    ADD_APIKEY = SparqlTemplate("""
+            INSERT DATA {
+                GRAPH $users_graph {
+                    $user :keyid $keyid .
+                    $keyid rdf:type :apikey .
+                    $keyid rdfs:label $keyname .
+                    $keyid :key $key .
+                }
+            }
+            """, users_graph='iri', user='local', keyid='local', keyname='literal', key='literal')
+
+    ADD_GALAXY = SparqlTemplate("""
+            INSERT DATA {
+                GRAPH $users_graph {
+                    $user :galaxy_instance $instance .
+                    $instance rdf:type :galaxy .
+                    $instance :galaxy_url $url .
+                    $instance :galaxy_key $key .
+                }
+            }
+            """, users_graph='iri', user='local', instance='local', url='literal', key='literal')
+
+    DELETE_APIKEY = SparqlTemplate("""
+            DELETE WHERE {
+                GRAPH $users_graph {
+                    ?URIusername :keyid ?URIkeyid .
+                    ?URIkeyid :key $key .
+                    ?URIkeyid rdf:type :apikey .
+                    ?URIkeyid rdfs:label ?keyname .
+                }
+            }
+            """, users_graph='iri', key='literal')
+
+    DELETE_GALAXY = SparqlTemplate("""
+            DELETE WHERE {
+                GRAPH $users_graph {
+                    $user :galaxy_instance ?Ginstance .
+                    ?Ginstance ?p ?o .
+                }
+            }
+            """, users_graph='iri', user='local')
+
     def __init__(self, settings, session):
         SparqlQueryBuilder.__init__(self, settings, session)
         self.log = logging.getLogger(__name__)
 
+    def render(self, template, **params):
+        """Render a template of the users graph"""
+        return template.render(self, users_graph=self.get_param("askomics.users_graph"), **params)
 
     def check_username_presence(self, username):
         """
         Check if a username is present in users graph
         """
-        return self.build_query_on_the_fly({
-            'select': '?status',
-            'query': "GRAPH <"+ self.get_param("askomics.users_graph") + "> {" +
-                     'BIND(EXISTS {:' + username + ' rdf:type foaf:Person} AS ?status)' +
-                     "}"
-        }, True)
+        return self.render(self.CHECK_USERNAME_PRESENCE, user=username)
 
     def check_email_presence(self, email):
         """
         Check if an email is present in users graph
         """
-        return self.build_query_on_the_fly({
-            'select': '?status',
-            'query': "GRAPH <"+ self.get_param("askomics.users_graph") + "> {" +
-                     'BIND(EXISTS { ?uri foaf:mbox <mailto:' + email + '> } AS ?status)'+
-                     "}"
-        }, True)
+        return self.render(self.CHECK_EMAIL_PRESENCE, email='mailto:' + email)
 
     def get_username_by_email(self, email):
         """Get usermail of a user by his email"""
 
-        return self.build_query_on_the_fly({
-            'select': '?username',
-            'query': '?URIusername rdf:type foaf:Person .\n' +
-                     '?URIusername foaf:name ?username .\n' +
-                     '?URIusername foaf:mbox <mailto:' + email + '> .'
-        }, True)
+        return self.USERNAME_BY_EMAIL.render(self, email='mailto:' + email)
 
     def get_password_with_email(self, email):
         """
         Check the password of a user by his email
         """
-        return self.build_query_on_the_fly({
-            'select': '?salt ?shapw',
-            'query': "GRAPH <"+ self.get_param("askomics.users_graph") + "> {" +
-                     '\t?URIusername rdf:type foaf:Person .\n' +
-                     '\t?URIusername foaf:mbox <mailto:' + email + '> .\n' +
-                     '\t?URIusername :randomsalt ?salt .\n' +
-                     '\t?URIusername :password ?shapw .\n'+
-                     "}"
-        }, True)
+        return self.render(self.PASSWORD_WITH_EMAIL, email='mailto:' + email)
 
     def get_password_with_username(self, username):
         """
         Check the password of a user by his username
         """
-        return self.build_query_on_the_fly({
-            'select': '?salt ?shapw',
-            'query': "GRAPH <"+ self.get_param("askomics.users_graph") + "> {" +
-                     '\t?URIusername rdf:type foaf:Person .\n' +
-                     '\t?URIusername foaf:name \"' + username + '\" .\n' +
-                     '\t?URIusername :randomsalt ?salt .\n' +
-                     '\t?URIusername :password ?shapw .\n'+
-                     "}"
-        }, True)
+        return self.render(self.PASSWORD_WITH_USERNAME, username=username)
 
     def get_number_of_users(self):
         """
         Get the number of users
         """
-        return self.build_query_on_the_fly({
-            'select': '(count(*) AS ?count)',
-            'query': "GRAPH <"+ self.get_param("askomics.users_graph") + "> {" +
-                     '?s rdf:type foaf:Person .\n'
-                     "}"
-        }, True)
+        return self.render(self.NUMBER_OF_USERS)
 
     def get_admin_blocked_by_username(self, username):
         """
         get if a user is admin, by his username
         """
-        return self.build_query_on_the_fly({
-            'select': '?admin ?blocked',
-            'query': "GRAPH <"+ self.get_param("askomics.users_graph") + "> {" +
-                     '\t?URIusername rdf:type foaf:Person .\n' +
-                     '\t?URIusername foaf:name \"' + username + '\" .\n' +
-                     '\t?URIusername :isadmin ?admin .\n'+
-                     '\t?URIusername :isblocked ?blocked .'
-                     "}"
-        }, True)
+        return self.render(self.ADMIN_BLOCKED_BY_USERNAME, username=username)
 
     def get_owner_apikey(self, key):
         """Get the owner of the API key"""
 
-        return self.build_query_on_the_fly({
-            'select': '?username',
-            'query': 'GRAPH <' + self.get_param('askomics.users_graph') + '> {' +
-                     '\t?URIusername rdf:type foaf:Person .\n' +
-                     '\t?URIusername :keyid ?keyid .\n' +
-                     '\t?keyid :key "' + key + '" .\n' +
-                     '\t?URIusername foaf:name ?username .\n' +
-                     '}'
-            }, True)
+        return self.render(self.OWNER_APIKEY, key=key)
 
 
     def ckeck_key_belong_user(self, username, key):
         """Chek if a key belong to a user"""
 
-        return self.build_query_on_the_fly({
-            'select': '(COUNT(*) AS ?count)',
-            'query': "GRAPH <"+ self.get_param("askomics.users_graph") + "> {" +
-                     '\n?URIusername rdf:type foaf:Person .\n' +
-                     '\t?URIusername foaf:name "' + username + '" .\n' +
-                     '\t?URIusername :keyid ?URIkeyid .\n'+
-                     '\t?URIkeyid :key "' + key + '"'
-                     "}"
-            }, True)
+        return self.render(self.KEY_BELONG_USER, username=username, key=key)
 
     def get_admin_blocked_by_email(self, email):
         """
         get if a user is admin, by his email
         """
-        return self.build_query_on_the_fly({
-            'select': '?admin ?blocked',
-            'query': "GRAPH <"+ self.get_param("askomics.users_graph") + "> {" +
-                     '\n?URIusername rdf:type foaf:Person .\n' +
-                     '\t?URIusername foaf:mbox <mailto:' + email + '> .\n' +
-                     '\t?URIusername :isadmin ?admin .\n'+
-                     '\t?URIusername :isblocked ?blocked .'
-                     "}"
-        }, True)
+        return self.render(self.ADMIN_BLOCKED_BY_EMAIL, email='mailto:' + email)
 
     def get_users_infos(self, username):
         """
         Get users infos exept me
         """
-        return self.build_query_on_the_fly({
-            'select': '?username ?email ?admin ?blocked',
-            'query': "GRAPH <"+ self.get_param("askomics.users_graph") + "> {" +
-                     '\t?URIusername rdf:type foaf:Person .\n' +
-                     '\t?URIusername foaf:name ?username .\n' +
-                     '\t?URIusername foaf:mbox ?email .\n' +
-                     '\t?URIusername :isadmin ?admin .\n'+
-                     '\t?URIusername :isblocked ?blocked .' +
-                     '\tFILTER NOT EXISTS { ?URIusername foaf:name "' + username + '" . }\n' +
-                     "}"
-        }, True)
+        return self.render(self.USERS_INFOS, username=username)
 
     def get_user_infos(self, username):
         """
         Get infos about one user
         """
-        return self.build_query_on_the_fly({
-            'select': '?email ?admin ?blocked ?keyname ?apikey ?Gurl ?Gkey',
-            'query': "GRAPH <"+ self.get_param("askomics.users_graph") + "> {" +
-                     '\t?URIusername rdf:type foaf:Person .\n' +
-                     '\t?URIusername foaf:name "' + username + '" .\n' +
-                     '\t?URIusername foaf:mbox ?email .\n' +
-                     '\t?URIusername :isadmin ?admin .\n'+
-                     '\t?URIusername :isblocked ?blocked .\n\n' +
-                     '\tOPTIONAL {\n' +
-                     '\t?URIusername :keyid ?URIkeyid .\n' +
-                     '\t?URIkeyid rdfs:label ?keyname .\n' +
-                     '\t?URIkeyid :key ?apikey .\n' +
-                     '\t}\n' +
-                     '\tOPTIONAL {\n' +
-                     '\t?URIusername :galaxy_instance ?Ginstance .\n' +
-                     '\t?Ginstance rdf:type :galaxy .\n' +
-                     '\t?Ginstance :galaxy_url ?Gurl .\n' +
-                     '\t?Ginstance :galaxy_key ?Gkey .\n' +
-                     '\t}\n' +
-                     "}"
-        }, True)
+        return self.render(self.USER_INFOS, username=username)
 
     def get_galaxy_infos(self, username):
         """Get Galaxy url and apikey of a user"""
 
-        return self.build_query_on_the_fly({
-            'select': '?url ?key',
-            'query': "GRAPH <"+ self.get_param("askomics.users_graph") + "> {\n" +
-                     '\t?URIusername rdf:type foaf:Person .\n' +
-                     '\t?URIusername foaf:name "' + username + '" .\n' +
-                     '\t?URIusername :galaxy_instance ?Ginstance .\n' +
-                     '\t?Ginstance rdf:type :galaxy .\n' +
-                     '\t?Ginstance :galaxy_url ?url .\n' +
-                     '\t?Ginstance :galaxy_key ?key .\n' +
-                     "}"
-            }, True)
+        return self.render(self.GALAXY_INFOS, username=username)
 
     def get_admins_emails(self):
         """
         Get emails of all admins
         """
-        return self.build_query_on_the_fly({
-            'select': '?email',
-            'query': "GRAPH <"+ self.get_param("askomics.users_graph") + "> {" +
-                     '\t?URIusername rdf:type foaf:Person .\n' +
-                     '\t?URIusername foaf:mbox ?email .\n' +
-                     '\t?URIusername :isadmin "true"^^xsd:boolean .\n'+
-                     "}"
-        }, True)
+        return self.render(self.ADMINS_EMAILS)
 
     def update_mail(self, username, email):
         """
         update the email of user
         """
-        return self.prepare_query(
-            """
-            WITH GRAPH <""" + self.get_param('askomics.users_graph') + """>
-            DELETE { :""" + username + """ foaf:mbox ?email }
-            INSERT { :""" + username + """ foaf:mbox <mailto:""" + email + """> }
-            WHERE { :""" + username + """ foaf:mbox ?email }
-            """)
+        return self.render(self.UPDATE_MAIL, user=username, email='mailto:' + email)
 
     def update_passwd(self, username, shapw, salt):
         """
         update the email of user
         """
-        return self.prepare_query(
-            """
-            WITH GRAPH <""" + self.get_param('askomics.users_graph') + """>
-            DELETE { :""" + username + """ :password ?passwd .
-                     :""" + username + """ :randomsalt ?salt . }
-            INSERT { :""" + username + """ :password \"""" + shapw + """\" .
-                     :""" + username + """ :randomsalt \"""" + salt + """\" . }
-            WHERE { :""" + username + """ :password ?passwd .
-                    :""" + username + """ :randomsalt ?salt . }
-            """)
+        return self.render(self.UPDATE_PASSWD, user=username, shapw=shapw, salt=salt)
 
     def add_apikey(self, username, keyname):
         """Insert a new api key"""
@@ -246,37 +330,14 @@ class SparqlQueryAuth(SparqlQueryBuilder):
         key = self.get_random_string(20)
         keyid = keyname + '_' + key[:5]
 
-        return self.prepare_query(
-            """
-            INSERT DATA {
-                GRAPH <""" + self.get_param('askomics.users_graph') + """> {
-                    :""" + username + """ :keyid :""" + keyid + """ .
-                    :""" + keyid + """ rdf:type :apikey .
-                    :""" + keyid + """ rdfs:label \"""" + keyname + """\" .
-                    :""" + keyid + """ :key \"""" + key + """\" .
-                }
-            }
-            """)
+        return self.render(self.ADD_APIKEY, user=username, keyid=keyid, keyname=keyname, key=key)
 
     def add_galaxy(self, username, url, key):
         """Insert a galaxy instance (url + api key)"""
 
         instance = 'galaxy_' + self.get_random_string(5)
 
-        query = self.prepare_query(
-            """
-            INSERT DATA {
-                GRAPH <""" + self.get_param('askomics.users_graph') + """> {
-                    :""" + username + """ :galaxy_instance :""" + instance + """ .
-                    :""" + instance + """ rdf:type :galaxy .
-                    :""" + instance + """ :galaxy_url \"""" + url +"""\" .
-                    :""" + instance + """ :galaxy_key \"""" + key +"""\" .
-                }
-            }
-            """)
-
-        self.log.debug(query)
-        return query
+        return self.render(self.ADD_GALAXY, user=username, instance=instance, url=url, key=key)
 
     @staticmethod
     def get_random_string(number):
@@ -291,38 +352,15 @@ class SparqlQueryAuth(SparqlQueryBuilder):
         """
         Delet all info of a user
         """
-        return self.prepare_query(
-            """
-            DELETE WHERE {
-                GRAPH <"""+self.get_param('askomics.users_graph')+"""> {
-                    ?URIusername :keyid ?URIkeyid .
-                    ?URIkeyid :key \"""" + key + """\" .
-                    ?URIkeyid rdf:type :apikey .
-                    ?URIkeyid rdfs:label ?keyname .
-                }
-            }
-            """)
+        return self.render(self.DELETE_APIKEY, key=key)
 
     def delete_galaxy(self, username):
         """delete galaxy triples of a user"""
 
-        return self.prepare_query(
-            """
-            DELETE WHERE {
-                GRAPH <"""+self.get_param('askomics.users_graph')+"""> {
-                    :""" + username + """ :galaxy_instance ?Ginstance .
-                    ?Ginstance ?p ?o .
-                }
-            }
-            """)
+        return self.render(self.DELETE_GALAXY, user=username)
 
     def check_galaxy(self, username):
         """
         Check if user have a galaxy
         """
-        return self.build_query_on_the_fly({
-            'select': '?status',
-            'query': "GRAPH <"+ self.get_param("askomics.users_graph") + "> {" +
-                     'BIND(EXISTS {:' + username + ' :galaxy_instance ?Ginstance} AS ?status)' +
-                     "}"
-        }, True)
+        return self.render(self.CHECK_GALAXY, user=username)
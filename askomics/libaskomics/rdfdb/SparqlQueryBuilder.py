@@ -6,6 +6,8 @@ from string import Template
 
 from askomics.libaskomics.rdfdb.QueryLauncher import QueryLauncher
 from askomics.libaskomics.rdfdb.MultipleQueryLauncher import MultipleQueryLauncher
+from askomics.libaskomics.rdfdb.GraphAccessCache import GraphAccessCache
+from askomics.libaskomics.rdfdb.SparqlAst import SelectQuery
 from askomics.libaskomics.ParamManager import ParamManager
 from askomics.libaskomics.EndpointManager import EndpointManager
 # from askomics.libaskomics.utils import prefix_lines
@@ -21,8 +23,39 @@ class SparqlQueryBuilder(ParamManager):
         ParamManager.__init__(self, settings, session)
         self.log = logging.getLogger(__name__)
 
+        # the endpoints that could not be reached by the last graph queries
+        self.unreachable_endpoints = []
+
     def getGraphUser(self,removeGraph=[]):
+        """
+        Get the graphs visible by the user, by endpoint.
+        The map is cached per user, see GraphAccessCache.
+        """
         self.log.debug("=== setGraphUser ===")
+
+        cache = GraphAccessCache.get_cache(self)
+        key = (self.get_param("askomics.endpoint"), self.session['username'])
+        settings = cache.get(key)
+        if settings is None:
+            stamp = cache.stamp()
+            em = EndpointManager(self.settings, self.session)
+            self.unreachable_endpoints = []
+            settings = self.queryGraphUser(em)
+            # an endpoint that did not answer is missing from the map, do not keep it
+            if not self.unreachable_endpoints:
+                cache.put(key, settings, stamp)
+
+        if removeGraph:
+            for endpoint in settings.values():
+                for access in ('private', 'public'):
+                    if access in endpoint:
+                        endpoint[access] = [g for g in endpoint[access] if g not in removeGraph]
+
+        self.log.debug("setting:\n"+str(settings))
+        return settings
+
+    def queryGraphUser(self, em):
+        """Query the graphs visible by the user on all the endpoints of em"""
         settings = {}
         #finding all private graph graph
 
@@ -45,8 +78,6 @@ class SparqlQueryBuilder(ParamManager):
         for elt in results:
             if 'g' not in elt:
                 continue
-            if elt['g'] in removeGraph:
-                continue
             settings[endpoint]['private'].append(elt['g'])
 
         #finding all public graph on all Askomics endpoint
@@ -60,9 +91,9 @@ class SparqlQueryBuilder(ParamManager):
         }, True)
 
         ql = MultipleQueryLauncher(self.settings, self.session)
-        em = EndpointManager(self.settings, self.session)
 
         results = ql.process_query(query,em.list_endpoints(),indexByEndpoint=True)
+        self.unreachable_endpoints.extend(ql.unreachable_endpoints)
 
         for endpoint in results:
             if endpoint not in settings:
@@ -71,8 +102,6 @@ class SparqlQueryBuilder(ParamManager):
 
             settings[endpoint]['public'] = []
             for elt in results[endpoint]:
-                if elt['g'] in removeGraph:
-                    continue
                 settings[endpoint]['public'].append(elt['g'])
 
 
@@ -90,14 +119,12 @@ class SparqlQueryBuilder(ParamManager):
         }, True)
 
         ql = MultipleQueryLauncher(self.settings, self.session)
-        em = EndpointManager(self.settings, self.session)
 
         results = ql.process_query(query,em.list_endpoints(),indexByEndpoint=True)
+        self.unreachable_endpoints.extend(ql.unreachable_endpoints)
 
         for endpoint in results:
             for elt in results[endpoint]:
-                if elt['g'] in removeGraph:
-                    continue
                 if elt['endpoint'] not in settings:
                     settings[elt['endpoint']] = {}
                     settings[elt['endpoint']]['type'] = 'external'
@@ -105,13 +132,20 @@ class SparqlQueryBuilder(ParamManager):
 
                 settings[elt['endpoint']]['public'].append(elt['g'])
 
-        self.log.debug("setting:\n"+str(settings))
         return settings
 
     def getExternalServiceEndpoint(self):
         """
             Get all external endpoint finding in all askomics endpoint
+            The map is cached with the graphs of the users, see GraphAccessCache.
         """
+        cache = GraphAccessCache.get_cache(self)
+        key = ('external_services', self.get_param("askomics.endpoint"))
+        settings = cache.get(key)
+        if settings is not None:
+            return settings
+        stamp = cache.stamp()
+
         query = self.build_query_on_the_fly({
             'select': '?name ?url ?description ?class',
             'query': ''+
@@ -130,6 +164,7 @@ class SparqlQueryBuilder(ParamManager):
         em = EndpointManager(self.settings, self.session)
 
         results = ql.process_query(query,em.list_endpoints())
+        self.unreachable_endpoints = ql.unreachable_endpoints
 
         settings = {}
         settings['endpoints'] = {}
@@ -149,12 +184,51 @@ class SparqlQueryBuilder(ParamManager):
 
         self.log.debug("==================== EXTERNAL ENDPOINT ========================")
         self.log.debug(settings)
+
+        # an endpoint that did not answer is missing from the map, do not keep it
+        if not self.unreachable_endpoints:
+            cache.put(key, settings, stamp)
         return settings
 
 
+    def get_graph_scoping(self, graph_count):
+        """
+        Get how a query on graph_count graphs of the local triplestore is scoped:
+            - 'from': a FROM clause per graph,
+            - 'values': each triple pattern in GRAPH ?g { ... } VALUES ?g { ... }
+        askomics.graph_scoping is a mode, or a list of type:mode for each
+        triplestore type (see get_triplestore_type). The mode 'auto' is
+        'values' above askomics.graph_scoping_threshold graphs.
+        """
+        scoping = "virtuoso:from,fuseki:auto,generic:from"
+        if self.is_defined("askomics.graph_scoping"):
+            scoping = self.get_param("askomics.graph_scoping")
+
+        triplestore = self.get_triplestore_type()
+        mode = 'from'
+        for item in scoping.split(','):
+            item = item.strip().lower()
+            if ':' not in item:
+                mode = item
+            elif item.split(':', 1)[0] == triplestore:
+                mode = item.split(':', 1)[1]
+                break
+
+        if mode == 'auto':
+            threshold = 50
+            if self.is_defined("askomics.graph_scoping_threshold"):
+                threshold = int(self.get_param("askomics.graph_scoping_threshold"))
+            mode = 'values' if graph_count > threshold else 'from'
+
+        if mode not in ('from', 'values'):
+            raise ValueError("Unknown graph scoping: " + mode)
+        return mode
+
     def build_query_on_the_fly(self, replacement, adminrequest=False, externalrequest= False):
         """
         Build a query from the private or public template
+        With replacement['scoped'], the query scopes its graphs itself (see
+        get_graph_scoping), no FROM clause is added.
         """
         for elt in ['query', 'select']:
             if not elt in replacement:
@@ -165,14 +239,14 @@ class SparqlQueryBuilder(ParamManager):
         self.log.debug("select:\n:"+replacement['select'])
         self.log.debug("query:\n:"+replacement['query'])
 
-        query = ""
-        query += "SELECT DISTINCT "+replacement['select']+"\n"
+        listfrom = []
 
         #security test
         if not 'admin' in self.session or not isinstance(self.session['admin'], bool):
             self.session['admin'] = False
         # ADM can query on all database !
-        if not externalrequest and (not isinstance(adminrequest, bool) or not adminrequest):
+        if not externalrequest and not replacement.get('scoped') and \
+                (not isinstance(adminrequest, bool) or not adminrequest):
             #add ALL GRAPHS user only if from is not defined !!
             if 'from' not in set(replacement) or \
                 len(replacement['from']) == 0:
@@ -184,34 +258,32 @@ class SparqlQueryBuilder(ParamManager):
             else:
                 listfrom = replacement['from']
 
-            if len(listfrom) > 0:
-                for elt in set(listfrom):
-                    self.log.debug(elt)
-                    query += "FROM <"+elt+">\n"
-
-        query += "WHERE {"+"\n"
-        query += replacement['query']+"\n"
-        query += "}"+"\n"
-
-        if 'post_action' in replacement:
-            query += replacement['post_action'] + "\n"
+        # the canonical text: the same query gives the same text (and fingerprint)
+        select_query = SelectQuery(replacement['select'], replacement['query'],
+                                   listfrom, replacement.get('post_action'))
+        query = select_query.to_sparql()
+        self.log.debug("query fingerprint: " + select_query.fingerprint())
 
         prefixes = self.header_sparql_config(query)
         return prefixes + query
 
 
-    def custom_query(self, fromgraph, select, query,externalrequest=False,adminrequest=False):
+    def custom_query(self, fromgraph, select, query,externalrequest=False,adminrequest=False,scoped=False,post_action=None):
         """
         launch a custom query.
         """
         exr = externalrequest
         ar = adminrequest
         self.log.debug('---> custom_query')
-        return self.build_query_on_the_fly({
+        replacement = {
             'from' : fromgraph,
             'select': select,
-            'query': query
-        },externalrequest=exr,adminrequest=ar)
+            'query': query,
+            'scoped': scoped
+        }
+        if post_action:
+            replacement['post_action'] = post_action
+        return self.build_query_on_the_fly(replacement,externalrequest=exr,adminrequest=ar)
 
     def get_delete_query_string(self, graph):
         """
@@ -14,14 +14,330 @@ information on build_query_on_the_fly:
 """
 import logging
 from askomics.libaskomics.rdfdb.SparqlQueryBuilder import SparqlQueryBuilder
+from askomics.libaskomics.rdfdb.SparqlTemplate import SparqlTemplate
 
 class SparqlQueryGraph(SparqlQueryBuilder):
     """
     This class contain method to build a sparql query to
     extract data from public and private graph
     It replace the template files
+    The queries are SparqlTemplate, compiled once.
     """
 
+    PUBLIC_START_POINT = SparqlTemplate.select(
+        '?g ?nodeUri ?nodeLabel',
+        'GRAPH ?g {\n' +
+        '\t?nodeUri askomics:entity "true"^^xsd:boolean .\n' +
+        '\t?nodeUri askomics:startPoint "true"^^xsd:boolean .\n' +
+        '\t?nodeUri rdfs:label ?nodeLabel.\n' +
+        '\t?g :accessLevel "public".\n' +
+        '}')
+
+    USER_START_POINT = SparqlTemplate.select(
+        '?g ?nodeUri ?nodeLabel ?accesLevel',
+        'GRAPH ?g {\n' +
+        '\t?nodeUri askomics:entity "true"^^xsd:boolean .\n' +
+        '\t?nodeUri askomics:startPoint "true"^^xsd:boolean .\n' +
+        '\t?nodeUri rdfs:label ?nodeLabel.\n' +
+        '\t?g :accessLevel ?accesLevel.\n ' +
+        '\t?g dc:creator $username\n' +
+        '}',
+        username='literal')
+
+    PREFIX_URI = SparqlTemplate.select(
+        '?nodeLabel ?prefUri',
+        'GRAPH ?g {\n' +
+        '\t?nodeUri askomics:entity "true"^^xsd:boolean .\n' +
+        '\t?nodeUri rdfs:label ?nodeLabel.\n' +
+        '\t?nodeUri askomics:prefixUri ?prefUri.\n' +
+        '\t{\n' +
+        '\t\t{ ?g :accessLevel ?accesLevel.\n' +
+        "\t\t\tFILTER ( ?accesLevel = 'public' )." +
+        '\t\t}\n' +
+        '\t\tUNION\n' +
+        '\t\t{ ?g :accessLevel ?accesLevel.\n ' +
+        '\t\t?g dc:creator $username }\n' +
+        '\t}\n.' +
+        '}',
+        username='literal')
+
+    ISA_RELATION_ENTITIES = SparqlTemplate.select(
+        '?uri ?urisub',
+        '\n' +
+        'GRAPH ?g1 { ?uri askomics:entity "true"^^xsd:boolean.}\n' +
+        'GRAPH ?g2 {?uri rdfs:subClassOf ?urisub.}\n' +
+        'GRAPH ?g3 {?urisub askomics:entity "true"^^xsd:boolean.}\n')
+
+    PUBLIC_GRAPHS = SparqlTemplate.select(
+        '?g',
+        'GRAPH ?g {\n' +
+        "?g :accessLevel 'public'. \n" +
+        ' } ',
+        post_action='GROUP BY ?g')
+
+    # the number of triples and the size of a graph are recorded at its integration
+    GRAPH_INFOS_QUERY = ('GRAPH ?g {\n' +
+                         '\t?g prov:generatedAtTime ?date .\n' +
+                         '\t?g prov:wasDerivedFrom ?name .\n' +
+                         '\t?g :accessLevel ?access .\n' +
+                         '$bind' +
+                         '\t?g dc:creator ?owner .\n' +
+                         '\tOPTIONAL { ?g void:triples ?co . }\n' +
+                         '\tOPTIONAL { ?g dcat:byteSize ?size . }\n' +
+                         '}')
+
+    USER_GRAPH_INFOS = SparqlTemplate.select(
+        '?g ?name ?date ?access ?owner ?co ?size',
+        GRAPH_INFOS_QUERY.replace('$bind', 'BIND($owner AS ?owner). \n'),
+        owner='literal')
+
+    ADMIN_GRAPH_INFOS = SparqlTemplate.select(
+        '?g ?name ?date ?access ?owner ?co ?size',
+        GRAPH_INFOS_QUERY.replace('$bind', ''))
+
+    IF_POSITIONABLE = SparqlTemplate.select(
+        '?exist',
+        'GRAPH ?g {\n\tBIND(EXISTS {$uri askomics:is_positionable "true"^^xsd:boolean} AS ?exist) ' +
+        '\t{' +
+        '\t\t{ ?g :accessLevel "public". }' +
+        '\t\tUNION ' +
+        '\t\t{ ?g dc:creator $username.}' +
+        '\t}' +
+        '}',
+        uri='iri', username='literal')
+
+    ALL_TAXONS = SparqlTemplate.select(
+        '?taxon',
+        'GRAPH ?g {\n' +
+        '\t:taxonCategory askomics:category ?URItax .\n' +
+        '\t?URItax rdfs:label ?taxon' +
+        '\t{' +
+        '\t\t{ ?g :accessLevel "public". }' +
+        '\t\tUNION ' +
+        '\t\t{ ?g dc:creator $username.}' +
+        '\t}' +
+        '}',
+        username='literal')
+
+    PUBLIC_ABSTRACTION_ATTRIBUTE_ENTITY = SparqlTemplate.select(
+        '?g ?entity ?attribute ?labelAttribute ?typeAttribute ?order',
+        'Graph ?g {\n' +
+        '\t?entity askomics:entity "true"^^xsd:boolean .\n\n' +
+        '\t?attribute askomics:attribute "true"^^xsd:boolean .\n\n' +
+        '\t?attribute rdf:type owl:DatatypeProperty ;\n' +
+        '\t           rdfs:label ?labelAttribute ;\n' +
+        '\t           rdfs:domain ?entity ;\n' +
+        '\t           rdfs:range ?typeAttribute .\n\n' +
+        '\tOPTIONAL {?attribute askomics:attributeOrder ?order .}\n' +
+        '\t?g :accessLevel "public". ' +
+        '}')
+
+    USER_ABSTRACTION_ATTRIBUTE_ENTITY = SparqlTemplate.select(
+        '?g ?entity ?attribute ?labelAttribute ?typeAttribute ?order',
+        'Graph ?g {\n' +
+        '\t?entity askomics:entity "true"^^xsd:boolean .\n\n' +
+        '\t?attribute askomics:attribute "true"^^xsd:boolean .\n\n' +
+        '\t?attribute rdf:type owl:DatatypeProperty ;\n' +
+        '\t           rdfs:label ?labelAttribute ;\n' +
+        '\t           rdfs:domain ?entity ;\n' +
+        '\t           rdfs:range ?typeAttribute .\n\n' +
+        '\tOPTIONAL {?attribute askomics:attributeOrder ?order .}\n' +
+        '\t?g dc:creator $username.' +
+        '}',
+        username='literal')
+
+    PUBLIC_ABSTRACTION_RELATION = SparqlTemplate.select(
+        '?g ?d ?subject ?relation ?object',
+        'GRAPH ?g { ?relation rdf:type $prop ;\n' +
+        '\t          rdfs:domain ?subject ;\n' +
+        '\t          rdfs:range ?object .\n' +
+        '\t?subject askomics:entity "true"^^xsd:boolean .\n\n' +
+        '\t?g :accessLevel "public". ' +
+        '}',
+        prop='pname')
+
+    USER_ABSTRACTION_RELATION = SparqlTemplate.select(
+        '?g ?d ?subject ?relation ?object',
+        'GRAPH ?g { ?relation rdf:type $prop ;\n' +
+        '\t          rdfs:domain ?subject ;\n' +
+        '\t          rdfs:range ?object .\n' +
+        '\t?subject askomics:entity "true"^^xsd:boolean .\n\n' +
+        '\t?g dc:creator $username .' +
+        '}',
+        prop='pname', username='literal')
+
+    PUBLIC_ABSTRACTION_ENTITY = SparqlTemplate.select(
+        '?g ?entity ?property ?value',
+        'GRAPH ?g { ?entity ?property ?value .\n' +
+        '\t?entity askomics:entity "true"^^xsd:boolean .\n' +
+        '\t?g :accessLevel "public".' +
+        '}')
+
+    USER_ABSTRACTION_ENTITY = SparqlTemplate.select(
+        '?g ?entity ?property ?value',
+        'GRAPH ?g { ?entity ?property ?value .\n' +
+        '\t?entity askomics:entity "true"^^xsd:boolean .\n' +
+        '\t?g dc:creator $username .' +
+        '}',
+        username='literal')
+
+    ABSTRACTION_POSITIONABLE_ENTITY = SparqlTemplate.select(
+        '?entity',
+        'GRAPH ?g1 { ?entity askomics:entity "true"^^xsd:boolean .\n' +
+        '?entity askomics:is_positionable "true"^^xsd:boolean .}')
+
+    PUBLIC_ABSTRACTION_CATEGORY_ENTITY = SparqlTemplate.select(
+        '?g ?entity ?category ?labelCategory ?typeCategory ?order',
+        'GRAPH ?g { \n' +
+        '\t?entity askomics:entity "true"^^xsd:boolean .\n' +
+        '\t?category rdf:type owl:ObjectProperty ;\n' +
+        '\t            rdfs:label ?labelCategory ;\n' +
+        '\t            rdfs:domain ?entity;\n' +
+        '\t            rdfs:range ?typeCategory.\n' +
+        '\tOPTIONAL {?category askomics:attributeOrder ?order .}\n' +
+        '\t?typeCategory askomics:category ?catStuff .\n' +
+        '\t?g :accessLevel "public".' +
+        '\t}')
+
+    USER_ABSTRACTION_CATEGORY_ENTITY = SparqlTemplate.select(
+        '?g ?entity ?category ?labelCategory ?typeCategory ?order',
+        'GRAPH ?g { \n' +
+        '\t?entity askomics:entity "true"^^xsd:boolean .\n' +
+        '\t?category rdf:type owl:ObjectProperty ;\n' +
+        '\t            rdfs:label ?labelCategory ;\n' +
+        '\t            rdfs:domain ?entity;\n' +
+        '\t            rdfs:range ?typeCategory.\n' +
+        '\tOPTIONAL {?category askomics:attributeOrder ?order .}\n' +
+        '\t?typeCategory askomics:category ?catStuff .\n' +
+        '\t?g dc:creator $username .' +
+        '\t}',
+        username='literal')
+
+    CLASS_INFO_FROM_ABSTRACTION = SparqlTemplate.select(
+        '?relation_label',
+        'GRAPH ?g { $node_class rdf:type owl:Class .\n' +
+        '\tOPTIONAL { ?relation rdfs:domain ?class } .\n' +
+        '\tOPTIONAL { ?relation rdfs:range ?range } .\n' +
+        '\tOPTIONAL { ?relation rdfs:label ?relation_label }.\n} ',
+        node_class='local')
+
+    # all the facets of the abstraction in a single query, ?facet tells which one
+    # gives a row (see TripleStoreExplorer.group_abstraction)
+    ABSTRACTION_ACCESS = ('\t{ ?g :accessLevel "public". }\n' +
+                          '\tUNION\n' +
+                          '\t{ ?g dc:creator $username. }\n')
+
+    USER_ABSTRACTION = SparqlTemplate.select(
+        '?facet ?g ?subject ?relation ?object ?entity ?property ?value ' +
+        '?attribute ?labelAttribute ?typeAttribute ?category ?labelCategory ?typeCategory ?order ?uri ?urisub',
+        '{\n' +
+        'GRAPH ?g { ?relation rdf:type owl:ObjectProperty ;\n' +
+        '\t          rdfs:domain ?subject ;\n' +
+        '\t          rdfs:range ?object .\n' +
+        '\t?subject askomics:entity "true"^^xsd:boolean .\n' +
+        ABSTRACTION_ACCESS +
+        '}\n' +
+        'BIND("relations" AS ?facet)\n' +
+        '} UNION {\n' +
+        'GRAPH ?g { ?entity ?property ?value .\n' +
+        '\t?entity askomics:entity "true"^^xsd:boolean .\n' +
+        ABSTRACTION_ACCESS +
+        '}\n' +
+        'BIND("entities" AS ?facet)\n' +
+        '} UNION {\n' +
+        'GRAPH ?g {\n' +
+        '\t?entity askomics:entity "true"^^xsd:boolean .\n' +
+        '\t?attribute askomics:attribute "true"^^xsd:boolean .\n' +
+        '\t?attribute rdf:type owl:DatatypeProperty ;\n' +
+        '\t           rdfs:label ?labelAttribute ;\n' +
+        '\t           rdfs:domain ?entity ;\n' +
+        '\t           rdfs:range ?typeAttribute .\n' +
+        '\tOPTIONAL {?attribute askomics:attributeOrder ?order .}\n' +
+        ABSTRACTION_ACCESS +
+        '}\n' +
+        'BIND("attributes" AS ?facet)\n' +
+        '} UNION {\n' +
+        'GRAPH ?g {\n' +
+        '\t?entity askomics:entity "true"^^xsd:boolean .\n' +
+        '\t?category rdf:type owl:ObjectProperty ;\n' +
+        '\t            rdfs:label ?labelCategory ;\n' +
+        '\t            rdfs:domain ?entity;\n' +
+        '\t            rdfs:range ?typeCategory.\n' +
+        '\tOPTIONAL {?category askomics:attributeOrder ?order .}\n' +
+        '\t?typeCategory askomics:category ?catStuff .\n' +
+        ABSTRACTION_ACCESS +
+        '}\n' +
+        'BIND("categories" AS ?facet)\n' +
+        '} UNION {\n' +
+        'GRAPH ?g1 { ?uri askomics:entity "true"^^xsd:boolean.}\n' +
+        'GRAPH ?g2 {?uri rdfs:subClassOf ?urisub.}\n' +
+        'GRAPH ?g3 {?urisub askomics:entity "true"^^xsd:boolean.}\n' +
+        'BIND("subclassof" AS ?facet)\n' +
+        '} UNION {\n' +
+        'GRAPH ?g1 { ?entity askomics:entity "true"^^xsd:boolean .\n' +
+        '?entity askomics:is_positionable "true"^^xsd:boolean .}\n' +
+        'BIND("positionable" AS ?facet)\n' +
+        '}',
+        username='literal')
+
+    # the abstraction of a single graph, see AbstractionSnapshot
+    GRAPH_ABSTRACTION_RELATION = SparqlTemplate.select(
+        '?g ?subject ?relation ?object',
+        'VALUES ?g { $graph }\n' +
+        'GRAPH ?g { ?relation rdf:type owl:ObjectProperty ;\n' +
+        '\t          rdfs:domain ?subject ;\n' +
+        '\t          rdfs:range ?object .\n' +
+        '\t?subject askomics:entity "true"^^xsd:boolean .\n' +
+        '}',
+        graph='iri')
+
+    GRAPH_ABSTRACTION_ENTITY = SparqlTemplate.select(
+        '?g ?entity ?property ?value',
+        'VALUES ?g { $graph }\n' +
+        'GRAPH ?g { ?entity ?property ?value .\n' +
+        '\t?entity askomics:entity "true"^^xsd:boolean .\n' +
+        '}',
+        graph='iri')
+
+    GRAPH_ABSTRACTION_ATTRIBUTE_ENTITY = SparqlTemplate.select(
+        '?g ?entity ?attribute ?labelAttribute ?typeAttribute ?order',
+        'VALUES ?g { $graph }\n' +
+        'GRAPH ?g {\n' +
+        '\t?entity askomics:entity "true"^^xsd:boolean .\n\n' +
+        '\t?attribute askomics:attribute "true"^^xsd:boolean .\n\n' +
+        '\t?attribute rdf:type owl:DatatypeProperty ;\n' +
+        '\t           rdfs:label ?labelAttribute ;\n' +
+        '\t           rdfs:domain ?entity ;\n' +
+        '\t           rdfs:range ?typeAttribute .\n\n' +
+        '\tOPTIONAL {?attribute askomics:attributeOrder ?order .}\n' +
+        '}',
+        graph='iri')
+
+    GRAPH_ABSTRACTION_CATEGORY_ENTITY = SparqlTemplate.select(
+        '?g ?entity ?category ?labelCategory ?typeCategory ?order',
+        'VALUES ?g { $graph }\n' +
+        'GRAPH ?g { \n' +
+        '\t?entity askomics:entity "true"^^xsd:boolean .\n' +
+        '\t?category rdf:type owl:ObjectProperty ;\n' +
+        '\t            rdfs:label ?labelCategory ;\n' +
+        '\t            rdfs:domain ?entity;\n' +
+        '\t            rdfs:range ?typeCategory.\n' +
+        '\tOPTIONAL {?category askomics:attributeOrder ?order .}\n' +
+        '\t?typeCategory askomics:category ?catStuff .\n' +
+        '}',
+        graph='iri')
+
+    GRAPH_SUBCLASSOF = SparqlTemplate.select(
+        '?uri ?urisub',
+        'GRAPH $graph { ?uri rdfs:subClassOf ?urisub . }',
+        graph='iri')
+
+    GRAPH_ABSTRACTION_POSITIONABLE_ENTITY = SparqlTemplate.select(
+        '?entity',
+        'GRAPH $graph { ?entity askomics:entity "true"^^xsd:boolean .\n' +
+        '?entity askomics:is_positionable "true"^^xsd:boolean .}',
+        graph='iri')
+
     def __init__(self, settings, session):
         SparqlQueryBuilder.__init__(self, settings, session)
         self.log = logging.getLogger(__name__)
@@ -39,280 +355,128 @@ class SparqlQueryGraph(SparqlQueryBuilder):
         """
         Get the start point and in which public graph they are
         """
-        self.log.debug('---> get_start_point')
-
-        return self.build_query_on_the_fly({
-            'select': '?g ?nodeUri ?nodeLabel',
-            'query': 'GRAPH ?g {\n'+
-                     '\t?nodeUri askomics:entity "true"^^xsd:boolean .\n' +
-                     '\t?nodeUri askomics:startPoint "true"^^xsd:boolean .\n' +
-                     '\t?nodeUri rdfs:label ?nodeLabel.\n'+
-                     '\t?g :accessLevel "public".\n'+
-                     '}'
-        }, True)
+        return self.PUBLIC_START_POINT.render(self)
 
     def get_user_start_point(self):
         """
         Get the start point and in which private graph they are
         """
-        self.log.debug('---> get_start_point')
-
-        return self.build_query_on_the_fly({
-            'select': '?g ?nodeUri ?nodeLabel ?accesLevel',
-            'query': 'GRAPH ?g {\n'+
-                     '\t?nodeUri askomics:entity "true"^^xsd:boolean .\n' +
-                     '\t?nodeUri askomics:startPoint "true"^^xsd:boolean .\n' +
-                     '\t?nodeUri rdfs:label ?nodeLabel.\n'+
-                     "\t?g :accessLevel ?accesLevel.\n "+
-                     "\t?g dc:creator '" + self.session['username'] + "'\n"+
-                     '}'
-        }, True)
+        return self.USER_START_POINT.render(self, username=self.session['username'])
 
     def get_prefix_uri(self):
         """
         Get list of uri defined as metadata for a entities list
         """
-        self.log.debug('---> get_prefix_uri')
-        return self.build_query_on_the_fly({
-            'select': '?nodeLabel ?prefUri',
-            'query': 'GRAPH ?g {\n'+
-                     '\t?nodeUri askomics:entity "true"^^xsd:boolean .\n' +
-                     '\t?nodeUri rdfs:label ?nodeLabel.\n'+
-                     '\t?nodeUri askomics:prefixUri ?prefUri.\n'+
-                     "\t{\n"+
-                     "\t\t{ ?g :accessLevel ?accesLevel.\n"+
-                     "\t\t\tFILTER ( ?accesLevel = 'public' )."+
-                     "\t\t}\n"+
-                     "\t\tUNION\n"+
-                     "\t\t{ ?g :accessLevel ?accesLevel.\n "+
-                     "\t\t?g dc:creator '" + self.session['username'] + "' }\n"+
-                     "\t}\n."+
-                     "}"
-        }, True)
+        return self.PREFIX_URI.render(self, username=self.session['username'])
 
     def get_isa_relation_entities(self):
         """
         Get the association list of entities and subclass
         """
-        self.log.debug('---> get_isa_relation_entities')
-        return self.build_query_on_the_fly({
-            'select': '?uri ?urisub',
-            'query': '\n'+
-                     'GRAPH ?g1 { ?uri askomics:entity "true"^^xsd:boolean.}\n'+
-                     'GRAPH ?g2 {?uri rdfs:subClassOf ?urisub.}\n'+
-                     'GRAPH ?g3 {?urisub askomics:entity "true"^^xsd:boolean.}\n'
-        }, True)
+        return self.ISA_RELATION_ENTITIES.render(self)
 
     def get_public_graphs(self):
         """
         Get the list of public named graph
         """
-        self.log.debug('---> get_public_graphs')
-        return self.build_query_on_the_fly({
-            'select': '?g',
-            'query': 'GRAPH ?g {\n'+
-                     "?g :accessLevel 'public'. \n" +
-                     " } ",
-            'post_action': 'GROUP BY ?g'
-        }, True)
+        return self.PUBLIC_GRAPHS.render(self)
 
-    def get_user_graph_infos_with_count(self):
-        """Get infos of all datasets owned by a user"""
+    def get_user_graph_infos(self):
+        """Get infos of all datasets owned by a user, with their number of triples and size"""
 
-        strbind = "BIND('" + self.session['username'] + "' AS ?owner). \n"
         if self.session['admin']:
-            strbind =""
+            return self.ADMIN_GRAPH_INFOS.render(self)
 
-        return self.build_query_on_the_fly({
-            'select': '?g ?name ?date ?access ?owner (count(*) as ?co)',
-            'query': 'GRAPH ?g {\n' +
-                 '\t?s ?p ?o .\n' +
-                 '\t?g prov:generatedAtTime ?date .\n' +
-                 '\t?g prov:wasDerivedFrom ?name .\n'+
-                 '\t?g :accessLevel ?access .\n' +
-                 strbind +
-                 "\t?g dc:creator ?owner .\n" +
-                 '}',
-            'post_action': 'GROUP BY ?g ?name ?date ?access ?owner'
-        }, True)
+        return self.USER_GRAPH_INFOS.render(self, owner=self.session['username'])
 
     def get_if_positionable(self, uri):
         """
         Get if an entity is positionable
         """
-        self.log.debug('---> get_if_positionable')
-        return self.build_query_on_the_fly({
-            'select': '?exist',
-            'query': 'GRAPH ?g {\n\tBIND(EXISTS {<' +
-                     uri + '> askomics:is_positionable "true"^^xsd:boolean} AS ?exist) '+
-                     '\t{'+
-                     '\t\t{ ?g :accessLevel "public". }'+
-                     '\t\tUNION '+
-                     '\t\t{ ?g dc:creator "'+self.session['username']+'".}'+
-                     '\t}'+
-                     '}'
-        }, True)
+        return self.IF_POSITIONABLE.render(self, uri=uri, username=self.session['username'])
 
     def get_all_taxons(self):
         """
         Get the list of all taxon
         """
-        self.log.debug('---> get_all_taxons')
-        return self.build_query_on_the_fly({
-            'select': '?taxon',
-            'query': 'GRAPH ?g {\n'+
-                     '\t:taxonCategory askomics:category ?URItax .\n' +
-                     '\t?URItax rdfs:label ?taxon'+
-                     '\t{'+
-                     '\t\t{ ?g :accessLevel "public". }'+
-                     '\t\tUNION '+
-                     '\t\t{ ?g dc:creator "'+self.session['username']+'".}'+
-                     '\t}'+
-                     '}'
-        }, True)
+        return self.ALL_TAXONS.render(self, username=self.session['username'])
 
     def get_public_abstraction_attribute_entity(self):
         """
         Get all attributes of an entity
         """
-        return self.build_query_on_the_fly({
-            'select': '?g ?entity ?attribute ?labelAttribute ?typeAttribute ?order',
-            'query': 'Graph ?g {\n' +
-                     '\t?entity askomics:entity "true"^^xsd:boolean .\n\n' +
-                     '\t?attribute askomics:attribute "true"^^xsd:boolean .\n\n' +
-                     '\t?attribute rdf:type owl:DatatypeProperty ;\n' +
-                     '\t           rdfs:label ?labelAttribute ;\n' +
-                     '\t           rdfs:domain ?entity ;\n' +
-                     '\t           rdfs:range ?typeAttribute .\n\n' +
-                     '\tOPTIONAL {?attribute askomics:attributeOrder ?order .}\n' +
-                     '\t?g :accessLevel "public". '+
-                     '}'
-        }, True)
+        return self.PUBLIC_ABSTRACTION_ATTRIBUTE_ENTITY.render(self)
+
+    def get_user_abstraction(self):
+        """
+        Get all the facets of the abstraction visible by the user
+        """
+        return self.USER_ABSTRACTION.render(self, username=self.session['username'])
 
     def get_user_abstraction_attribute_entity(self):
         """
         Get all attributes of an entity
         """
-        return self.build_query_on_the_fly({
-            'select': '?g ?entity ?attribute ?labelAttribute ?typeAttribute ?order',
-            'query': 'Graph ?g {\n' +
-                     '\t?entity askomics:entity "true"^^xsd:boolean .\n\n' +
-                     '\t?attribute askomics:attribute "true"^^xsd:boolean .\n\n' +
-                     '\t?attribute rdf:type owl:DatatypeProperty ;\n' +
-                     '\t           rdfs:label ?labelAttribute ;\n' +
-                     '\t           rdfs:domain ?entity ;\n' +
-                     '\t           rdfs:range ?typeAttribute .\n\n' +
-                     '\tOPTIONAL {?attribute askomics:attributeOrder ?order .}\n' +
-                     '\t?g dc:creator "'+self.session['username']+'".'+
-                     '}'
-        }, True)
+        return self.USER_ABSTRACTION_ATTRIBUTE_ENTITY.render(self, username=self.session['username'])
 
     def get_public_abstraction_relation(self, prop):
         """
         Get the relation of an entity
         """
-        return self.build_query_on_the_fly({
-            'select': '?g ?d ?subject ?relation ?object',
-            'query': 'GRAPH ?g { ?relation rdf:type ' + prop + ' ;\n' +
-                     '\t          rdfs:domain ?subject ;\n' +
-                     '\t          rdfs:range ?object .\n'+
-                     '\t?subject askomics:entity "true"^^xsd:boolean .\n\n' +
-                     '\t?g :accessLevel "public". '+
-                     '}'
-            }, True)
+        return self.PUBLIC_ABSTRACTION_RELATION.render(self, prop=prop)
 
     def get_user_abstraction_relation(self, prop):
         """
         Get the relation of an entity
         """
-        return self.build_query_on_the_fly({
-            'select': '?g ?d ?subject ?relation ?object',
-            'query': 'GRAPH ?g { ?relation rdf:type ' + prop + ' ;\n' +
-                     '\t          rdfs:domain ?subject ;\n' +
-                     '\t          rdfs:range ?object .\n'+
-                     '\t?subject askomics:entity "true"^^xsd:boolean .\n\n' +
-                     '\t?g dc:creator "'+self.session['username']+'" .'+
-                     '}'
-            }, True)
+        return self.USER_ABSTRACTION_RELATION.render(self, prop=prop, username=self.session['username'])
 
     def get_public_abstraction_entity(self):
         """
         Get theproperty of an entity
         """
-        return self.build_query_on_the_fly({
-            'select': '?g ?entity ?property ?value',
-            'query': 'GRAPH ?g { ?entity ?property ?value .\n' +
-                     '\t?entity askomics:entity "true"^^xsd:boolean .\n' +
-                     '\t?g :accessLevel "public".'+
-                     '}'
-            }, True)
+        return self.PUBLIC_ABSTRACTION_ENTITY.render(self)
 
     def get_user_abstraction_entity(self):
         """
         Get theproperty of an entity
         """
-        return self.build_query_on_the_fly({
-            'select': '?g ?entity ?property ?value',
-            'query': 'GRAPH ?g { ?entity ?property ?value .\n' +
-                     '\t?entity askomics:entity "true"^^xsd:boolean .\n' +
-                     '\t?g dc:creator "'+self.session['username']+'" .'+
-                     '}'
-            }, True)
+        return self.USER_ABSTRACTION_ENTITY.render(self, username=self.session['username'])
 
     def get_abstraction_positionable_entity(self):
         """
         Get all positionable entities
         """
-        return self.build_query_on_the_fly({
-            'select': '?entity',
-            'query': 'GRAPH ?g1 { ?entity askomics:entity "true"^^xsd:boolean .\n' +
-                     '?entity askomics:is_positionable "true"^^xsd:boolean .}'
-            }, True)
+        return self.ABSTRACTION_POSITIONABLE_ENTITY.render(self)
 
     def get_public_abstraction_category_entity(self):
         """
         Get the category of an entity
         """
-        return self.build_query_on_the_fly({
-            'select': '?g ?entity ?category ?labelCategory ?typeCategory ?order',
-            'query': 'GRAPH ?g { \n'+
-                     '\t?entity askomics:entity "true"^^xsd:boolean .\n' +
-                     '\t?category rdf:type owl:ObjectProperty ;\n' +
-                     '\t            rdfs:label ?labelCategory ;\n' +
-                     '\t            rdfs:domain ?entity;\n' +
-                     '\t            rdfs:range ?typeCategory.\n' +
-                     '\tOPTIONAL {?category askomics:attributeOrder ?order .}\n' +
-                     '\t?typeCategory askomics:category ?catStuff .\n' +
-                     '\t?g :accessLevel "public".'+
-                     '\t}'
-            }, True)
+        return self.PUBLIC_ABSTRACTION_CATEGORY_ENTITY.render(self)
 
     def get_user_abstraction_category_entity(self):
         """
         Get the category of an entity
         """
-        return self.build_query_on_the_fly({
-            'select': '?g ?entity ?category ?labelCategory ?typeCategory ?order',
-            'query': 'GRAPH ?g { \n'+
-                     '\t?entity askomics:entity "true"^^xsd:boolean .\n' +
-                     '\t?category rdf:type owl:ObjectProperty ;\n' +
-                     '\t            rdfs:label ?labelCategory ;\n' +
-                     '\t            rdfs:domain ?entity;\n' +
-                     '\t            rdfs:range ?typeCategory.\n' +
-                     '\tOPTIONAL {?category askomics:attributeOrder ?order .}\n' +
-                     '\t?typeCategory askomics:category ?catStuff .\n' +
-                     '\t?g dc:creator "'+self.session['username']+'" .'+
-                     '\t}'
-            }, True)
+        return self.USER_ABSTRACTION_CATEGORY_ENTITY.render(self, username=self.session['username'])
 
     def get_class_info_from_abstraction(self, node_class):
         """
         get
         """
-        return self.build_query_on_the_fly({
-            'select': '?relation_label',
-            'query': 'GRAPH ?g { :'+node_class+' rdf:type owl:Class .\n' +
-                     '\tOPTIONAL { ?relation rdfs:domain ?class } .\n' +
-                     '\tOPTIONAL { ?relation rdfs:range ?range } .\n' +
-                     '\tOPTIONAL { ?relation rdfs:label ?relation_label }.\n} '
-            }, True)
+        return self.CLASS_INFO_FROM_ABSTRACTION.render(self, node_class=node_class)
+
+    def get_graph_abstraction(self, graph):
+        """
+        Get the queries of the abstraction of a graph, by facet
+        (the facets of getUserAbstraction, without the access conditions)
+        """
+        return {
+            'relations': self.GRAPH_ABSTRACTION_RELATION.render(self, graph=graph),
+            'entities': self.GRAPH_ABSTRACTION_ENTITY.render(self, graph=graph),
+            'attributes': self.GRAPH_ABSTRACTION_ATTRIBUTE_ENTITY.render(self, graph=graph),
+            'categories': self.GRAPH_ABSTRACTION_CATEGORY_ENTITY.render(self, graph=graph),
+            'subclassof': self.GRAPH_SUBCLASSOF.render(self, graph=graph),
+            'positionable': self.GRAPH_ABSTRACTION_POSITIONABLE_ENTITY.render(self, graph=graph)
+        }
@@ -16,110 +16,225 @@ information on build_query_on_the_fly:
 import logging
 
 from askomics.libaskomics.rdfdb.SparqlQueryBuilder import SparqlQueryBuilder
+from askomics.libaskomics.rdfdb.SparqlTemplate import SparqlTemplate
+
+
+def stats_templates(select, query):
+    """
+    The templates of a stats query, one per access condition (see SparqlQueryStats.render_stats)
+    :param query: the text of the query, with a $condition on ?g
+    """
+    conditions = {
+        'public': ('?g :accessLevel "public".', {}),
+        'admin': ('?g :accessLevel "private".', {}),
+        'user': ('{ ?g :accessLevel $access_level.  ?g dc:creator $username .}',
+                 {'access_level': 'literal', 'username': 'literal'})
+    }
+
+    return {name: SparqlTemplate.select(select, query.replace('$condition', condition), **types)
+            for name, (condition, types) in conditions.items()}
 
 
 class SparqlQueryStats(SparqlQueryBuilder):
     """
     This class contain method to build a sparql query to
     extract data from the users graph
+    The queries are SparqlTemplate, compiled once.
     """
 
+    NUMBER_OF_TRIPLES = stats_templates(
+        '(COUNT(*) AS ?number)',
+        'GRAPH ?g {?s ?p ?o.$condition}')
+
+    NUMBER_OF_ENTITIES = stats_templates(
+        '(COUNT(DISTINCT ?s) AS ?number)',
+        'GRAPH ?g {?s a [].$condition}')
+
+    NUMBER_OF_CLASSES = stats_templates(
+        '(COUNT(DISTINCT ?s) AS ?number)',
+        'GRAPH ?g {?s rdf:type owl:Class.$condition}')
+
+    NUMBER_OF_SUBGRAPH = stats_templates(
+        '(COUNT(DISTINCT ?g) AS ?number)',
+        'GRAPH ?g {?s ?p ?o.$condition}')
+
+    SUBGRAPH_INFOS = stats_templates(
+        '?graph ?date ?owner ?server ?version',
+        'GRAPH ?g {?g prov:wasDerivedFrom ?graph .\n' +
+        '\t?g dc:creator ?owner .\n' +
+        '\t?g dc:hasVersion ?version .\n' +
+        '\t?g prov:describesService ?server .\n' +
+        '\t?g prov:generatedAtTime ?date .$condition}')
+
+    ATTR_OF_CLASSES = stats_templates(
+        '?class ?attr',
+        'GRAPH ?g {?uri_class a owl:Class .\n' +
+        '\t?uri_class rdfs:label ?class .\n' +
+        '\t?uri_attr rdfs:domain ?uri_class .\n' +
+        '\t?uri_attr rdfs:label ?attr .$condition}')
+
+    REL_OF_CLASSES = stats_templates(
+        '?domain ?relname ?range',
+        'GRAPH ?g {?rel a owl:ObjectProperty .\n' +
+        '\t?rel rdfs:label ?relname .\n' +
+        '\t?rel rdfs:domain ?uri_domain .\n' +
+        '\t?rel rdfs:range ?uri_range .\n' +
+        '\t?uri_domain rdfs:label ?domain .\n' +
+        '\t?uri_range rdfs:label ?range .$condition}')
+
+    CLASS_CARDINALITIES = SparqlTemplate.select(
+        '?class (COUNT(?s) AS ?count)',
+        'GRAPH ?g {?s rdf:type ?class.}',
+        post_action='GROUP BY ?class')
+
+    PREDICATE_CARDINALITIES = SparqlTemplate.select(
+        '?predicate (COUNT(*) AS ?count) (COUNT(DISTINCT ?s) AS ?subjects) (COUNT(DISTINCT ?o) AS ?objects)',
+        'GRAPH ?g {?s ?predicate ?o.}',
+        post_action='GROUP BY ?predicate')
+
+    # the statistics of a graph, recorded by StatisticsManager
+    GRAPH_NUMBER_OF_TRIPLES = SparqlTemplate.select(
+        '(COUNT(*) AS ?number)',
+        'GRAPH $graph {?s ?p ?o.}', graph='iri')
+
+    GRAPH_NUMBER_OF_ENTITIES = SparqlTemplate.select(
+        '(COUNT(DISTINCT ?s) AS ?number)',
+        'GRAPH $graph {?s a [].}', graph='iri')
+
+    GRAPH_CLASSES = SparqlTemplate.select(
+        '?class',
+        'GRAPH $graph {?class rdf:type owl:Class.}', graph='iri')
+
+    GRAPH_INFOS = SparqlTemplate.select(
+        '?graph ?date ?owner ?server ?version ?access',
+        'GRAPH $graph {$graph prov:wasDerivedFrom ?graph .\n' +
+        '\t$graph dc:creator ?owner .\n' +
+        '\t$graph dc:hasVersion ?version .\n' +
+        '\t$graph prov:describesService ?server .\n' +
+        '\t$graph prov:generatedAtTime ?date .\n' +
+        '\t$graph :accessLevel ?access .}', graph='iri')
+
+    GRAPH_ATTR_OF_CLASSES = SparqlTemplate.select(
+        '?class ?attr',
+        'GRAPH $graph {?uri_class a owl:Class .\n' +
+        '\t?uri_class rdfs:label ?class .\n' +
+        '\t?uri_attr rdfs:domain ?uri_class .\n' +
+        '\t?uri_attr rdfs:label ?attr .}', graph='iri')
+
+    GRAPH_REL_OF_CLASSES = SparqlTemplate.select(
+        '?domain ?relname ?range',
+        'GRAPH $graph {?rel a owl:ObjectProperty .\n' +
+        '\t?rel rdfs:label ?relname .\n' +
+        '\t?rel rdfs:domain ?uri_domain .\n' +
+        '\t?rel rdfs:range ?uri_range .\n' +
+        '\t?uri_domain rdfs:label ?domain .\n' +
+        '\t?uri_range rdfs:label ?range .}', graph='iri')
+
+    LOCAL_GRAPHS = SparqlTemplate.select(
+        '?g',
+        'GRAPH ?g {?g prov:generatedAtTime ?date.}')
+
     def __init__(self, settings, session):
         SparqlQueryBuilder.__init__(self, settings, session)
         self.log = logging.getLogger(__name__)
 
 
-    def condition_query(self, access_level):
+    def render_stats(self, templates, access_level):
         '''
-            return the query according the accessLevel
+            render the template of a stats query according the accessLevel
         '''
 
         if access_level == 'public':
-            return '?g :accessLevel "public".'
+            return templates['public'].render(self)
 
         if self.session['admin']:
-            return '?g :accessLevel "private".'
-
-        query = '{ ?g :accessLevel \''+access_level+'\'.'
-        query += '  ?g dc:creator "'+self.session['username']+'" .}'
+            return templates['admin'].render(self)
 
-        return query
+        return templates['user'].render(self, access_level=access_level, username=self.session['username'])
 
     def get_number_of_triples(self, access_level):
         """
         Get number of triples in public graph
         """
-        return self.build_query_on_the_fly({
-            'select': '(COUNT(*) AS ?number)',
-            'query': 'GRAPH ?g {?s ?p ?o.'+self.condition_query(access_level)+'}'
-        }, True)
+        return self.render_stats(self.NUMBER_OF_TRIPLES, access_level)
 
     def get_number_of_entities(self, access_level):
         """
         Get number of triples in public graph
         """
-        return self.build_query_on_the_fly({
-            'select': '(COUNT(DISTINCT ?s) AS ?number)',
-            'query': 'GRAPH ?g {?s a [].'+self.condition_query(access_level)+'}'
-        }, True)
+        return self.render_stats(self.NUMBER_OF_ENTITIES, access_level)
 
 
     def get_number_of_classes(self, access_level):
         """
         Get number of triples in public graph
         """
-        return self.build_query_on_the_fly({
-            'select': '(COUNT(DISTINCT ?s) AS ?number)',
-            'query': 'GRAPH ?g {?s rdf:type owl:Class.'+self.condition_query(access_level)+'}'
-        }, True)
+        return self.render_stats(self.NUMBER_OF_CLASSES, access_level)
 
     def get_number_of_subgraph(self, access_level):
         """
         Get number of triples in public graph
         """
-        return self.build_query_on_the_fly({
-            'select': '(COUNT(DISTINCT ?g) AS ?number)',
-            'query': 'GRAPH ?g {?s ?p ?o.'+self.condition_query(access_level)+'}'
-        }, True)
+        return self.render_stats(self.NUMBER_OF_SUBGRAPH, access_level)
 
 
     def get_subgraph_infos(self, access_level):
         """
         Get number of triples in public graph
         """
-        return self.build_query_on_the_fly({
-            'select': '?graph ?date ?owner ?server ?version',
-            'query': 'GRAPH ?g {?g prov:wasDerivedFrom ?graph .\n' +
-                     '\t?g dc:creator ?owner .\n' +
-                     '\t?g dc:hasVersion ?version .\n' +
-                     '\t?g prov:describesService ?server .\n' +
-                     '\t?g prov:generatedAtTime ?date .'+self.condition_query(access_level)+'}'
-        }, True)
+        return self.render_stats(self.SUBGRAPH_INFOS, access_level)
 
 
     def get_attr_of_classes(self, access_level):
         """
         Get all the attributes of a class
         """
-        return self.build_query_on_the_fly({
-            'select': '?class ?attr',
-            'query': 'GRAPH ?g {?uri_class a owl:Class .\n' +
-                     '\t?uri_class rdfs:label ?class .\n' +
-                     '\t?uri_attr rdfs:domain ?uri_class .\n' +
-                     '\t?uri_attr rdfs:label ?attr .'+self.condition_query(access_level)+'}'
-            }, True)
+        return self.render_stats(self.ATTR_OF_CLASSES, access_level)
 
 
     def get_rel_of_classes(self, access_level):
         """
         Get all the attributes of a class
         """
-        return self.build_query_on_the_fly({
-            'select': '?domain ?relname ?range',
-            'query': 'GRAPH ?g {?rel a owl:ObjectProperty .\n' +
-                     '\t?rel rdfs:label ?relname .\n' +
-                     '\t?rel rdfs:domain ?uri_domain .\n' +
-                     '\t?rel rdfs:range ?uri_range .\n' +
-                     '\t?uri_domain rdfs:label ?domain .\n' +
-                     '\t?uri_range rdfs:label ?range .'+self.condition_query(access_level)+'}'
-            }, True)
+        return self.render_stats(self.REL_OF_CLASSES, access_level)
+
+
+    def get_class_cardinalities(self):
+        """
+        Get the number of instances of each class, in all the graphs
+        """
+        return self.CLASS_CARDINALITIES.render(self)
+
+
+    def get_predicate_cardinalities(self):
+        """
+        Get the number of triples, of subjects and of objects of each predicate, in all the graphs
+        """
+        return self.PREDICATE_CARDINALITIES.render(self)
+
+
+    def get_graph_statistics(self, graph):
+        """
+        Get the queries of the statistics of a graph: {name: query}
+        """
+        return {name: template.render(self, graph=graph)
+                for name, template in (('ntriples', self.GRAPH_NUMBER_OF_TRIPLES),
+                                       ('nentities', self.GRAPH_NUMBER_OF_ENTITIES),
+                                       ('classes', self.GRAPH_CLASSES),
+                                       ('infos', self.GRAPH_INFOS),
+                                       ('class_attr', self.GRAPH_ATTR_OF_CLASSES),
+                                       ('class_rel', self.GRAPH_REL_OF_CLASSES))}
+
+
+    def get_graph_number_of_triples(self, graph):
+        """
+        Get the number of triples of a graph
+        """
+        return self.GRAPH_NUMBER_OF_TRIPLES.render(self, graph=graph)
+
+
+    def get_local_graphs(self):
+        """
+        Get the graphs integrated in the local triplestore
+        """
+        return self.LOCAL_GRAPHS.render(self)
@@ -0,0 +1,89 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+import re
+import threading
+from string import Template
+
+from askomics.libaskomics.rdfdb.SparqlAst import SelectQuery
+
+class SparqlTemplate(object):
+    """
+    A query defined once, with typed $parameters:
+        - the PREFIX header of the prefixes it uses is resolved at its first
+          rendering, then kept with the text (one per askomics namespaces),
+        - render only escapes the parameters and substitutes them.
+    The types of the parameters:
+        - literal: a string literal, escaped,
+        - iri: an absolute IRI, refused if it contains forbidden characters,
+        - local: a name of the askomics default prefix (:name), as a full IRI,
+        - pname: a prefixed name (owl:Class),
+        - int: an integer.
+    """
+
+    RE_IRI_FORBIDDEN = re.compile(r'[\x00-\x20<>"{}|^`\\]')
+    RE_PNAME = re.compile(r'^[A-Za-z][\w.-]*:[\w-]*$')
+    LITERAL_ESCAPES = {'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+    def __init__(self, query, **types):
+        """
+        :param query: the text of the query, with its $parameters
+        :param types: the type of each parameter
+        """
+        self.query = query
+        self.types = types
+
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def select(cls, select, query, post_action=None, **types):
+        """A template of SELECT DISTINCT select WHERE { query } post_action"""
+        return cls(SelectQuery(select, query, post_action=post_action).to_sparql(), **types)
+
+    @classmethod
+    def escape(cls, kind, value, param_manager=None):
+        """Get the SPARQL text of a parameter value"""
+
+        if kind == 'literal':
+            return '"' + ''.join(cls.LITERAL_ESCAPES.get(char, char) for char in str(value)) + '"'
+
+        if kind == 'int':
+            return str(int(value))
+
+        if kind == 'pname':
+            if not cls.RE_PNAME.match(value):
+                raise ValueError("SparqlTemplate: invalid prefixed name: " + repr(value))
+            return value
+
+        if kind == 'local':
+            value = param_manager.get_param("askomics.prefix") + str(value)
+        elif kind != 'iri':
+            raise ValueError("SparqlTemplate: unknown parameter type: " + repr(kind))
+
+        if cls.RE_IRI_FORBIDDEN.search(value):
+            raise ValueError("SparqlTemplate: invalid IRI: " + repr(value))
+        return '<' + value + '>'
+
+    def compile(self, param_manager):
+        """Get the Template of the query with its PREFIX header, for the namespaces of a ParamManager"""
+
+        key = (param_manager.get_param("askomics.prefix"), param_manager.get_param("askomics.namespace"))
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            with self._lock:
+                compiled = self._compiled.get(key)
+                if compiled is None:
+                    compiled = Template(param_manager.get_sparql_prefixes(self.query) + self.query)
+                    self._compiled[key] = compiled
+        return compiled
+
+    def render(self, param_manager, **params):
+        """Get the query text, with the escaped parameters"""
+
+        values = {}
+        for name, kind in self.types.items():
+            if name not in params:
+                raise ValueError("SparqlTemplate: missing parameter " + name)
+            values[name] = self.escape(kind, params[name], param_manager)
+
+        return self.compile(param_manager).substitute(values)
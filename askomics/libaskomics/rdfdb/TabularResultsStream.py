@@ -0,0 +1,136 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+import io
+import re
+import csv
+import logging
+
+class TabularResultsStream(object):
+    """
+    The TabularResultsStream reads a SPARQL 1.1 TSV (text/tab-separated-values)
+    or CSV (text/csv) results document line by line, and yields each row as a
+    {variable: value} dict, like JsonResultsStream does.
+        - TSV: RDF terms are written in turtle syntax, only the lexical value is
+          kept (<iri> gives iri, "literal"@lang or "literal"^^type gives literal).
+          Quoted header and IRIs, as written by Virtuoso, are accepted too.
+          An empty field is an unbound variable.
+        - CSV: values are already lexical values, an empty field can not be told
+          apart from an empty literal and is considered as unbound.
+    The stream can be iterated only once.
+    """
+
+    RE_CHARSET = re.compile(r'(?i)charset\s*=\s*("[^"]*"|[^;\s]+)')
+    RE_ECHAR = re.compile(r'\\(u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)')
+    ECHAR = {'t': '\t', 'b': '\b', 'n': '\n', 'r': '\r', 'f': '\f',
+             '"': '"', "'": "'", '\\': '\\'}
+
+    def __init__(self, text, dialect='tsv', response=None):
+        """
+        :param text: text file-like object or iterable of lines
+        :param dialect: 'tsv' or 'csv'
+        :param response: the http response to close at the end of the iteration
+        """
+        if dialect not in ('tsv', 'csv'):
+            raise ValueError("Unknown tabular results format: " + str(dialect))
+
+        self.log = logging.getLogger(__name__)
+        self.vars = []
+        self.dialect = dialect
+
+        self._text = text
+        self._response = response
+
+    @classmethod
+    def get_encoding(cls, response):
+        """
+        Get the charset of the Content-Type of a response, UTF-8 (the encoding
+        of the SPARQL results formats) if there is none: requests would
+        give ISO-8859-1 to any text/* answer without charset
+        """
+        match = cls.RE_CHARSET.search(response.headers.get('Content-Type', ''))
+        if match is None:
+            return 'utf-8'
+        return match.group(1).strip('"\'')
+
+    @classmethod
+    def from_response(cls, response, dialect='tsv'):
+        """Build a stream on a requests response opened with stream=True"""
+        response.raw.decode_content = True
+        text = io.TextIOWrapper(response.raw, encoding=cls.get_encoding(response), newline='')
+        return cls(text, dialect, response)
+
+    def close(self):
+        """Release the http connection"""
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+    @classmethod
+    def _unescape(cls, match):
+        char = match.group(1)
+        if len(char) > 1:
+            return chr(int(char[1:], 16))
+        return cls.ECHAR.get(char, '\\' + char)
+
+    @classmethod
+    def decode_term(cls, term):
+        """Get the lexical value of a turtle encoded RDF term (None if empty)"""
+        if not term:
+            return None
+
+        first = term[0]
+        if first == '<':
+            return term[1:-1]
+
+        if first == '"' or first == "'":
+            value = term[1:term.rfind(first)]
+            if '\\' in value:
+                value = cls.RE_ECHAR.sub(cls._unescape, value)
+            return value
+
+        # numbers, booleans and blank nodes
+        return term
+
+    def __iter__(self):
+        try:
+            if self.dialect == 'csv':
+                yield from self._iter_csv()
+            else:
+                yield from self._iter_tsv()
+        finally:
+            self.close()
+
+    def _iter_tsv(self):
+        lines = iter(self._text)
+        header = next(lines, None)
+        if header is None:
+            return
+
+        self.vars = [var.strip().strip('"').lstrip('?$') for var in header.rstrip('\r\n').split('\t')]
+        variables = self.vars
+        decode_term = self.decode_term
+
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            row = {}
+            for variable, term in zip(variables, line.split('\t')):
+                value = decode_term(term)
+                if value is not None:
+                    row[variable] = value
+            yield row
+
+    def _iter_csv(self):
+        reader = csv.reader(self._text)
+        header = next(reader, None)
+        if header is None:
+            return
+
+        self.vars = [var.strip().lstrip('?$') for var in header]
+        variables = self.vars
+
+        for line in reader:
+            if not line:
+                continue
+            yield {variable: value for variable, value in zip(variables, line) if value != ''}
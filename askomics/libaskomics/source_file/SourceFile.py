@@ -14,9 +14,13 @@ from pkg_resources import get_distribution
 import datetime
 
 from askomics.libaskomics.ParamManager import ParamManager
+from askomics.libaskomics.StatisticsManager import StatisticsManager
 from askomics.libaskomics.rdfdb.SparqlQueryBuilder import SparqlQueryBuilder
 from askomics.libaskomics.rdfdb.SparqlQueryGraph import SparqlQueryGraph
+from askomics.libaskomics.rdfdb.SparqlQueryStats import SparqlQueryStats
 from askomics.libaskomics.rdfdb.QueryLauncher import QueryLauncher
+from askomics.libaskomics.rdfdb.GraphAccessCache import GraphAccessCache
+from askomics.libaskomics.rdfdb.AbstractionSnapshot import AbstractionSnapshot
 from askomics.libaskomics.utils import cached_property, HaveCachedProperties
 
 class SourceFileSyntaxError(SyntaxError):
@@ -27,6 +31,12 @@ class SourceFile(ParamManager, HaveCachedProperties):
     Class representing a source file.
     """
 
+    # the prefixes written as is by the generators, the others come from encode_to_rdf_uri
+    TURTLE_PREFIXES = ('', 'rdf', 'rdfs', 'owl', 'xsd', 'askomics', 'faldo')
+
+    # the prefixes emitted by the generators once they track them (see track_prefixes)
+    used_prefixes = None
+
     def __init__(self, settings, session, path, uri_set=None):
 
         ParamManager.__init__(self, settings, session)
@@ -65,6 +75,23 @@ class SourceFile(ParamManager, HaveCachedProperties):
                 else:
                     self.uri.append(self.get_param("askomics.prefix"))
 
+    def track_prefixes(self):
+        """
+        Record the prefixes of the turtle generated from now on: the generators
+        (get_turtle, get_abstraction, get_domain_knowledge) call it first, persist
+        builds the headers from used_prefixes and scans the turtle only if it is None
+        """
+        if self.used_prefixes is None:
+            self.used_prefixes = set(self.TURTLE_PREFIXES)
+
+    def encode_to_rdf_uri(self, toencode, prefix=None):
+        """ParamManager.encode_to_rdf_uri, recording the prefix of the prefixed names"""
+
+        uri = ParamManager.encode_to_rdf_uri(toencode, prefix)
+        if self.used_prefixes is not None and not uri.startswith('<'):
+            self.used_prefixes.add(uri[:uri.find(':')])
+        return uri
+
     def setGraph(self,graph):
         self.graph = graph
 
@@ -93,9 +120,49 @@ class SourceFile(ParamManager, HaveCachedProperties):
         else:
             raise ValueError("askomics.endpoint does not exit.")
 
-        sparql_header = sqb.header_sparql_config('')
+        sparql_header = sqb.header_sparql_config(ttl)
 
         query_laucher.insert_data(ttl, self.graph, sparql_header)
+        # the new graph is visible
+        GraphAccessCache.get_cache(self).invalidate()
+
+    def insert_size_metadatas(self, triple_count, byte_size=None):
+        """
+        Insert the number of triples and the size (bytes of turtle loaded) of
+        the graph into the parent graph, listed by list_user_graph
+        """
+
+        sqb = SparqlQueryBuilder(self.settings, self.session)
+        query_laucher = QueryLauncher(self.settings, self.session)
+
+        ttl = '<' + self.graph + '> void:triples "' + str(int(triple_count)) + '"^^xsd:integer .\n'
+        if byte_size is not None:
+            ttl += '<' + self.graph + '> dcat:byteSize "' + str(int(byte_size)) + '"^^xsd:integer .\n'
+
+        query_laucher.insert_data(ttl, self.graph, sqb.get_sparql_prefixes(ttl))
+
+    def count_triples(self):
+        """
+        Get the number of triples of the graph, for the files whose triples are not counted while loading
+        """
+        sqs = SparqlQueryStats(self.settings, self.session)
+        query_laucher = QueryLauncher(self.settings, self.session)
+
+        return int(query_laucher.process_query(sqs.get_graph_number_of_triples(self.graph))[0]['number'])
+
+    def save_abstraction_snapshot(self):
+        """
+        Write the snapshot of the abstraction of the graph, see AbstractionSnapshot
+        """
+        store = AbstractionSnapshot.get_store(self)
+        if store is not None:
+            store.save(self.graph, self.settings, self.session)
+
+    def save_graph_statistics(self):
+        """
+        Record the statistics of the graph, see StatisticsManager
+        """
+        StatisticsManager(self.settings, self.session).save_graph_statistics(self.graph)
 
     def get_timestamp(self):
         """
@@ -113,11 +180,15 @@ class SourceFile(ParamManager, HaveCachedProperties):
         """
         self.insert_metadatas(public)
 
+        self.used_prefixes = None
         content_ttl = self.get_turtle()
         ql = QueryLauncher(self.settings, self.session)
 
         # use insert data instead of load sparql procedure when the dataset is small
+        # the header of a chunk is built from the prefixes recorded by the
+        # generators so far, the chunk is scanned only if they are not tracked
         total_triple_count = 0
+        byte_size = 0
         chunk_count = 1
         chunk = ""
         pathttl = self.get_rdf_user_directory()
@@ -143,10 +214,11 @@ class SourceFile(ParamManager, HaveCachedProperties):
                     fp = tempfile.NamedTemporaryFile(dir=pathttl, prefix="tmp_"+self.alphanum_name, suffix=".ttl", mode="w", delete=False)
                     # We have reached the maximum chunk size, load it and then we will start a new chunk
                     self.log.debug("Loading ttl chunk %s file %s" % (chunk_count, fp.name))
-                    header_ttl = self.get_turtle_template(chunk)
+                    header_ttl = self.get_turtle_prefixes(chunk, self.used_prefixes)
                     fp.write(header_ttl + '\n')
                     fp.write(chunk)
                     fp.close()
+                    byte_size += os.path.getsize(fp.name)
                     data = self.load_data_from_file(fp, urlbase)
                     if data['status'] == 'failed':
                         return data
@@ -160,10 +232,11 @@ class SourceFile(ParamManager, HaveCachedProperties):
             if triple_count > 0:
                 self.log.debug("Loading ttl chunk %s (last)" % (chunk_count))
                 fp = tempfile.NamedTemporaryFile(dir=pathttl, prefix="tmp_"+self.alphanum_name, suffix=".ttl", mode="w", delete=False)
-                header_ttl = self.get_turtle_template(chunk)
+                header_ttl = self.get_turtle_prefixes(chunk, self.used_prefixes)
                 fp.write(header_ttl + '\n')
                 fp.write(chunk)
                 fp.close()
+                byte_size += os.path.getsize(fp.name)
                 data = self.load_data_from_file(fp, urlbase)
                 if data['status'] == 'failed':
                     return data
@@ -175,7 +248,7 @@ class SourceFile(ParamManager, HaveCachedProperties):
             # We get the abstraction now as we need first to parse the whole file to have category_values
             abstraction_ttl = self.get_abstraction()
             domain_knowledge_ttl = self.get_domain_knowledge()
-            header_ttl = self.get_turtle_template(abstraction_ttl+"\n"+domain_knowledge_ttl)
+            header_ttl = self.get_turtle_prefixes(abstraction_ttl+"\n"+domain_knowledge_ttl, self.used_prefixes)
 
             fp = tempfile.NamedTemporaryFile(dir=pathttl, prefix="tmp_"+self.alphanum_name, suffix=".ttl", mode="w", delete=False)
             fp.write(header_ttl + '\n')
@@ -184,6 +257,7 @@ class SourceFile(ParamManager, HaveCachedProperties):
 
             self.log.debug("Loading ttl abstraction file %s" % (fp.name))
             fp.close()
+            byte_size += os.path.getsize(fp.name)
             data = self.load_data_from_file(fp, urlbase)
             if data['status'] == 'failed':
                 return data
@@ -206,8 +280,9 @@ class SourceFile(ParamManager, HaveCachedProperties):
                     # We have reached the maximum chunk size, load it and then we will start a new chunk
                     self.log.debug("Inserting ttl chunk %s" % (chunk_count))
                     try:
-                        header_ttl = sqb.header_sparql_config(chunk)
+                        header_ttl = sqb.get_sparql_prefixes(chunk, self.used_prefixes)
                         queryResults = ql.insert_data(chunk, self.graph, header_ttl)
+                        byte_size += len(chunk.encode('utf-8'))
                     except Exception as e:
                         return self._format_exception(e)
 
@@ -221,8 +296,9 @@ class SourceFile(ParamManager, HaveCachedProperties):
                 self.log.debug("Inserting ttl chunk %s (last)" % (chunk_count))
 
                 try:
-                    header_ttl = sqb.header_sparql_config(chunk)
+                    header_ttl = sqb.get_sparql_prefixes(chunk, self.used_prefixes)
                     queryResults = ql.insert_data(chunk, self.graph, header_ttl)
+                    byte_size += len(chunk.encode('utf-8'))
                 except Exception as e:
                     return self._format_exception(e)
 
@@ -234,23 +310,23 @@ class SourceFile(ParamManager, HaveCachedProperties):
             abstraction_ttl = self.get_abstraction()
             domain_knowledge_ttl = self.get_domain_knowledge()
 
-            chunk += abstraction_ttl + '\n'
+            chunk = abstraction_ttl + '\n'
             chunk += domain_knowledge_ttl + '\n'
 
             self.log.debug("Inserting ttl abstraction")
             try:
-                header_ttl = sqb.header_sparql_config(chunk)
+                header_ttl = sqb.get_sparql_prefixes(chunk, self.used_prefixes)
                 ql.insert_data(chunk, self.graph, header_ttl)
+                byte_size += len(chunk.encode('utf-8'))
             except Exception as e:
                 return self._format_exception(e)
 
             self.metadatas['graphName'] = self.graph
-            sparqlHeader = sqb.header_sparql_config("")
 
             data = {}
 
-            if 'server' in queryResults.info():
-                self.metadatas['server'] = queryResults.info()['server']
+            if 'server' in queryResults.headers:
+                self.metadatas['server'] = queryResults.headers['server']
             else:
                 self.metadatas['server'] = 'unknown'
 
@@ -259,6 +335,10 @@ class SourceFile(ParamManager, HaveCachedProperties):
 
         data['expected_lines_number'] = self.get_number_of_lines()
 
+        self.insert_size_metadatas(total_triple_count, byte_size)
+
+        self.save_abstraction_snapshot()
+        self.save_graph_statistics()
         return data
 
     def load_data_from_file(self, fp, urlbase):
@@ -65,6 +65,7 @@ class SourceFileBed(SourceFile):
         :rtype: string
         """
 
+        self.track_prefixes()
         taxon_entity = ':unknown'
         if self.taxon != '':
             taxon_entity = self.encode_to_rdf_uri(self.taxon.strip(),prefix='askomics:')
@@ -204,6 +205,7 @@ class SourceFileBed(SourceFile):
             'score': '8'
         }
 
+        self.track_prefixes()
         ttl =  '#################\n'
         ttl += '#  Abstraction  #\n'
         ttl += '#################\n\n'
@@ -280,6 +282,7 @@ class SourceFileBed(SourceFile):
         :rtype: string
         """
 
+        self.track_prefixes()
         ttl =  '######################\n'
         ttl += '#  Domain knowledge  #\n'
         ttl += '######################\n\n'
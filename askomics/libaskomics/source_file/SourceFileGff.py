@@ -81,6 +81,7 @@ class SourceFileGff(SourceFile):
         Get turtle string for a gff file
         """
 
+        self.track_prefixes()
         self.log.debug(self.path)
         handle = open(self.path, encoding="utf-8", errors="ignore")
 
@@ -325,6 +326,7 @@ class SourceFileGff(SourceFile):
             'position_taxon': '7'
         }
 
+        self.track_prefixes()
         ttl =  '#################\n'
         ttl += '#  Abstraction  #\n'
         ttl += '#################\n\n'
@@ -395,6 +397,7 @@ class SourceFileGff(SourceFile):
         Get Domain Knowledge (turtle) of the GFF
         """
 
+        self.track_prefixes()
         ttl =  '######################\n'
         ttl += '#  Domain knowledge  #\n'
         ttl += '######################\n\n'
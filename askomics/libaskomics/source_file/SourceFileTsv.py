@@ -320,6 +320,7 @@ class SourceFileTsv(SourceFile):
 
         # TODO use rdflib or other abstraction layer to create rdf
 
+        self.track_prefixes()
         if len(self.forced_column_types) <= 0:
             raise ValueError("forced_column_types is not defined !")
 
@@ -410,6 +411,7 @@ class SourceFileTsv(SourceFile):
 
         #TODO use rdflib or other abstraction layer to create rdf
 
+        self.track_prefixes()
         ttl = ''
 
         if all(types in self.forced_column_types for types in ('start', 'end')): # a positionable entity have to have a start and a end
@@ -477,6 +479,7 @@ class SourceFileTsv(SourceFile):
 
         # TODO use rdflib or other abstraction layer to create rdf
 
+        self.track_prefixes()
         self.category_values = defaultdict(set) # key=name of a column of 'category' type -> list of found values
 
         with open(self.path, 'r', encoding="utf-8", errors="ignore") as tabfile:
@@ -76,6 +76,9 @@ class SourceFileTtl(SourceFile):
             data = query_lauch.insert_data(chunk, self.graph, '')
 
         self.insert_metadatas(public)
+        self.insert_size_metadatas(self.count_triples(), os.path.getsize(self.path))
+        self.save_abstraction_snapshot()
+        self.save_graph_statistics()
         return data
 
     @staticmethod
@@ -45,5 +45,9 @@ class SourceFileURL(SourceFile):
         data["status"] = "ok"
 
         self.insert_metadatas(public)
+        # the size of the remote file is unknown
+        self.insert_size_metadatas(self.count_triples())
+        self.save_abstraction_snapshot()
+        self.save_graph_statistics()
 
         return data
@@ -150,18 +150,14 @@ class AskomicsUserAbstraction {
     */
     /* Request information in the model layer */
     //this.updateOntology();
-    loadUserAbstraction(urlService) {
+    loadUserAbstraction() {
 
-      let data = { };
-
-      if ( urlService !== undefined ) {
-        data.service= urlService ;
-      }
+      /* GET: the browser revalidates its copy with the ETag of the abstraction */
       var service = new RestServiceJs("userAbstraction");
 
       let iua = this;
 
-      service.postsync(data,function(resultListTripletSubjectRelationObject ) {
+      service.getsync(function(resultListTripletSubjectRelationObject ) {
       /* All relation are stored in tripletSubjectRelationObject */
       iua.tripletSubjectRelationObject = resultListTripletSubjectRelationObject.relations;
       /* == External Service can add external relation == */
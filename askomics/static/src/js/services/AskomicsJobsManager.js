@@ -92,6 +92,18 @@
       });
     }
 
+    cancel_job(id) {
+
+      let service = new RestServiceJs('canceljob');
+      let model = {jobid: id};
+
+      service.post(model, () => {
+        this.loadjob().then(() => {
+          this.update_jobview('query');
+        });
+      });
+    }
+
     prepareQuery() {
         //     Get JSON to ask for a SPARQL query corresponding to the graph
         //     and launch it according to given parameters.
@@ -172,7 +184,7 @@
 
               $("<h3></h3>").addClass("header-div")
                             .css("text-align","center")
-                            .html("Preview ("+Math.min(this.npreview, this.query_jobs[ij].nrows)+" rows)")
+                            .html("Preview ("+Math.min(this.npreview, this.query_jobs[ij].data.length)+" rows)")
                           );
 
             r.append(prev);
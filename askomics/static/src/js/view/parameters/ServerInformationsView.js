@@ -34,4 +34,9 @@ class ServerInformationsView {
     let service = new RestServiceJs("cleantmpdirectory");
     service.post({}).then( function() { instanceServerInformationsView.update();});
   }
+
+  rebuildStatistics() {
+    let service = new RestServiceJs("rebuild_statistics");
+    service.post({}).then( function() { instanceServerInformationsView.update();});
+  }
 }
@@ -0,0 +1,105 @@
+"""contain AbstractionSnapshot tests"""
+
+import unittest
+import os
+import tempfile
+import shutil
+import time
+
+from pyramid.paster import get_appsettings
+from pyramid import testing
+
+from askomics.libaskomics.rdfdb.AbstractionSnapshot import AbstractionSnapshot
+from askomics.libaskomics.rdfdb.SparqlQueryBuilder import SparqlQueryBuilder
+
+class StaticSnapshot(AbstractionSnapshot):
+    """Build the abstraction of the graphs without the triplestore"""
+
+    @staticmethod
+    def build(graph, settings, session):
+        if graph == 'urn:broken':
+            raise ValueError('triplestore down')
+        entity = graph + '#Entity'
+        return {
+            'relations': [{'g': graph, 'subject': entity, 'relation': graph + '#rel', 'object': entity}],
+            'entities': [{'g': graph, 'entity': entity, 'property': 'label', 'value': graph}],
+            'attributes': [],
+            'categories': [],
+            'subclassof': [{'uri': entity, 'urisub': 'urn:a#Entity'}] if graph != 'urn:a' else [],
+            'positionable': [{'entity': 'urn:a#Entity'}]
+        }
+
+class AbstractionSnapshotTests(unittest.TestCase):
+    """Test for the AbstractionSnapshot class"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+        self.settings = get_appsettings('configs/tests.ini', name='main')
+        self.settings['askomics.files_dir'] = self.directory
+
+        self.request = testing.DummyRequest()
+        self.request.session['username'] = 'jdoe'
+        self.request.session['admin'] = False
+
+        self.store = StaticSnapshot(os.path.join(self.directory, 'abstraction'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_store(self):
+        sqb = SparqlQueryBuilder(self.settings, self.request.session)
+        store = AbstractionSnapshot.get_store(sqb)
+        assert store is AbstractionSnapshot.get_store(sqb)
+        assert store.directory == os.path.join(self.directory, 'abstraction')
+
+        self.settings['askomics.abstraction_snapshots'] = 'false'
+        assert AbstractionSnapshot.get_store(sqb) is None
+
+    def test_save_load(self):
+        assert self.store.load('urn:a') is None
+        assert self.store.save('urn:a', self.settings, self.request.session)
+
+        snapshot = self.store.load('urn:a')
+        assert snapshot['entities'] == [{'g': 'urn:a', 'entity': 'urn:a#Entity', 'property': 'label', 'value': 'urn:a'}]
+
+        # another process reads the file
+        other = StaticSnapshot(self.store.directory)
+        assert other.load('urn:a') == snapshot
+
+        self.store.delete('urn:a')
+        assert self.store.load('urn:a') is None
+        assert other.load('urn:a') is None
+
+    def test_save_failure(self):
+        assert not self.store.save('urn:broken', self.settings, self.request.session)
+        assert self.store.load('urn:broken') is None
+
+    def test_merge(self):
+        self.store.save('urn:a', self.settings, self.request.session)
+        self.store.save('urn:b', self.settings, self.request.session)
+
+        abstraction = self.store.merge(['urn:b', 'urn:a', 'urn:b'])
+        assert [row['g'] for row in abstraction['entities']] == ['urn:a', 'urn:b']
+        assert len(abstraction['relations']) == 2
+        # the subclasses of visible entities, once
+        assert abstraction['subclassof'] == [{'uri': 'urn:b#Entity', 'urisub': 'urn:a#Entity'}]
+        assert abstraction['positionable'] == [{'entity': 'urn:a#Entity'}]
+
+        assert self.store.merge(['urn:b'])['subclassof'] == []
+
+        # a graph without snapshot
+        assert self.store.merge(['urn:a', 'urn:c']) is None
+
+    def test_backfill(self):
+        self.store.save('urn:a', self.settings, self.request.session)
+        assert self.store.missing(['urn:a', 'urn:b', 'urn:broken']) == ['urn:b', 'urn:broken']
+
+        assert self.store.start_backfill(['urn:a', 'urn:b', 'urn:broken'], self.settings, self.request.session)
+        for _ in range(100):
+            if not self.store._running:
+                break
+            time.sleep(0.05)
+
+        assert self.store.missing(['urn:a', 'urn:b', 'urn:broken']) == ['urn:broken']
+        assert self.store.merge(['urn:a', 'urn:b']) is not None
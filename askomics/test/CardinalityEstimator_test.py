@@ -0,0 +1,89 @@
+"""contain CardinalityEstimator tests"""
+
+import unittest
+import threading
+
+from pyramid.paster import get_appsettings
+from pyramid import testing
+
+from askomics.libaskomics.rdfdb.CardinalityEstimator import CardinalityEstimator
+from askomics.libaskomics.TripleStoreExplorer import TripleStoreExplorer
+
+PREFIXES = {'': 'urn:', 'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'}
+
+class BlockedEstimator(CardinalityEstimator):
+    """Refresh the counts once released, as a slow triplestore"""
+
+    def __init__(self):
+        CardinalityEstimator.__init__(self)
+        self.release = threading.Event()
+        self.refreshed = threading.Event()
+
+    def _refresh(self, settings, session):
+        try:
+            self.release.wait(5)
+            self.set_counts({'urn:Gene': 5}, {'urn:name': (5, 5, 5)})
+        finally:
+            self._refresh_lock.release()
+            self.refreshed.set()
+
+class CardinalityEstimatorTests(unittest.TestCase):
+    """Test for the CardinalityEstimator class"""
+
+    def setUp(self):
+        self.estimator = CardinalityEstimator()
+        self.estimator.set_counts(
+            {'urn:Gene': 1000, 'urn:Protein': 10},
+            {'urn:name': (1010, 1010, 1000), 'urn:encodes': (20, 20, 10)})
+
+    def test_estimate(self):
+        estimate = self.estimator.estimate
+
+        assert estimate('?g rdf:type :Gene', (), PREFIXES) == 1000
+        assert estimate('?g a <urn:Protein>', (), PREFIXES) == 10
+        assert estimate('?g a :Unknown', (), PREFIXES) == 0
+        assert estimate('?g rdf:type :Gene', ('?g',), PREFIXES) == 1
+
+        assert estimate('?g :name ?n', (), PREFIXES) == 1010
+        assert estimate('?g :name ?n', ('?g',), PREFIXES) == 1
+        assert estimate('?g :name "TP53"', (), PREFIXES) == 1010 / 1000
+        assert estimate('?g ?p ?n', (), PREFIXES) == 1030
+
+    def test_no_statistics(self):
+        assert CardinalityEstimator().estimate('?g rdf:type :Gene') is None
+
+    def test_reorder(self):
+        settings = get_appsettings('configs/tests.ini', name='main')
+        request = testing.DummyRequest()
+        tse = TripleStoreExplorer(settings, request.session)
+        assert tse.get_pattern_estimate() is None
+
+        constraints = [[
+            '?g rdf:type :Gene',
+            '?g :name ?n',
+            '?p rdf:type :Protein',
+            '?g :encodes ?p'
+        ], '']
+        estimate = lambda pattern, bound: self.estimator.estimate(pattern, bound, PREFIXES)
+
+        # from the proteins to their genes
+        assert tse.build_recursive_block('', constraints, estimate=estimate) == (
+            '?p rdf:type :Protein.\n'
+            '?g :encodes ?p.\n'
+            '?g :name ?n.\n'
+            '?g rdf:type :Gene.\n')
+
+    def test_background_refresh(self):
+        estimator = BlockedEstimator()
+        estimator.set_counts({'urn:Gene': 1000}, {'urn:name': (1000, 1000, 1000)})
+        estimator.updated = 0
+
+        # the request does not wait for the refresh, nor starts another one
+        assert estimator.refresh({}, {})
+        assert not estimator.refresh({}, {})
+        assert estimator.estimate('?g rdf:type :Gene', (), PREFIXES) == 1000
+
+        estimator.release.set()
+        assert estimator.refreshed.wait(5)
+        assert estimator.estimate('?g rdf:type :Gene', (), PREFIXES) == 5
+        assert not estimator.is_expired()
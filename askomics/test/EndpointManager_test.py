@@ -2,10 +2,14 @@
 
 import unittest
 import os.path
+import tempfile
+import time
 
 from pyramid.paster import get_appsettings
 from pyramid import testing
+import askomics.libaskomics.EndpointManager
 from askomics.libaskomics.EndpointManager import EndpointManager
+from askomics.libaskomics.DatabaseConnector import DatabaseConnector
 from interface_tps_db import InterfaceTpsDb
 from SetupTests import SetupTests
 
@@ -90,7 +94,10 @@ class EndpointManagerTests(unittest.TestCase):
             'endpoint': 'http://endpoint/sparql',
             'auth': 'BASIC',
             'enable': True,
-            'message': None
+            'message': None,
+            'circuit': 'closed',
+            'failures': 0,
+            'retry_at': None
         },
         {
             'id': 2,
@@ -98,7 +105,10 @@ class EndpointManagerTests(unittest.TestCase):
             'endpoint': 'http://other_endpoint/sparql',
             'auth': 'BASIC',
             'enable': True,
-            'message': None
+            'message': None,
+            'circuit': 'closed',
+            'failures': 0,
+            'retry_at': None
         }]
 
 
@@ -119,7 +129,10 @@ class EndpointManagerTests(unittest.TestCase):
             'endpoint': 'http://endpoint/sparql',
             'auth': 'BASIC',
             'enable': True,
-            'message': None
+            'message': None,
+            'circuit': 'closed',
+            'failures': 0,
+            'retry_at': None
         }]
 
 
@@ -137,3 +150,111 @@ class EndpointManagerTests(unittest.TestCase):
         endpoint_manager.remove_endpoint(endpoint)
 
         assert not self.tps.test_row_presence('endpoints', 'id, name, url, auth, enable, message', (1, 'endpoint1', 'http://endpoint/sparql', 'BASIC', 0, None))
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    """Test the circuit breaker of the EndpointManager class"""
+
+    def setUp(self):
+        """Set up the settings with a temporary database"""
+
+        self.database = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.database.close()
+        self.settings = {
+            'askomics.database_path': self.database.name,
+            'askomics.endpoint_failure_threshold': '2',
+            'askomics.endpoint_open_delay': '10'
+        }
+        self.endpoint_manager = EndpointManager(self.settings, {})
+        self.id = self.endpoint_manager.save_endpoint('endpoint1', 'http://endpoint/sparql', isenable=True)
+
+    def tearDown(self):
+        os.remove(self.database.name)
+
+    def get_endpoint(self):
+        return self.endpoint_manager.list_endpoints()[0]
+
+    def test_open(self):
+
+        assert self.endpoint_manager.allow_request(self.id) == 'closed'
+
+        self.endpoint_manager.record_failure(self.id, 'timeout')
+        assert self.get_endpoint()['circuit'] == 'closed'
+        assert self.endpoint_manager.allow_request(self.id) == 'closed'
+
+        self.endpoint_manager.record_failure(self.id, 'timeout')
+        endpoint = self.get_endpoint()
+        assert endpoint['circuit'] == 'open'
+        assert endpoint['failures'] == 2
+        assert endpoint['message'] == 'timeout'
+        assert endpoint['enable']
+        assert endpoint['retry_at'] > time.time() + 9
+        assert self.endpoint_manager.allow_request(self.id) is None
+
+    def test_half_open(self):
+
+        self.endpoint_manager.record_failure(self.id, 'timeout')
+        self.endpoint_manager.record_failure(self.id, 'timeout')
+
+        # the delay is over: a single probe goes
+        self.endpoint_manager.settings['askomics.endpoint_open_delay'] = '0'
+        self.endpoint_manager.record_failure(self.id, 'timeout')
+        self.endpoint_manager.settings['askomics.endpoint_open_delay'] = '10'
+        assert self.endpoint_manager.allow_request(self.id) == 'half-open'
+        assert self.endpoint_manager.allow_request(self.id) is None
+
+        # the probe failed, open again for longer
+        self.endpoint_manager.record_failure(self.id, 'timeout')
+        endpoint = self.get_endpoint()
+        assert endpoint['circuit'] == 'open'
+        assert endpoint['retry_at'] > time.time() + 30
+
+    def test_recovery(self):
+
+        self.endpoint_manager.settings['askomics.endpoint_open_delay'] = '0'
+        self.endpoint_manager.record_failure(self.id, 'timeout')
+        self.endpoint_manager.record_failure(self.id, 'timeout')
+
+        circuit = self.endpoint_manager.allow_request(self.id)
+        assert circuit == 'half-open'
+        self.endpoint_manager.record_success(self.id, circuit)
+
+        endpoint = self.get_endpoint()
+        assert endpoint['circuit'] == 'closed'
+        assert endpoint['failures'] == 0
+        assert endpoint['retry_at'] is None
+
+    def test_circuit_cache(self):
+
+        connections = []
+
+        class CountingConnector(DatabaseConnector):
+            def __init__(self, settings, session):
+                connections.append(self)
+                DatabaseConnector.__init__(self, settings, session)
+
+        askomics.libaskomics.EndpointManager.DatabaseConnector = CountingConnector
+        try:
+            # the closed circuit is read once, the successes are not written
+            for _ in range(3):
+                circuit = self.endpoint_manager.allow_request(self.id)
+                self.endpoint_manager.record_success(self.id, circuit)
+            assert len(connections) == 1
+
+            # the failures are
+            self.endpoint_manager.record_failure(self.id, 'timeout')
+            self.endpoint_manager.record_success(self.id, self.endpoint_manager.allow_request(self.id))
+            assert len(connections) == 3
+        finally:
+            askomics.libaskomics.EndpointManager.DatabaseConnector = DatabaseConnector
+
+        assert self.get_endpoint()['failures'] == 0
+
+    def test_enable_closes(self):
+
+        self.endpoint_manager.record_failure(self.id, 'timeout')
+        self.endpoint_manager.record_failure(self.id, 'timeout')
+        self.endpoint_manager.enable(self.id)
+
+        assert self.get_endpoint()['circuit'] == 'closed'
+        assert self.endpoint_manager.allow_request(self.id) == 'closed'
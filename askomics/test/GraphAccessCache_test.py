@@ -0,0 +1,138 @@
+"""contain GraphAccessCache tests"""
+
+import unittest
+import os
+import time
+import tempfile
+import shutil
+
+from pyramid.paster import get_appsettings
+from pyramid import testing
+
+from askomics.libaskomics.rdfdb.GraphAccessCache import GraphAccessCache
+from askomics.libaskomics.rdfdb.SparqlQueryBuilder import SparqlQueryBuilder
+from askomics.libaskomics.EndpointManager import EndpointManager
+
+class CountingQueryBuilder(SparqlQueryBuilder):
+    """Answer the graphs of the user without the triplestore, and count the queries"""
+
+    calls = 0
+    unreachable = []
+
+    def queryGraphUser(self, em):
+        CountingQueryBuilder.calls += 1
+        self.unreachable_endpoints = list(CountingQueryBuilder.unreachable)
+        return {self.get_param("askomics.endpoint"): {
+            'type': 'askomics',
+            'private': ['urn:private:' + self.session['username']],
+            'public': ['urn:public:1', 'urn:public:2']}}
+
+class GraphAccessCacheTests(unittest.TestCase):
+    """Test for the GraphAccessCache class"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.version_path = os.path.join(self.directory, 'graph_acl.version')
+
+        self.settings = get_appsettings('configs/tests.ini', name='main')
+        self.settings['askomics.files_dir'] = self.directory
+        self.settings['askomics.database_path'] = os.path.join(self.directory, 'database.db')
+
+        self.request = testing.DummyRequest()
+        self.request.session['username'] = 'jdoe'
+        self.request.session['admin'] = False
+
+        CountingQueryBuilder.calls = 0
+        CountingQueryBuilder.unreachable = []
+
+    def tearDown(self):
+        GraphAccessCache._caches.pop(self.version_path, None)
+        shutil.rmtree(self.directory)
+
+    def test_get_put(self):
+        cache = GraphAccessCache(self.version_path)
+        assert cache.get('jdoe') is None
+
+        graphs = {'e': {'public': ['g']}}
+        assert cache.put('jdoe', graphs, cache.stamp())
+        graphs['e']['public'].append('h')
+
+        # the cache keeps and returns copies
+        cached = cache.get('jdoe')
+        assert cached == {'e': {'public': ['g']}}
+        cached['e']['public'].append('i')
+        assert cache.get('jdoe') == {'e': {'public': ['g']}}
+
+    def test_expire(self):
+        cache = GraphAccessCache(self.version_path, ttl=0.05)
+        cache.put('jdoe', {}, cache.stamp())
+        assert cache.get('jdoe') == {}
+        time.sleep(0.1)
+        assert cache.get('jdoe') is None
+
+        cache.ttl = 0
+        assert not cache.put('jdoe', {}, cache.stamp())
+
+    def test_invalidate_processes(self):
+        cache = GraphAccessCache(self.version_path)
+        other = GraphAccessCache(self.version_path)
+        cache.put('jdoe', {}, cache.stamp())
+        other.put('jdoe', {}, other.stamp())
+
+        # a graph changed in another process
+        other.invalidate()
+        assert cache.get('jdoe') is None
+        assert other.get('jdoe') is None
+
+    def test_stale_put(self):
+        cache = GraphAccessCache(self.version_path)
+        other = GraphAccessCache(self.version_path)
+
+        stamp = cache.stamp()
+        other.invalidate()
+        assert not cache.put('jdoe', {}, stamp)
+
+        stamp = cache.stamp()
+        cache.invalidate()
+        assert not cache.put('jdoe', {}, stamp)
+
+    def test_get_graph_user(self):
+        sqb = CountingQueryBuilder(self.settings, self.request.session)
+
+        graphs = sqb.getGraphUser()
+        assert sqb.getGraphUser() == graphs
+        assert CountingQueryBuilder.calls == 1
+
+        endpoint = self.settings['askomics.endpoint']
+        graphs = sqb.getGraphUser(['urn:public:1'])
+        assert graphs[endpoint]['public'] == ['urn:public:2']
+        assert sqb.getGraphUser()[endpoint]['public'] == ['urn:public:1', 'urn:public:2']
+        assert CountingQueryBuilder.calls == 1
+
+        # adding an endpoint invalidates the graphs
+        em = EndpointManager(self.settings, self.request.session)
+        em.save_endpoint('other', 'http://other/sparql', isenable=True)
+        sqb.getGraphUser()
+        assert CountingQueryBuilder.calls == 2
+
+        # the graphs are not kept while an endpoint does not answer
+        CountingQueryBuilder.unreachable = ['http://other/sparql']
+        GraphAccessCache.get_cache(sqb).invalidate()
+        sqb.getGraphUser()
+        sqb.getGraphUser()
+        assert CountingQueryBuilder.calls == 4
+
+        # the circuit of an endpoint does not matter
+        CountingQueryBuilder.unreachable = []
+        id = em.list_endpoints()[0]['id']
+        em.record_failure(id, 'down')
+        sqb.getGraphUser()
+        sqb.getGraphUser()
+        assert CountingQueryBuilder.calls == 5
+
+        # disabling or enabling an endpoint invalidates the graphs
+        em.disable(id, '')
+        sqb.getGraphUser()
+        em.enable(id)
+        sqb.getGraphUser()
+        assert CountingQueryBuilder.calls == 7
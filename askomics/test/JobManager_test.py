@@ -73,6 +73,21 @@ class JobManagerTests(unittest.TestCase):
 
         assert self.tps.test_row_presence('query', 'user_id, state, data, file, preview, graph, variates, nrows, error', (1, 'done', '_s3_22data_string_s3_22', 'file_string', None, 'graph_string', '_s3_7B_s3_27variate_s3_27_s3_3A_s3_20_s3_5B_s3_27_s3_3Fvariate_s3_27_s3_5D_s3_7D', 15, None))
 
+    def test_set_query_job_nrows(self):
+
+        self.tps.clean_up()
+        self.tps.add_jdoe_in_users()
+
+        job_manager = JobManager(self.settings, self.request.session)
+        job_manager.save_query_job('graph_string', '_s3_7B_s3_27variate_s3_27_s3_3A_s3_20_s3_5B_s3_27_s3_3Fvariate_s3_27_s3_5D_s3_7D')
+        job_manager.set_query_job_nrows(1, 42)
+
+        assert self.tps.test_row_presence('query', 'user_id, state, nrows', (1, 'wait', 42))
+
+        # the number of results is kept when the job does not know it
+        job_manager.done_query_job(1, None, 'data_string', 'file_string')
+        assert self.tps.test_row_presence('query', 'user_id, state, nrows', (1, 'done', 42))
+
     def test_set_error_message(self):
 
         self.tps.clean_up()
@@ -0,0 +1,86 @@
+"""contain JsonResultsStream tests"""
+
+import unittest
+import json
+import os
+
+from askomics.libaskomics.rdfdb.JsonResultsStream import JsonResultsStream
+from askomics.libaskomics.rdfdb.QueryLauncher import QueryLauncher
+
+DOCUMENT = {
+    "head": {"vars": ["s", "label", "age"]},
+    "results": {
+        "bindings": [
+            {"s": {"type": "uri", "value": "http://example.org/A"},
+             "label": {"type": "literal", "value": "Alice éè"},
+             "age": {"type": "typed-literal", "value": "23"}},
+            {"s": {"type": "uri", "value": "http://example.org/B"},
+             "age": {"type": "typed-literal", "value": "25"}},
+            {"s": {"type": "uri", "value": "http://example.org/C"},
+             "label": {"type": "literal", "value": "Charles {\"x\": [1]}"},
+             "age": {"type": "typed-literal", "value": "34"}}
+        ]
+    }
+}
+
+def chunked(text, size):
+    data = text.encode('utf-8')
+    return [data[i:i+size] for i in range(0, len(data), size)]
+
+class JsonResultsStreamTests(unittest.TestCase):
+    """Test for the JsonResultsStream class"""
+
+    def setUp(self):
+        self.expected = [
+            {'s': 'http://example.org/A', 'label': 'Alice éè', 'age': '23'},
+            {'s': 'http://example.org/B', 'age': '25'},
+            {'s': 'http://example.org/C', 'label': 'Charles {"x": [1]}', 'age': '34'}
+        ]
+
+    def test_parse_chunks(self):
+        text = json.dumps(DOCUMENT, indent=2)
+        for size in (1, 3, 7, 64, len(text) * 2):
+            stream = JsonResultsStream(chunked(text, size))
+            assert list(stream) == self.expected, size
+            assert stream.vars == ['s', 'label', 'age']
+
+    def test_lazy(self):
+        text = json.dumps(DOCUMENT)
+        consumed = []
+
+        def chunks():
+            for chunk in chunked(text, 16):
+                consumed.append(chunk)
+                yield chunk
+
+        stream = iter(JsonResultsStream(chunks()))
+        assert next(stream) == self.expected[0]
+        assert len(consumed) < len(chunked(text, 16))
+
+    def test_ask_and_empty(self):
+        stream = JsonResultsStream([b'{ "head" : {} , "boolean" : true }'])
+        assert list(stream) == []
+        assert stream.boolean is True
+
+        stream = JsonResultsStream([b'{"head": {"vars": ["a"]}, "results": {"bindings": []}}'])
+        assert list(stream) == []
+        assert list(JsonResultsStream([])) == []
+
+    def test_malformed(self):
+        stream = JsonResultsStream([b'{"head": {"vars": ["a"]}, "results": {"bindings": [{"a": '])
+        self.assertRaises(ValueError, list, stream)
+
+    def test_format_results_csv(self):
+        settings = {'askomics.files_dir': '/tmp/askomics_test'}
+        ql = QueryLauncher(settings, {'username': 'jdoe'})
+        stream = JsonResultsStream(chunked(json.dumps(DOCUMENT), 10))
+
+        filename = ql.format_results_csv(stream)
+        path = ql.get_user_csv_directory() + filename
+        with open(path) as csvfile:
+            lines = csvfile.read().splitlines()
+        os.remove(path)
+
+        assert lines[0] == 's\tlabel\tage'
+        assert lines[2] == 'http://example.org/B\t\t25'
+        assert len(lines) == 4
@@ -2,10 +2,13 @@
 
 import unittest
 import os.path
+import time
 
 from pyramid.paster import get_appsettings
 from pyramid import testing
 from askomics.libaskomics.rdfdb.MultipleQueryLauncher import MultipleQueryLauncher
+from askomics.libaskomics.rdfdb.MultipleQueryLauncher import MultipleQueryLauncher as MultipleQueryLauncher_
+from askomics.libaskomics.rdfdb.QueryLauncher import QueryLauncher
 from askomics.libaskomics.EndpointManager import EndpointManager
 
 class MultipleQueryLauncher(unittest.TestCase):
@@ -30,3 +33,51 @@ class MultipleQueryLauncher(unittest.TestCase):
             assert True
         except ValueError:
             assert False
+
+
+class SlowQueryLauncher(QueryLauncher):
+    """QueryLauncher answering after a delay, without triplestore"""
+
+    def _execute_query(self, query, log_raw_results=True, externalService=None, coalesce=True):
+        time.sleep(0.2)
+        return {"head": {"vars": ["g"]},
+                "results": {"bindings": [{"g": {"type": "uri", "value": self.endpoint + "#g"}}]}}
+
+class SlowMultipleQueryLauncher(MultipleQueryLauncher_):
+
+    def setUserDatastore(self):
+        self.name = 'Local'
+        self.endpoint = 'http://local/sparql'
+
+    def _execute_query(self, query, log_raw_results=True, externalService=None, coalesce=True):
+        return SlowQueryLauncher._execute_query(self, query)
+
+    def get_endpoint_launcher(self, es):
+        return SlowQueryLauncher(self.settings, self.session, name=es['name'], endpoint=es['endpoint'])
+
+class MultipleQueryLauncherFanOutTests(unittest.TestCase):
+    """Test the concurrent fan-out of MultipleQueryLauncher"""
+
+    def setUp(self):
+        self.lendpoints = [{'name': 'ep' + str(i), 'endpoint': 'http://ep' + str(i) + '/sparql'} for i in range(5)]
+
+    def test_concurrent(self):
+        mql = SlowMultipleQueryLauncher({}, {})
+
+        time0 = time.time()
+        results = mql.process_query("SELECT ?g WHERE { GRAPH ?g {} }", self.lendpoints, indexByEndpoint=True)
+        assert time.time() - time0 < 0.2 * 3
+
+        assert list(results) == ['http://local/sparql'] + [es['endpoint'] for es in self.lendpoints]
+        assert results['http://ep3/sparql'] == [{'g': 'http://ep3/sparql#g'}]
+
+        results = mql.process_query("SELECT ?g WHERE { GRAPH ?g {} }", self.lendpoints)
+        assert [r['g'] for r in results] == ['http://local/sparql#g'] + [es['endpoint'] + '#g' for es in self.lendpoints]
+
+    def test_max_parallel(self):
+        mql = SlowMultipleQueryLauncher({'askomics.endpoints_max_parallel': '1'}, {})
+
+        time0 = time.time()
+        results = mql.process_query("SELECT ?g WHERE { GRAPH ?g {} }", self.lendpoints[:2])
+        assert time.time() - time0 >= 0.2 * 3
+        assert len(results) == 3
@@ -103,6 +103,34 @@ class ParamManagerTests(unittest.TestCase):
         m = ParamManager(self.settings, self.request.session)
         m.header_sparql_config("SELECT ?a FROM { ?a a owl:Class. \n ?a yago:test eat:test. }")
 
+    def test_get_sparql_prefixes(self):
+        m = ParamManager(self.settings, self.request.session)
+        header = m.get_sparql_prefixes("SELECT ?a FROM <http://a> { ?a a owl:Class ; :label \"x\"^^xsd:string . }")
+        assert header == ("PREFIX : <" + m.ASKOMICS_prefix[""] + ">\n"
+                          "PREFIX owl: <http://www.w3.org/2002/07/owl#>\n"
+                          "PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>\n")
+        assert m.get_sparql_prefixes("SELECT * { ?s ?p ?o }") == ""
+
+    def test_get_sparql_prefixes_tracked(self):
+        m = ParamManager(self.settings, self.request.session)
+        prefixes = set()
+        m.get_used_prefixes("?a rdf:type owl:Class .", prefixes)
+        m.get_used_prefixes("?a rdfs:label ?l .", prefixes)
+
+        # the text is not scanned when the prefixes are given
+        header = m.get_sparql_prefixes("", prefixes)
+        assert header == m.get_sparql_prefixes("?a rdf:type owl:Class . ?a rdfs:label ?l .")
+        assert header.count("PREFIX") == 3
+        assert m.get_sparql_prefixes("", prefixes) is header
+
+    def test_get_turtle_prefixes(self):
+        m = ParamManager(self.settings, self.request.session)
+        header = m.get_turtle_prefixes(":a rdfs:label \"a\" .")
+        assert "@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> ." in header
+        assert "@prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#> ." in header
+        assert "@prefix xsd:" not in header
+        assert header.endswith("rdf:type owl:Ontology .")
+
     def test_remove_prefix(self):
         m = ParamManager(self.settings, self.request.session)
         d = m.remove_prefix("SELECT ?a FROM { ?a a http://www.w3.org/2002/07/owl#Class. }")
@@ -0,0 +1,97 @@
+"""contain PrefixRegistry tests"""
+
+import unittest
+import os
+import json
+import tempfile
+import shutil
+
+from askomics.libaskomics.PrefixRegistry import PrefixRegistry
+
+class CountingRegistry(PrefixRegistry):
+    """Answer the prefix.cc lookups from a dict, and count them"""
+
+    def __init__(self, known, *args, **kwargs):
+        PrefixRegistry.__init__(self, *args, **kwargs)
+        self.known = known
+        self.fetched = []
+
+    def _fetch_prefix(self, prefix):
+        self.fetched.append(prefix)
+        if prefix in self.known:
+            return prefix, self.known[prefix]
+        return None
+
+    def _fetch_namespace(self, uri):
+        self.fetched.append(uri)
+        for prefix, namespace in self.known.items():
+            if uri.startswith(namespace):
+                return namespace, prefix
+        return None
+
+class PrefixRegistryTests(unittest.TestCase):
+    """Test for the PrefixRegistry class"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.directory, 'prefix_cache.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_bundled(self):
+        registry = CountingRegistry({}, self.cache_path, online=True)
+
+        assert registry.lookup('rdfs') == 'http://www.w3.org/2000/01/rdf-schema#'
+        assert registry.reverse_lookup('http://yago-knowledge.org/resource/Paris') == 'yago'
+        assert registry.fetched == []
+
+    def test_offline(self):
+        registry = CountingRegistry({'eat': 'http://example.org/eat#'}, self.cache_path)
+
+        assert registry.lookup('eat') is None
+        assert registry.reverse_lookup('http://example.org/eat#a') is None
+        assert registry.fetched == []
+
+    def test_shared_cache(self):
+        online = CountingRegistry({'eat': 'http://example.org/eat#'}, self.cache_path, online=True)
+        assert online.lookup('eat') == 'http://example.org/eat#'
+
+        # another process reads the answer from the cache, without the network
+        offline = CountingRegistry({}, self.cache_path)
+        assert offline.lookup('eat') == 'http://example.org/eat#'
+        assert offline.reverse_lookup('http://example.org/eat#a') is None
+
+        assert online.reverse_lookup('http://example.org/eat#a') == 'eat'
+        assert offline.reverse_lookup('http://example.org/eat#b') == 'eat'
+
+        with open(self.cache_path) as cache_file:
+            cache = json.load(cache_file)
+        assert cache['prefixes'] == {'eat': 'http://example.org/eat#'}
+        assert cache['namespaces'] == {'http://example.org/eat#': 'eat'}
+
+    def test_negative_cache(self):
+        registry = CountingRegistry({}, self.cache_path, online=True)
+
+        assert registry.lookup('toto') is None
+        assert registry.lookup('toto') is None
+        assert registry.fetched == ['toto']
+
+        expired = CountingRegistry({}, self.cache_path, online=True, negative_ttl=0)
+        assert expired.lookup('toto') is None
+        assert expired.fetched == ['toto']
+
+    def test_get_registry(self):
+        settings = {'askomics.files_dir': self.directory}
+
+        class Settings(object):
+            def is_defined(self, key):
+                return key in settings
+
+            def get_param(self, key):
+                return settings[key]
+
+        registry = PrefixRegistry.get_registry(Settings())
+        assert registry is PrefixRegistry.get_registry(Settings())
+        assert registry.cache_path == self.cache_path
+        assert not registry.online
@@ -6,12 +6,24 @@
 
 import unittest
 import os.path
+import io
+import gzip
+import json
+import tempfile
+import threading
+import time
+import socket
+import requests
+import urllib3
+import urllib.parse
 
 import sys
 import pprint
 PP = pprint.PrettyPrinter( indent=4, stream=sys.stderr )
 
 from askomics.libaskomics.rdfdb.QueryLauncher import *
+from askomics.libaskomics.EndpointManager import EndpointManager
+from askomics.test.TabularResultsStream_test import make_response
 
 # ================================================
 generic_query = "SELECT * WHERE { ?domain ?prop ?range } LIMIT 1"
@@ -88,3 +100,327 @@ class QueryLauncherTests( unittest.TestCase ):
         ep_uri = 'http://aqw.com/'
         o_ql = QueryLauncher_( {},{}, endpoint=ep_uri )
         self.assertRaises( NotEndpoint, o_ql.test_endpoint )
+
+
+class FailingSession(object):
+    """Fail the first requests with a connection error, then answer"""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def post(self, url, data=None, headers=None, stream=False, timeout=None):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise requests.exceptions.ConnectionError("connection refused")
+        return make_response('?s\n<http://a>\n', 'text/tab-separated-values')
+
+class BrokenBody(io.RawIOBase):
+    """A response body whose connection breaks after the headers"""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        raise urllib3.exceptions.ProtocolError("Connection broken")
+
+class BrokenBodySession(FailingSession):
+    """Answer with a body that can not be read"""
+
+    def post(self, url, data=None, headers=None, stream=False, timeout=None):
+        self.calls += 1
+        response = make_response('', 'text/tab-separated-values')
+        response.raw = BrokenBody()
+        return response
+
+class RetryTests( unittest.TestCase ):
+    """Test the retries and the circuit breaker of the QueryLauncher class."""
+
+    def setUp( self ):
+        self.database = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.database.close()
+        self.settings = {
+                'askomics.database_path': self.database.name,
+                'askomics.endpoint_retry_delay': '0',
+                'askomics.endpoint_failure_threshold': '1',
+            }
+        self.em = EndpointManager(self.settings, {})
+        self.service = {'id': self.em.save_endpoint('ep', 'http://ep/sparql', isenable=True)}
+
+    def tearDown( self ):
+        os.remove(self.database.name)
+
+    def launcher( self, http_session ):
+        o_ql = QueryLauncher( self.settings, {}, endpoint='http://ep/sparql' )
+        o_ql.get_http_session = lambda: http_session
+        return o_ql
+
+    def test_retry( self ):
+        http_session = FailingSession(2)
+        o_ql = self.launcher(http_session)
+        results = o_ql._execute_query(generic_query, externalService=self.service)
+        self.assertEqual( results, [{'s': 'http://a'}] )
+        self.assertEqual( http_session.calls, 3 )
+        self.assertEqual( self.em.list_endpoints()[0]['circuit'], 'closed' )
+        self.assertFalse( o_ql.unreachable )
+
+    def test_circuit( self ):
+        http_session = FailingSession(3)
+        o_ql = self.launcher(http_session)
+        self.assertEqual( o_ql._execute_query(generic_query, externalService=self.service), [] )
+        self.assertEqual( self.em.list_endpoints()[0]['circuit'], 'open' )
+        self.assertTrue( o_ql.unreachable )
+
+        # the endpoint is skipped without any request
+        self.assertEqual( o_ql._execute_query(generic_query, externalService=self.service), [] )
+        self.assertEqual( http_session.calls, 3 )
+
+    def test_broken_body( self ):
+        http_session = BrokenBodySession(0)
+        o_ql = self.launcher(http_session)
+        self.assertEqual( list(o_ql._execute_query(generic_query, externalService=self.service)), [] )
+        self.assertEqual( http_session.calls, 3 )
+        endpoint = self.em.list_endpoints()[0]
+        self.assertEqual( endpoint['circuit'], 'open' )
+        self.assertIn( 'Connection broken', endpoint['message'] )
+
+
+class RecordingSession(object):
+    """Record the requests, answer after a delay"""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.requests = []
+
+    def post(self, url, data=None, headers=None, stream=False, timeout=None):
+        self.requests.append({'data': data, 'timeout': timeout})
+        time.sleep(self.delay)
+        return make_response('?s\n<http://a>\n', 'text/tab-separated-values')
+
+class UnavailableSession(RecordingSession):
+    """Answer 503, as Fuseki does at the timeout of a query"""
+
+    def post(self, url, data=None, headers=None, stream=False, timeout=None):
+        self.requests.append({'data': data, 'timeout': timeout})
+        response = requests.Response()
+        response.status_code = 503
+        response.raw = io.BytesIO(b'Service Unavailable')
+        return response
+
+class DeadlineTests( unittest.TestCase ):
+    """Test the deadlines and the cancellation of the QueryLauncher class."""
+
+    def setUp( self ):
+        QueryLauncher.result_cache.clear()
+
+    def launcher( self, settings, http_session ):
+        o_ql = QueryLauncher( settings, {}, endpoint='http://localhost:8890/sparql' )
+        o_ql.get_http_session = lambda: http_session
+        return o_ql
+
+    def test_timeout( self ):
+        http_session = RecordingSession()
+        settings = {'askomics.endpoint': 'http://localhost:8890/sparql',
+                    'askomics.hack_virtuoso': 'true',
+                    'askomics.query_timeout': '60'}
+        self.launcher(settings, http_session).process_query(generic_query)
+
+        request = http_session.requests[0]
+        self.assertEqual( request['timeout'], (10, 60) )
+        self.assertEqual( request['data']['timeout'], '60000' )
+
+        # no timeout parameter for an unknown triplestore
+        settings['askomics.triplestore'] = 'generic'
+        settings['askomics.result_cache_size'] = '0'
+        self.launcher(settings, http_session).process_query(generic_query)
+        self.assertNotIn( 'timeout', http_session.requests[1]['data'] )
+
+    def test_fuseki_timeout( self ):
+        http_session = UnavailableSession()
+        settings = {'askomics.endpoint': 'http://localhost:8890/sparql',
+                    'askomics.triplestore': 'fuseki',
+                    'askomics.query_timeout': '60'}
+        self.assertRaises( QueryTimeout, self.launcher(settings, http_session).process_query, generic_query )
+        self.assertEqual( http_session.requests[0]['data']['timeout'], '60.000' )
+
+        # without the timeout parameter, the endpoint is unavailable
+        settings['askomics.endpoint'] = 'http://other:3030/sparql'
+        self.assertRaises( SPARQLError, self.launcher(settings, http_session).process_query, generic_query )
+
+    def test_deadline( self ):
+        http_session = RecordingSession()
+        o_ql = self.launcher({}, http_session)
+
+        o_ql.deadline = time.time() + 5
+        o_ql.process_query(generic_query)
+        self.assertLessEqual( http_session.requests[0]['timeout'][1], 5 )
+
+        o_ql.deadline = time.time() - 1
+        self.assertRaises( QueryTimeout, o_ql.process_query, generic_query )
+        self.assertEqual( len(http_session.requests), 1 )
+
+    def test_cancel( self ):
+        http_session = RecordingSession(delay=2)
+        o_ql = self.launcher({}, http_session)
+        cancelled = threading.Event()
+        o_ql.cancel_check = cancelled.is_set
+
+        threading.Timer(0.2, cancelled.set).start()
+        time0 = time.time()
+        self.assertRaises( QueryCancelled, o_ql.process_query, generic_query )
+        self.assertLess( time.time() - time0, 1 )
+
+    def test_cancel_closes_connection( self ):
+        # a triplestore which never answers, until the client closes the connection
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        closed = threading.Event()
+
+        def serve():
+            connection, address = server.accept()
+            while connection.recv(65536):
+                pass
+            closed.set()
+            connection.close()
+
+        threading.Thread(target=serve, daemon=True).start()
+
+        o_ql = self.launcher({}, requests.Session())
+        o_ql.endpoint = 'http://127.0.0.1:%d/sparql' % server.getsockname()[1]
+        cancelled = threading.Event()
+        o_ql.cancel_check = cancelled.is_set
+
+        threads = threading.active_count()
+        threading.Timer(0.2, cancelled.set).start()
+        self.assertRaises( QueryCancelled, o_ql.process_query, generic_query )
+
+        # the connection and the thread waiting for the response are gone
+        self.assertTrue( closed.wait(2) )
+        for _ in range(20):
+            if threading.active_count() <= threads:
+                break
+            time.sleep(0.05)
+        self.assertLessEqual( threading.active_count(), threads )
+        server.close()
+
+
+def make_gzip_response(body, content_type):
+    """A streamed response with a gzip compressed body"""
+    response = requests.Response()
+    response.status_code = 200
+    response.headers['Content-Type'] = content_type
+    response.headers['Content-Encoding'] = 'gzip'
+    response.raw = urllib3.HTTPResponse(body=io.BytesIO(gzip.compress(body.encode('utf-8'))),
+                                        headers={'Content-Encoding': 'gzip'},
+                                        preload_content=False)
+    return response
+
+class UpdateSession(object):
+    """
+    Record the update bodies, refuse the compressed ones, or ignore them
+    answering 200, if asked
+    """
+
+    def __init__(self, refuse_gzip=False, ignore_gzip=False):
+        self.refuse_gzip = refuse_gzip
+        self.ignore_gzip = ignore_gzip
+        self.requests = []
+        self.probes = []
+        self.triples = set()
+
+    def post(self, url, data=None, headers=None, stream=False, timeout=None):
+        headers = headers or {}
+        encoding = headers.get('Content-Encoding')
+        if isinstance(data, dict):
+            body = data
+        else:
+            if encoding == 'gzip':
+                data = gzip.decompress(data)
+            body = dict(urllib.parse.parse_qsl(data.decode('utf-8')))
+        query = body.get('update', body.get('query', ''))
+
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = io.BytesIO(b'')
+        if QueryLauncher.COMPRESSION_PROBE_GRAPH not in query:
+            self.requests.append(encoding)
+            if self.refuse_gzip and encoding:
+                response.status_code = 400
+        elif query.startswith('ASK'):
+            answer = query[query.index('{ GRAPH'):] in self.triples
+            response.raw = io.BytesIO(json.dumps({'boolean': answer}).encode('utf-8'))
+        elif query.startswith('INSERT'):
+            self.probes.append(encoding)
+            if self.refuse_gzip:
+                response.status_code = 400
+            elif not self.ignore_gzip:
+                self.triples.add(query[query.index('{ GRAPH'):])
+        return response
+
+class CompressionTests( unittest.TestCase ):
+    """Test the compressed transfers of the QueryLauncher class."""
+
+    def setUp( self ):
+        QueryLauncher.compressed_urls.clear()
+        QueryLauncher.uncompressed_urls.clear()
+        QueryLauncher.endpoint_formats.clear()
+
+    def tearDown( self ):
+        QueryLauncher.compressed_urls.clear()
+        QueryLauncher.uncompressed_urls.clear()
+        QueryLauncher.endpoint_formats.clear()
+
+    def launcher( self, http_session, compression='true' ):
+        o_ql = QueryLauncher( {'askomics.http_compression': compression,
+                               'askomics.http_compression_min_size': '100'}, {}, endpoint='http://ep/sparql' )
+        o_ql.allowUpdate = True
+        o_ql.get_http_session = lambda: http_session
+        return o_ql
+
+    def test_compressed_results( self ):
+        tsv = '?s\n' + ''.join('<http://a/%d>\n' % i for i in range(1000))
+        o_ql = self.launcher(None)
+        o_ql._post = lambda session, url, **kwargs: make_gzip_response(tsv, 'text/tab-separated-values')
+        results = o_ql.process_query(generic_query)
+        self.assertEqual( len(results), 1000 )
+        self.assertEqual( results[999]['s'], 'http://a/999' )
+
+        document = '{"head": {"vars": ["s"]}, "results": {"bindings": [{"s": {"type": "uri", "value": "http://a"}}]}}'
+        o_ql._post = lambda session, url, **kwargs: make_gzip_response(document, 'application/sparql-results+json')
+        self.assertEqual( list(o_ql.process_query(generic_query, stream=True)), [{'s': 'http://a'}] )
+
+    def test_compressed_update( self ):
+        http_session = UpdateSession()
+        o_ql = self.launcher(http_session)
+        o_ql._execute_query("INSERT DATA { <http://a> <http://b> 'x' }")
+        o_ql._execute_query("INSERT DATA { <http://a> <http://b> '" + 'x' * 200 + "' }")
+        self.assertEqual( http_session.requests, [None, 'gzip'] )
+        self.assertEqual( http_session.probes, ['gzip'] )
+
+        # the compressed bodies are opt-in
+        http_session = UpdateSession()
+        o_ql = self.launcher(http_session, compression='false')
+        o_ql._execute_query("INSERT DATA { <http://a> <http://b> '" + 'x' * 200 + "' }")
+        self.assertEqual( http_session.requests, [None] )
+        self.assertEqual( http_session.probes, [] )
+
+    def test_refused_compression( self ):
+        http_session = UpdateSession(refuse_gzip=True)
+        o_ql = self.launcher(http_session)
+        query = "INSERT DATA { <http://a> <http://b> '" + 'x' * 200 + "' }"
+        o_ql._execute_query(query)
+        o_ql._execute_query(query)
+        self.assertEqual( http_session.requests, [None, None] )
+        self.assertEqual( http_session.probes, ['gzip'] )
+
+    def test_ignored_compression( self ):
+        # an endpoint answering 200 to a compressed body it does not apply
+        http_session = UpdateSession(ignore_gzip=True)
+        o_ql = self.launcher(http_session)
+        query = "INSERT DATA { <http://a> <http://b> '" + 'x' * 200 + "' }"
+        o_ql._execute_query(query)
+        o_ql._execute_query(query)
+        self.assertEqual( http_session.requests, [None, None] )
+        self.assertEqual( http_session.probes, ['gzip'] )
+        self.assertIn( 'http://ep/sparql', QueryLauncher.uncompressed_urls )
@@ -0,0 +1,161 @@
+"""contain ResultCache tests"""
+
+import unittest
+import os
+import shutil
+import tempfile
+
+from askomics.libaskomics.rdfdb.ResultCache import ResultCache
+from askomics.libaskomics.rdfdb.ResultSet import ResultSet, ChainedResultsStream
+from askomics.libaskomics.rdfdb.QueryLauncher import QueryLauncher
+from askomics.test.TabularResultsStream_test import make_response
+
+TSV = '?s\n<http://example.org/A>\n<http://example.org/B>\n'
+
+class CountingSession(object):
+    """Answer the select queries with TSV, count the requests"""
+
+    def __init__(self):
+        self.queries = []
+
+    def post(self, url, data=None, headers=None, stream=False, timeout=None):
+        self.queries.append(data)
+        # update bodies are sent url encoded
+        if isinstance(data, bytes):
+            return make_response('', 'text/plain')
+        return make_response(TSV, 'text/tab-separated-values')
+
+class CountingQueryLauncher(QueryLauncher):
+
+    def __init__(self, settings, http_session):
+        QueryLauncher.__init__(self, settings, {}, endpoint='http://local/sparql')
+        self.allowUpdate = True
+        self.http_session = http_session
+
+    def get_http_session(self):
+        return self.http_session
+
+class ResultCacheTests(unittest.TestCase):
+    """Test for the ResultCache class"""
+
+    def setUp(self):
+        self.results = ResultSet(rows=[{'s': 'http://example.org/A'}])
+        QueryLauncher.result_cache.clear()
+
+    def tearDown(self):
+        QueryLauncher.result_cache.clear()
+
+    def test_key(self):
+        query = "SELECT ?s\n  FROM <http://g1>\n  FROM <http://g2>\n\n  # comment\n  WHERE { ?s ?p ?o }"
+        key = ResultCache.make_key('http://ep', query)
+        assert key == ResultCache.make_key('http://ep', "SELECT ?s\nFROM <http://g1>\nFROM <http://g2>\nWHERE { ?s ?p ?o }")
+        assert key[2] == frozenset(['http://g1', 'http://g2'])
+
+        assert ResultCache.get_dependencies("SELECT ?s WHERE { ?s ?p ?o }") is None
+        assert ResultCache.get_dependencies("SELECT ?s FROM <http://g1> WHERE { GRAPH ?g { ?s ?p ?o } }") is None
+        assert ResultCache.get_dependencies("SELECT ?s FROM <http://g1> WHERE { ?s :graph ?graph }") == frozenset(['http://g1'])
+
+    def test_updated_graphs(self):
+        assert ResultCache.get_updated_graphs("DROP SILENT GRAPH <http://g1>") == ['http://g1']
+        assert ResultCache.get_updated_graphs("LOAD <http://f.ttl> INTO GRAPH <http://g1>") == ['http://g1']
+        assert ResultCache.get_updated_graphs("INSERT DATA { GRAPH <askomics:graph:shortcut> { } }") == ['askomics:graph:shortcut']
+        assert ResultCache.get_updated_graphs("DELETE { GRAPH ?g { ?s ?p ?o } } WHERE { }") is None
+        assert ResultCache.get_updated_graphs("CLEAR ALL") is None
+
+    def test_lru(self):
+        cache = ResultCache(max_entries=2)
+        cache.put('a', self.results, 0)
+        cache.put('b', self.results, 0)
+        cache.get('a')
+        cache.put('c', self.results, 0)
+
+        assert cache.get('a') is self.results
+        assert cache.get('b') is None
+        assert len(cache) == 2
+
+    def test_memory(self):
+        size = ResultCache.estimate_size(self.results)
+        cache = ResultCache(max_bytes=size * 2)
+        for key in 'abc':
+            cache.put(key, self.results, 0)
+        assert len(cache) == 2
+
+        big = ResultSet(rows=[{'s': 'x' * size * 2}])
+        assert not cache.put('big', big, 0)
+
+    def test_invalidate(self):
+        cache = ResultCache()
+        cache.put(('ep', 'q1', frozenset(['g1'])), self.results, 0)
+        cache.put(('ep', 'q2', frozenset(['g2'])), self.results, 0)
+        cache.put(('ep', 'q3', None), self.results, 0)
+
+        cache.invalidate(['g1'])
+        assert len(cache) == 1
+        assert cache.get(('ep', 'q2', frozenset(['g2']))) is self.results
+
+        # results computed before an invalidation are not stored
+        assert not cache.put(('ep', 'q1', frozenset(['g1'])), self.results, 0)
+
+    def test_invalidate_processes(self):
+        directory = tempfile.mkdtemp()
+        try:
+            version_path = os.path.join(directory, 'result_cache.version')
+            cache = ResultCache(version_path=version_path)
+            other = ResultCache(version_path=version_path)
+            key = ('ep', 'q1', frozenset(['g1']))
+            assert cache.put(key, self.results, cache.stamp())
+            generation = cache.stamp()
+
+            # a graph changed in another process
+            other.invalidate(['g2'])
+            assert cache.get(key) is None
+            assert not cache.put(key, self.results, generation)
+            assert cache.put(key, self.results, cache.stamp())
+            assert cache.get(key) is self.results
+        finally:
+            shutil.rmtree(directory)
+
+    def test_query_launcher(self):
+        session = CountingSession()
+        settings = {'askomics.endpoint': 'http://local/sparql'}
+        ql = CountingQueryLauncher(settings, session)
+        query = "SELECT ?s FROM <http://g1> WHERE { ?s ?p ?o }"
+
+        assert ql.process_query(query) == [{'s': 'http://example.org/A'}, {'s': 'http://example.org/B'}]
+        assert ql.process_query(query) == [{'s': 'http://example.org/A'}, {'s': 'http://example.org/B'}]
+        assert len(session.queries) == 1
+
+        ql.process_query("DROP SILENT GRAPH <http://g2>")
+        ql.process_query(query)
+        assert len(session.queries) == 2
+
+        ql.process_query("DROP SILENT GRAPH <http://g1>")
+        ql.process_query(query)
+        assert len(session.queries) == 4
+
+        # the other endpoints are not cached
+        ql = CountingQueryLauncher({'askomics.endpoint': 'http://other/sparql'}, session)
+        ql.process_query(query)
+        ql.process_query(query)
+        assert len(session.queries) == 6
+
+    def test_large_results(self):
+        session = CountingSession()
+        # about 100 bytes, less than the two rows
+        settings = {'askomics.endpoint': 'http://local/sparql', 'askomics.result_cache_memory': '0.0001'}
+        ql = CountingQueryLauncher(settings, session)
+        query = "SELECT ?s FROM <http://g1> WHERE { ?s ?p ?o }"
+
+        # streamed past the limit, not cached
+        results = ql._execute_query(query)
+        assert isinstance(results, ChainedResultsStream)
+        assert [dict(row) for row in results] == [{'s': 'http://example.org/A'}, {'s': 'http://example.org/B'}]
+
+        assert ql.process_query(query) == [{'s': 'http://example.org/A'}, {'s': 'http://example.org/B'}]
+        assert len(session.queries) == 2
+        assert len(QueryLauncher.result_cache) == 0
+
+        # neither cached nor shared, never buffered
+        settings = {'askomics.result_cache_size': '0', 'askomics.query_coalescing': 'false'}
+        ql = CountingQueryLauncher(settings, session)
+        assert not isinstance(ql._execute_query(query), (ResultSet, ChainedResultsStream))
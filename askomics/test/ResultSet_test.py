@@ -0,0 +1,67 @@
+"""contain ResultSet tests"""
+
+import unittest
+import json
+import sys
+
+from askomics.libaskomics.rdfdb.ResultSet import ResultSet
+
+class ResultSetTests(unittest.TestCase):
+    """Test for the ResultSet class"""
+
+    def setUp(self):
+        self.rows = [
+            {'g': 'urn:g1', 'nodeUri': 'http://a#A', 'nodeLabel': 'A'},
+            {'g': 'urn:g1', 'nodeUri': 'http://a#B'},
+            {'g': 'urn:g2', 'nodeUri': 'http://a#C', 'nodeLabel': 'C', 'accesLevel': 'private'}
+        ]
+        self.result_set = ResultSet(rows=self.rows)
+
+    def test_rows(self):
+        rs = self.result_set
+
+        assert len(rs) == 3
+        assert rs.vars == ['g', 'nodeUri', 'nodeLabel', 'accesLevel']
+        assert rs == self.rows
+        assert rs[1] == self.rows[1]
+        assert rs[-1]['accesLevel'] == 'private'
+        assert 'nodeLabel' not in rs[1]
+        assert rs[1].get('nodeLabel', 'none') == 'none'
+        assert list(rs[1].keys()) == ['g', 'nodeUri']
+        self.assertRaises(KeyError, lambda: rs[1]['nodeLabel'])
+        self.assertRaises(IndexError, lambda: rs[3])
+        assert rs.column('g') == ['urn:g1', 'urn:g1', 'urn:g2']
+
+    def test_slice(self):
+        rs = self.result_set[1:]
+
+        assert isinstance(rs, ResultSet)
+        assert len(rs) == 2
+        assert rs == self.rows[1:]
+        assert len(self.result_set[5:10]) == 0
+
+    def test_add(self):
+        rs = ResultSet(rows=[{'g': 'urn:g3', 'other': 'x'}])
+        total = self.result_set + rs
+
+        assert len(total) == 4
+        assert total == self.rows + [{'g': 'urn:g3', 'other': 'x'}]
+
+        rs += self.result_set
+        assert len(rs) == 4
+        assert rs[1] == self.rows[0]
+
+        rs.append(self.result_set[0])
+        assert rs[-1] == self.rows[0]
+
+    def test_json(self):
+        serialized = json.dumps(self.result_set, default=lambda obj: obj.__json__(None))
+        assert json.loads(serialized) == self.rows
+
+    def test_memory(self):
+        rows = [{'v' + str(i): 'value' for i in range(20)} for n in range(2000)]
+        rs = ResultSet(rows=rows)
+
+        size_rows = sys.getsizeof(rows) + sum(sys.getsizeof(row) for row in rows)
+        size_rs = sum(sys.getsizeof(rs.column(var)) for var in rs.vars)
+        assert size_rs * 2 < size_rows
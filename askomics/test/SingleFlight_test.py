@@ -0,0 +1,200 @@
+"""contain SingleFlight tests"""
+
+import unittest
+import threading
+import time
+
+from askomics.libaskomics.rdfdb.SingleFlight import SingleFlight
+from askomics.libaskomics.rdfdb.QueryLauncher import QueryLauncher, QueryCancelled, QueryTimeout
+from askomics.test.TabularResultsStream_test import make_response
+
+TSV = '?s\n<http://example.org/A>\n<http://example.org/B>\n'
+
+class SlowSession(object):
+    """Answer the queries after a delay, and count them"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def post(self, url, data=None, headers=None, stream=False, timeout=None):
+        self.calls += 1
+        time.sleep(0.2)
+        return make_response(TSV, 'text/tab-separated-values')
+
+class SlowQueryLauncher(QueryLauncher):
+
+    def __init__(self, settings, http_session):
+        QueryLauncher.__init__(self, settings, {}, endpoint='http://slow/sparql')
+        self.http_session = http_session
+
+    def get_http_session(self):
+        return self.http_session
+
+def run_threads(function, count):
+    results = [None] * count
+
+    def run(index):
+        results[index] = function()
+
+    threads = [threading.Thread(target=run, args=(index, )) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+class SingleFlightTests(unittest.TestCase):
+    """Test for the SingleFlight class"""
+
+    def test_coalesce(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        def function():
+            calls.append(1)
+            time.sleep(0.2)
+            return object()
+
+        results = run_threads(lambda: single_flight.do('key', function), 5)
+        assert len(calls) == 1
+        assert all(result is results[0] for result in results)
+        assert len(single_flight) == 0
+
+        # nothing is kept once done
+        single_flight.do('key', function)
+        assert len(calls) == 2
+
+    def test_error(self):
+        single_flight = SingleFlight()
+
+        def function():
+            time.sleep(0.2)
+            raise ValueError("failed")
+
+        errors = []
+
+        def call():
+            try:
+                single_flight.do('key', function)
+            except ValueError as e:
+                errors.append(e)
+
+        run_threads(call, 3)
+        assert len(errors) == 3
+        assert len(single_flight) == 0
+
+    def test_private_error(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        def function():
+            calls.append(1)
+            time.sleep(0.2)
+            if len(calls) == 1:
+                raise TimeoutError("the deadline of the leader")
+            return 'result'
+
+        def call():
+            try:
+                return single_flight.do('key', function, private_errors=(TimeoutError, ))
+            except TimeoutError:
+                return 'timeout'
+
+        results = run_threads(call, 3)
+        # the waiters call again, once
+        assert sorted(results) == ['result', 'result', 'timeout']
+        assert len(calls) == 2
+
+    def test_waiter_check(self):
+        single_flight = SingleFlight()
+        leader = threading.Thread(target=single_flight.do, args=('key', lambda: time.sleep(0.5)))
+        leader.start()
+        time.sleep(0.05)
+
+        deadline = time.time() + 0.1
+
+        def check():
+            if time.time() >= deadline:
+                raise TimeoutError("the deadline of the waiter")
+            return deadline - time.time()
+
+        time0 = time.time()
+        with self.assertRaises(TimeoutError):
+            single_flight.do('key', lambda: None, check=check)
+        assert time.time() - time0 < 0.3
+        leader.join()
+
+    def test_query_launcher_cancelled(self):
+        session = SlowSession()
+        cancelled = SlowQueryLauncher({}, session)
+        cancelled.cancel_check = lambda: True
+        ql = SlowQueryLauncher({}, session)
+
+        def run_cancelled():
+            try:
+                cancelled.process_query('SELECT ?s WHERE { ?s ?p ?o }')
+            except QueryCancelled:
+                return 'cancelled'
+
+        thread = threading.Thread(target=run_cancelled)
+        thread.start()
+        time.sleep(0.05)
+        # the other job waiting for the cancelled one runs the query itself
+        assert len(ql.process_query('SELECT ?s WHERE { ?s ?p ?o }')) == 2
+        thread.join()
+
+        # a waiter stops at its own deadline
+        leader = threading.Thread(target=lambda: ql.process_query('SELECT ?o WHERE { ?s ?p ?o }'))
+        leader.start()
+        time.sleep(0.05)
+        waiter = SlowQueryLauncher({}, session)
+        waiter.deadline = time.time() + 0.05
+        with self.assertRaises(QueryTimeout):
+            waiter.process_query('SELECT ?o WHERE { ?s ?p ?o }')
+        leader.join()
+
+    def test_query_launcher(self):
+        session = SlowSession()
+        ql = SlowQueryLauncher({}, session)
+
+        results = run_threads(lambda: ql.process_query('SELECT ?s WHERE { ?s ?p ?o }'), 4)
+        assert session.calls == 1
+        for result in results:
+            assert result == [{'s': 'http://example.org/A'}, {'s': 'http://example.org/B'}]
+        # each caller gets its own copy
+        assert results[0] is not results[1]
+
+        # streams are not shared
+        results = run_threads(lambda: list(ql.process_query('SELECT ?s WHERE { ?s ?p ?o }', stream=True)), 2)
+        assert session.calls == 3
+
+    def test_not_shareable(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        def function():
+            calls.append(1)
+            time.sleep(0.2)
+            return object()
+
+        results = run_threads(lambda: single_flight.do('key', function, shareable=lambda result: False), 3)
+        # each waiter runs the function
+        assert len(calls) == 3
+        assert len(set(results)) == 3
+
+    def test_query_launcher_large_results(self):
+        session = SlowSession()
+        ql = SlowQueryLauncher({'askomics.result_cache_memory': '0.0001'}, session)
+
+        # streamed by the leader, the waiters send the query
+        results = run_threads(lambda: ql.process_query('SELECT ?s WHERE { ?s ?p ?o }'), 3)
+        assert session.calls == 3
+        for result in results:
+            assert result == [{'s': 'http://example.org/A'}, {'s': 'http://example.org/B'}]
+
+    def test_disabled(self):
+        session = SlowSession()
+        ql = SlowQueryLauncher({'askomics.query_coalescing': 'false'}, session)
+
+        run_threads(lambda: ql.process_query('SELECT ?s WHERE { ?s ?p ?o }'), 3)
+        assert session.calls == 3
@@ -0,0 +1,127 @@
+"""contain SparqlAst tests"""
+
+import unittest
+
+from askomics.libaskomics.rdfdb.SparqlAst import Pattern, Block, SelectQuery
+
+class SparqlAstTests(unittest.TestCase):
+    """Test for the SparqlAst classes"""
+
+    def test_pattern(self):
+        assert Pattern('  ?a   rdf:type  :Gene . ').text == '?a rdf:type :Gene'
+        assert Pattern('FILTER ( ?a = "x  y" )').text == 'FILTER ( ?a = "x  y" )'
+        assert Pattern('?a :label "l\'arbre"').text == '?a :label "l\'arbre"'
+
+        # the comments do not hide the next lines
+        assert Pattern('# the genes\n?a rdf:type :Gene').text == '?a rdf:type :Gene'
+        assert Pattern('?a :p <urn:a#b> # c\n. ?b :p "#1"').text == '?a :p <urn:a#b> . ?b :p "#1"'
+        assert Pattern('# nothing else').text == '# nothing else'
+
+        # the dot of a number is not the terminator
+        assert Pattern('?a :p ?b.').to_sparql() == '?a :p ?b.\n'
+        assert Pattern('?a :p 1.').to_sparql() == '?a :p 1.\n'
+        assert Pattern('?a :p 1 .').to_sparql() == '?a :p 1.\n'
+
+        assert Pattern('?a :p ?b').kind == Pattern.TRIPLE
+        assert Pattern('filter (?a < 2)').kind == Pattern.FILTER
+        assert Pattern('VALUES ?a { <urn:a> }').kind == Pattern.VALUES
+        assert Pattern('BIND (?a AS ?b)').kind == Pattern.BIND
+
+    def test_triples(self):
+        assert Pattern('?a :p ?b . ?b :q ?c .').triples() == ['?a :p ?b', '?b :q ?c']
+        assert Pattern('?a :p ?b ; :q "x . y"@en , ?c').triples() == ['?a :p ?b', '?a :q "x . y"@en', '?a :q ?c']
+        assert Pattern('?a :v 1.5').triples() == ['?a :v 1.5']
+
+        # property paths, blank nodes and collections
+        assert Pattern('?a :p/:q ?b').triples() is None
+        assert Pattern('?a ^:p ?b').triples() is None
+        assert Pattern('?a :p+ ?b').triples() is None
+        assert Pattern('?a :p [ :q ?b ]').triples() is None
+
+    def test_scoped_join(self):
+        # the triples of a constraint may match in two graphs, as with FROM
+        block = Block.from_json([['?a :p ?b . ?b :q ?c'], ''])
+        assert block.is_scopable()
+        assert block.to_sparql('', ['urn:g1', 'urn:g2']) == (
+            'GRAPH ?askomics_graph1 { ?a :p ?b }\n'
+            'VALUES ?askomics_graph1 { <urn:g1> <urn:g2> }\n'
+            'GRAPH ?askomics_graph2 { ?b :q ?c }\n'
+            'VALUES ?askomics_graph2 { <urn:g1> <urn:g2> }\n')
+
+        assert not Block.from_json([['?a :p ?b', [['?b :q/:r ?c'], 'OPTIONAL']], '']).is_scopable()
+        assert not Block.from_json([['{ ?a :p ?b } UNION { ?a :q ?b }'], '']).is_scopable()
+        assert Block.from_json([['?a :p ?b', [['?b :q/:r ?c'], 'SERVICE <http://other/sparql>']], '']).is_scopable()
+
+    def test_canonical_order(self):
+        first = Block.from_json([[
+            '?b rdf:type :Protein',
+            'FILTER (?x > 2)',
+            '?a rdf:type :Gene',
+            [['?a :position ?x'], 'OPTIONAL'],
+            '?a :name ?n'
+        ], ''])
+        second = Block.from_json([[
+            '?a rdf:type  :Gene',
+            '?b rdf:type :Protein',
+            'FILTER (?x > 2)',
+            [['?a :position ?x'], 'OPTIONAL'],
+            '?a :name ?n'
+        ], ''])
+
+        assert first.to_sparql() == second.to_sparql() == (
+            '?a rdf:type :Gene.\n'
+            '?b rdf:type :Protein.\n'
+            'FILTER (?x > 2).\n'
+            'OPTIONAL {\n'
+            '\t?a :position ?x.\n'
+            '}\n'
+            '?a :name ?n.\n')
+
+        # the optional patterns depend on their position
+        third = Block.from_json([['?a :name ?n', [['?a :position ?x'], 'OPTIONAL']], ''])
+        assert third.to_sparql() != first.to_sparql()
+
+    def test_malformed(self):
+        with self.assertRaises(ValueError):
+            Block.from_json([[1], ''])
+
+    def test_select_query(self):
+        where = Block.from_json([['?b :p ?c', '?a :p ?b'], ''])
+        query = SelectQuery('?a  ?b ?a', where, ['urn:g2', 'urn:g1', 'urn:g2'], 'LIMIT 10')
+
+        assert query.to_sparql() == (
+            'SELECT DISTINCT ?a ?b\n'
+            'FROM <urn:g1>\n'
+            'FROM <urn:g2>\n'
+            'WHERE {\n'
+            '?a :p ?b.\n'
+            '?b :p ?c.\n'
+            '}\n'
+            'LIMIT 10\n')
+
+        other = SelectQuery('?a ?b', Block.from_json([['?a :p ?b', '?b :p ?c'], '']),
+                            ['urn:g1', 'urn:g2'], 'LIMIT 10')
+        assert query.fingerprint() == other.fingerprint()
+        assert len(query.fingerprint()) == 40
+
+        assert SelectQuery('?b ?a', where).fingerprint() != SelectQuery('?a ?b', where).fingerprint()
+
+    def test_plan(self):
+        block = Block.from_json([[
+            '?a :name ?n',
+            '?a rdf:type :Gene',
+            [['?a :position ?x'], 'OPTIONAL']
+        ], ''])
+        estimates = {'?a rdf:type :Gene': 10, '?a :name ?n': 1000, '?a :position ?x': 5}
+
+        def estimate(pattern, bound):
+            return estimates[pattern] if '?a' not in bound else 1
+
+        assert block.plan(estimate) == [
+            {'depth': 0, 'pattern': '?a rdf:type :Gene', 'estimate': 10},
+            {'depth': 0, 'pattern': '?a :name ?n', 'estimate': 1},
+            {'depth': 0, 'pattern': 'OPTIONAL', 'estimate': None},
+            {'depth': 1, 'pattern': '?a :position ?x', 'estimate': 1}]
+
+        # the plan follows the text of the query
+        assert [step['pattern'] for step in block.plan()] == ['?a :name ?n', '?a rdf:type :Gene', 'OPTIONAL', '?a :position ?x']
@@ -0,0 +1,83 @@
+"""contain SparqlTemplate tests"""
+
+import unittest
+
+from pyramid.paster import get_appsettings
+from pyramid import testing
+
+from askomics.libaskomics.rdfdb.SparqlTemplate import SparqlTemplate
+from askomics.libaskomics.rdfdb.SparqlQueryBuilder import SparqlQueryBuilder
+from askomics.libaskomics.rdfdb.SparqlQueryGraph import SparqlQueryGraph
+from askomics.libaskomics.rdfdb.SparqlQueryAuth import SparqlQueryAuth
+
+class SparqlTemplateTests(unittest.TestCase):
+    """Test for the SparqlTemplate class"""
+
+    def setUp(self):
+        self.settings = get_appsettings('configs/tests.ini', name='main')
+        self.request = testing.DummyRequest()
+        self.request.session['username'] = 'jdoe'
+        self.request.session['admin'] = False
+
+        self.sqb = SparqlQueryBuilder(self.settings, self.request.session)
+
+    def test_escape(self):
+        assert SparqlTemplate.escape('literal', 'a"b\\c\nd') == '"a\\"b\\\\c\\nd"'
+        assert SparqlTemplate.escape('int', '12') == '12'
+        assert SparqlTemplate.escape('pname', 'owl:Class') == 'owl:Class'
+        assert SparqlTemplate.escape('iri', 'mailto:jdoe@example.com') == '<mailto:jdoe@example.com>'
+        assert SparqlTemplate.escape('local', 'gene', self.sqb) == '<' + self.settings['askomics.prefix'] + 'gene>'
+
+        with self.assertRaises(ValueError):
+            SparqlTemplate.escape('iri', 'http://a/b> } ; DROP ALL ; #')
+        with self.assertRaises(ValueError):
+            SparqlTemplate.escape('local', 'gene rdf:type', self.sqb)
+        with self.assertRaises(ValueError):
+            SparqlTemplate.escape('pname', 'owl:Class . ?s ?p ?o')
+        with self.assertRaises(ValueError):
+            SparqlTemplate.escape('int', '1 }')
+        with self.assertRaises(ValueError):
+            SparqlTemplate.escape('unknown', 'a')
+
+    def test_render(self):
+        template = SparqlTemplate.select('?s', 'GRAPH ?g { ?s dc:creator $username . }', username='literal')
+
+        query = template.render(self.sqb, username='jdoe')
+        assert query.startswith('PREFIX dc: <http://purl.org/dc/elements/1.1/>\n')
+        assert 'dc:creator "jdoe"' in query
+
+        # the parameters can not close the literal
+        query = template.render(self.sqb, username='jdoe" . ?s ?p ?o . #')
+        assert 'dc:creator "jdoe\\" . ?s ?p ?o . #"' in query
+
+        with self.assertRaises(ValueError):
+            template.render(self.sqb)
+
+    def test_compile(self):
+        template = SparqlTemplate('SELECT ?s WHERE { ?s rdf:type $name . ?s :label ?l }', name='local')
+
+        compiled = template.compile(self.sqb)
+        assert template.compile(self.sqb) is compiled
+
+        # one text per askomics namespaces
+        settings = dict(self.settings)
+        settings['askomics.prefix'] = 'http://other.org/'
+        other = SparqlQueryBuilder(settings, self.request.session)
+        assert template.compile(other) is not compiled
+        query = template.render(other, name='gene')
+        assert 'PREFIX : <http://other.org/>' in query
+        assert '<http://other.org/gene>' in query
+
+    def test_builders(self):
+        self.request.session['username'] = 'jd"oe'
+        sqg = SparqlQueryGraph(self.settings, self.request.session)
+        assert 'dc:creator "jd\\"oe"' in sqg.get_user_abstraction_entity()
+        # the datasets are listed from their metadatas only
+        assert 'count(' not in sqg.get_user_graph_infos()
+        assert 'BIND("jd\\"oe" AS ?owner)' in sqg.get_user_graph_infos()
+
+        with self.assertRaises(ValueError):
+            sqg.get_if_positionable('http://a/b> } DELETE WHERE { ?s ?p ?o')
+
+        sqa = SparqlQueryAuth(self.settings, self.request.session)
+        assert '<mailto:jdoe@example.com>' in sqa.get_password_with_email('jdoe@example.com')
@@ -0,0 +1,161 @@
+"""contain StatisticsManager tests"""
+
+import unittest
+import os
+import tempfile
+import shutil
+import time
+import json
+
+from pyramid.paster import get_appsettings
+from pyramid import testing
+from pyramid.renderers import render
+
+from askomics.libaskomics.StatisticsManager import StatisticsManager
+from askomics.libaskomics.rdfdb.ResultSet import ResultSet
+
+class EndpointsLauncher(object):
+    """Answer the stats queries as two askomics endpoints"""
+
+    def __init__(self):
+        self.locals = []
+
+    def process_query(self, query, lendpoints, local=True):
+        self.locals.append(local)
+        if 'COUNT(' in query:
+            return ResultSet(rows=[{'number': '5'}, {'number': '7'}])
+        if '?version' in query:
+            return ResultSet(rows=[{'graph': 'remote.tsv', 'date': '2018-02-01', 'owner': 'jsmith',
+                                    'server': 'remote', 'version': '18.04'}])
+        if '?relname' in query:
+            return ResultSet(rows=[{'domain': 'Gene', 'relname': 'in', 'range': 'urn:a'},
+                                   {'domain': 'Gene', 'relname': 'of', 'range': 'Species'}])
+        return ResultSet(rows=[{'class': 'Species', 'attr': 'name'}])
+
+class StaticStatistics(StatisticsManager):
+    """Build the statistics of the graphs without the triplestore"""
+
+    graphs = {
+        'urn:a': ('public', 'jdoe'),
+        'urn:b': ('private', 'jdoe'),
+        'urn:c': ('private', 'jsmith'),
+        'urn:d': ('public', 'jsmith')
+    }
+
+    def build(self, graph):
+        if graph == 'urn:broken':
+            raise ValueError('triplestore down')
+        access, owner = self.graphs[graph]
+        return {
+            'graph': graph + '.tsv', 'date': '2018-01-01', 'owner': owner,
+            'server': 'localhost', 'version': '18.04', 'access': access,
+            'ntriples': 10, 'nentities': 2,
+            'classes': ['urn:Gene', graph + '#Entity'],
+            'class_attr': [{'class': 'Gene', 'attr': 'name'}],
+            'class_rel': [{'domain': 'Gene', 'relname': 'in', 'range': graph}]
+        }
+
+    def list_graphs(self):
+        return sorted(self.graphs)
+
+    def get_endpoints_launcher(self):
+        return self.launcher
+
+class StatisticsManagerTests(unittest.TestCase):
+    """Test for the StatisticsManager class"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+        self.settings = get_appsettings('configs/tests.ini', name='main')
+        self.settings['askomics.database_path'] = os.path.join(self.directory, 'database.db')
+
+        self.request = testing.DummyRequest()
+        self.request.session['username'] = 'jdoe'
+        self.request.session['admin'] = False
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_get_statistics(self):
+        sm = StaticStatistics(self.settings, self.request.session)
+        for graph in ('urn:a', 'urn:b', 'urn:c', 'urn:d'):
+            assert sm.save_graph_statistics(graph)
+
+        public = sm.get_statistics('public')
+        assert public['ngraphs'] == 2
+        assert public['ntriples'] == 20
+        assert public['nentities'] == 4
+        # urn:Gene is a class of both graphs
+        assert public['nclasses'] == 3
+        assert public['class_attr'] == {'Gene': ['name']}
+        assert public['class_rel'] == {'Gene': [{'relname': 'in', 'target': 'urn:a'},
+                                                {'relname': 'in', 'target': 'urn:d'}]}
+
+        # the private graphs of the user, all of them for an administrator
+        assert [graph['graph'] for graph in sm.get_statistics('private')['graphs']] == ['urn:b.tsv']
+        self.request.session['admin'] = True
+        assert sm.get_statistics('private')['ngraphs'] == 2
+
+        assert sm.get_triple_counts() == {'urn:a': 10, 'urn:b': 10, 'urn:c': 10, 'urn:d': 10}
+
+        sm.delete_graph_statistics('urn:a')
+        assert sm.get_statistics('public')['ngraphs'] == 1
+
+    def test_add_endpoints_statistics(self):
+        sm = StaticStatistics(self.settings, self.request.session)
+        sm.launcher = EndpointsLauncher()
+        sm.save_graph_statistics('urn:a')
+
+        stats = sm.get_statistics('public')
+        assert sm.add_endpoints_statistics(stats, []) == stats
+        assert sm.launcher.locals == []
+
+        stats = sm.add_endpoints_statistics(stats, [{'name': 'remote', 'endpoint': 'http://remote/sparql'}])
+        # the local triplestore is not queried again
+        assert set(sm.launcher.locals) == {False}
+        assert stats['ntriples'] == 10 + 12
+        assert stats['ngraphs'] == 1 + 12
+        assert stats['graphs'][1] == {'graph': 'remote.tsv', 'date': '2018-02-01', 'owner': 'jsmith',
+                                      'server': 'remote', 'version': '18.04'}
+        assert stats['class_rel']['Gene'] == [{'relname': 'in', 'target': 'urn:a'},
+                                              {'relname': 'of', 'target': 'Species'}]
+        assert stats['class_attr'] == {'Gene': ['name'], 'Species': ['name']}
+
+        # the view renders them
+        testing.setUp()
+        try:
+            assert json.loads(render('json', {'public': stats}))['public'] == stats
+        finally:
+            testing.tearDown()
+
+    def test_save_failure(self):
+        sm = StaticStatistics(self.settings, self.request.session)
+        assert not sm.save_graph_statistics('urn:broken')
+        assert sm.list_recorded_graphs() == []
+
+    def test_rebuild(self):
+        sm = StaticStatistics(self.settings, self.request.session)
+        sm.save_graph_statistics('urn:a')
+        StaticStatistics.graphs['urn:removed'] = ('public', 'jdoe')
+        sm.save_graph_statistics('urn:removed')
+        del StaticStatistics.graphs['urn:removed']
+
+        assert sm.rebuild() == 3
+        assert sorted(sm.list_recorded_graphs()) == ['urn:a', 'urn:b', 'urn:c', 'urn:d']
+        assert sm.rebuild() == 0
+        assert sm.rebuild(force=True) == 4
+
+    def test_start_rebuild(self):
+        sm = StaticStatistics(self.settings, self.request.session)
+        assert not sm.is_rebuilt()
+
+        assert sm.start_rebuild()
+        for _ in range(100):
+            if sm.is_rebuilt():
+                break
+            time.sleep(0.05)
+
+        assert sm.is_rebuilt()
+        assert not sm.is_rebuilding()
+        assert len(sm.list_recorded_graphs()) == 4
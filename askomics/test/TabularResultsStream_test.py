@@ -0,0 +1,121 @@
+"""contain TabularResultsStream tests"""
+
+import unittest
+import io
+import json
+
+import requests
+
+from askomics.libaskomics.rdfdb.TabularResultsStream import TabularResultsStream
+from askomics.libaskomics.rdfdb.QueryLauncher import QueryLauncher
+
+TSV = ('?s\t?label\t?age\t?b\n'
+       '<http://example.org/A>\t"Alice\\tA\\n\\"x\\""@en\t23\t_:b0\n'
+       '<http://example.org/B>\t\t"25"^^<http://www.w3.org/2001/XMLSchema#integer>\t\n')
+
+CSV = ('s,label,age\r\n'
+       'http://example.org/A,"Alice, ""A""",23\r\n'
+       'http://example.org/B,,25\r\n')
+
+def make_response(body, content_type, status_code=200, encoding='utf-8'):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers['Content-Type'] = content_type
+    response.raw = io.BytesIO(body.encode(encoding))
+    # as the requests adapter does
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    return response
+
+class FakeSession(object):
+    """Answer the queries with the given responses, and record the Accept headers"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.accepts = []
+
+    def post(self, url, data=None, headers=None, stream=False, timeout=None):
+        self.accepts.append(headers['Accept'])
+        return self.responses.pop(0)
+
+class FakeQueryLauncher(QueryLauncher):
+
+    def __init__(self, settings, session, http_session):
+        QueryLauncher.__init__(self, settings, session, endpoint='http://fake/sparql')
+        self.http_session = http_session
+
+    def get_http_session(self):
+        return self.http_session
+
+class TabularResultsStreamTests(unittest.TestCase):
+    """Test for the TabularResultsStream class"""
+
+    def setUp(self):
+        QueryLauncher.endpoint_formats.clear()
+
+    def tearDown(self):
+        QueryLauncher.endpoint_formats.clear()
+
+    def test_tsv(self):
+        stream = TabularResultsStream(io.StringIO(TSV), 'tsv')
+        rows = list(stream)
+
+        assert stream.vars == ['s', 'label', 'age', 'b']
+        assert rows == [
+            {'s': 'http://example.org/A', 'label': 'Alice\tA\n"x"', 'age': '23', 'b': '_:b0'},
+            {'s': 'http://example.org/B', 'age': '25'}
+        ]
+
+    def test_tsv_virtuoso(self):
+        text = '"s"\t"label"\n"http://example.org/A"\t"Alice"\n'
+        rows = list(TabularResultsStream(io.StringIO(text), 'tsv'))
+        assert rows == [{'s': 'http://example.org/A', 'label': 'Alice'}]
+
+    def test_csv(self):
+        stream = TabularResultsStream(io.StringIO(CSV, newline=''), 'csv')
+        rows = list(stream)
+
+        assert stream.vars == ['s', 'label', 'age']
+        assert rows == [
+            {'s': 'http://example.org/A', 'label': 'Alice, "A"', 'age': '23'},
+            {'s': 'http://example.org/B', 'age': '25'}
+        ]
+
+    def test_encoding(self):
+        text = '?label\n"Gène"\n"Ærø"\n'
+        for content_type in ('text/tab-separated-values', 'text/csv'):
+            # the SPARQL results formats are UTF-8, requests would decode them as ISO-8859-1
+            response = make_response(text, content_type)
+            assert response.encoding == 'ISO-8859-1'
+            dialect = 'tsv' if 'tab' in content_type else 'csv'
+            rows = list(TabularResultsStream.from_response(response, dialect))
+            assert [row['label'].strip('"') for row in rows] == ['Gène', 'Ærø']
+
+        response = make_response(text, 'text/tab-separated-values; charset="iso-8859-1"', encoding='iso-8859-1')
+        assert [row['label'] for row in TabularResultsStream.from_response(response)] == ['Gène', 'Ærø']
+
+    def test_negotiate_tsv(self):
+        session = FakeSession([make_response(TSV, 'text/tab-separated-values; charset=utf-8'),
+                               make_response(TSV, 'text/tab-separated-values')])
+        ql = FakeQueryLauncher({}, {}, session)
+
+        assert len(ql.process_query('SELECT * WHERE { ?s ?p ?o }')) == 2
+        assert QueryLauncher.endpoint_formats['http://fake/sparql'] == 'tsv'
+        ql.process_query('SELECT * WHERE { ?s ?p ?o }')
+        assert session.accepts[0].startswith('text/tab-separated-values')
+
+    def test_fallback_json(self):
+        document = json.dumps({"head": {"vars": ["s"]},
+                               "results": {"bindings": [{"s": {"type": "uri", "value": "http://a"}}]}})
+        session = FakeSession([make_response('<sparql/>', 'application/sparql-results+xml'),
+                               make_response(document, 'application/sparql-results+json'),
+                               make_response(document, 'application/sparql-results+json')])
+        ql = FakeQueryLauncher({'askomics.results_format': 'csv'}, {}, session)
+
+        assert ql.process_query('SELECT * WHERE { ?s ?p ?o }') == [{'s': 'http://a'}]
+        assert QueryLauncher.endpoint_formats['http://fake/sparql'] == 'json'
+
+        # the fallback is remembered, no more negotiation
+        assert ql.process_query('SELECT * WHERE { ?s ?p ?o }') == [{'s': 'http://a'}]
+        assert session.accepts == ['text/csv, application/sparql-results+json;q=0.5',
+                                   'application/sparql-results+json',
+                                   'application/sparql-results+json']
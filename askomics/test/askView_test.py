@@ -9,11 +9,14 @@ import json
 from shutil import copyfile
 
 from pyramid import testing
+from pyramid.httpexceptions import HTTPForbidden, HTTPNotModified
 from pyramid.paster import get_appsettings
+from pyramid.renderers import render
 from askomics.libaskomics.TripleStoreExplorer import TripleStoreExplorer
 from askomics.libaskomics.rdfdb.SparqlQueryBuilder import SparqlQueryBuilder
 from askomics.libaskomics.rdfdb.QueryLauncher import QueryLauncher
 from askomics.libaskomics.EndpointManager import EndpointManager
+from askomics.libaskomics.rdfdb.GraphAccessCache import GraphAccessCache
 from askomics.ask_view import AskView
 from SetupTests import SetupTests
 
@@ -125,6 +128,24 @@ class AskViewTests(unittest.TestCase):
         timestamp_instrument = self.tps.load_instruments()
         self.askview.statistics()
 
+    def test_statistics_with_endpoint(self):
+
+        # empty tps
+        self.tps.clean_up()
+
+        timestamp_people = self.tps.load_public_people()
+
+        # the test triplestore is an askomics endpoint too
+        endpoint_manager = EndpointManager(self.settings, self.request.session)
+        endpoint_manager.save_endpoint('local', self.settings['askomics.endpoint'], isenable=True)
+
+        data = self.askview.statistics()
+        data = json.loads(render('json', data, request=self.request))
+
+        assert int(data['public']['ngraphs']) >= 2
+        for graph in data['public']['graphs']:
+            assert set(graph) == {'graph', 'date', 'owner', 'server', 'version'}
+
     def test_add_endpoint(self):
 
             # empty tps
@@ -759,6 +780,41 @@ class AskViewTests(unittest.TestCase):
         assert 'relations' in data
         assert 'positionable' in data
 
+    def test_user_abstraction_not_modified(self):
+        """Test the ETag of getUserAbstraction and start_points"""
+
+        # the graphs of the user, without the triplestore
+        cache = GraphAccessCache.get_cache(SparqlQueryBuilder(self.settings, self.request.session))
+        self.addCleanup(cache.invalidate)
+        cache.put((self.settings['askomics.endpoint'], 'jdoe'),
+                  {self.settings['askomics.endpoint']: {'type': 'askomics', 'private': ['urn:g'], 'public': []}},
+                  cache.stamp())
+
+        tse = TripleStoreExplorer(self.settings, self.request.session)
+        etag = tse.get_abstraction_version()
+        assert tse.get_abstraction_version() == etag
+
+        self.request.headers['If-None-Match'] = 'W/"other", "' + etag + '"'
+        with self.assertRaises(HTTPNotModified):
+            self.askview.getUserAbstraction()
+        with self.assertRaises(HTTPNotModified):
+            self.askview.start_points()
+
+        # another user
+        self.request.session['username'] = 'jsmith'
+        cache.put((self.settings['askomics.endpoint'], 'jsmith'),
+                  {self.settings['askomics.endpoint']: {'type': 'askomics', 'private': ['urn:g'], 'public': []}},
+                  cache.stamp())
+        assert tse.get_abstraction_version() != etag
+
+        # a graph changed
+        self.request.session['username'] = 'jdoe'
+        cache.invalidate()
+        cache.put((self.settings['askomics.endpoint'], 'jdoe'),
+                  {self.settings['askomics.endpoint']: {'type': 'askomics', 'private': ['urn:g'], 'public': []}},
+                  cache.stamp())
+        assert tse.get_abstraction_version() != etag
+
     def test_importShortcut(self):
         """
 
@@ -813,6 +869,7 @@ class AskViewTests(unittest.TestCase):
             }],
             'file': data['file'],
             'nrow': 6,
+            'next_page_token': None,
             'galaxy': False
         }
 
@@ -839,6 +896,39 @@ class AskViewTests(unittest.TestCase):
 
         data = self.askview.getSparqlQueryInTextFormat()
 
+    def test_explain_sparql_query(self):
+        """Test explainSparqlQuery method"""
+
+        self.tps.clean_up()
+
+        # load a test
+        timestamp_people = self.tps.load_people()
+
+        self.request.json_body = {
+            'type_endpoints'       : [ "askomics" ],
+            'endpoints'            : [ "http://localhost:8890/sparql" ],
+            'graphs'               : [ 'urn:sparql:test_askomics:jdoe:people_tsv_' + timestamp_people ],
+            'constraintesRelations': [[[[
+                '?URIPeople1 rdf:type <'+self.settings['askomics.prefix']+'People>',
+                '?URIPeople1 rdfs:label ?People1'
+            ], '']], ''],
+            'variates': {'People1': ['?People1']}
+        }
+
+        # admin only
+        with self.assertRaises(HTTPForbidden):
+            self.askview.explainSparqlQuery()
+
+        self.request.session['admin'] = True
+        data = self.askview.explainSparqlQuery()
+
+        assert 'error' not in data
+        assert data['nrows'] == 6
+        assert 'SELECT DISTINCT ?People1' in data['query']
+        assert [step['pattern'] for step in data['patterns']] == [
+            '?URIPeople1 rdf:type <'+self.settings['askomics.prefix']+'People>',
+            '?URIPeople1 rdfs:label ?People1']
+
     def test_upload_ttl(self):
         """Test uploadTtl method"""
 
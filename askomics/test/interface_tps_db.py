@@ -54,7 +54,7 @@ class InterfaceTpsDb(object):
         sqb = SparqlQueryGraph(self.settings, self.request.session)
         query_laucher = QueryLauncher(self.settings, self.request.session)
 
-        res = query_laucher.process_query(sqb.get_user_graph_infos_with_count())
+        res = query_laucher.process_query(sqb.get_user_graph_infos())
 
         named_graphs = []
 
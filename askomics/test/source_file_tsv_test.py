@@ -56,3 +56,14 @@ class SourceFileTsvTests(unittest.TestCase):
         assert SourceFileTsv.get_strand_faldo(None) == "faldo:BothStrandPosition"
         assert SourceFileTsv.get_strand_faldo("+") == "faldo:ForwardStrandPosition"
         assert SourceFileTsv.get_strand_faldo("-") == "faldo:ReverseStrandPosition"
+
+    def test_track_prefixes(self):
+        source_file = SourceFileTsv(self.settings, self.request.session, self.request.session['upload_directory'] + '/instruments.tsv',preview_limit=1,
+                                    uri_set={0: None, 1: None, 2: 'http://purl.org/dc/elements/1.1/'})
+        source_file.set_forced_column_types(['entity_start', 'text', 'category'])
+
+        ttl = '\n'.join(source_file.get_turtle())
+        ttl += source_file.get_abstraction() + source_file.get_domain_knowledge()
+
+        # the generators record every prefix of the turtle, no need to scan it
+        assert source_file.get_used_prefixes(ttl) <= source_file.used_prefixes
@@ -112,3 +112,296 @@
 #         #constraintesR2[0].append('FILTER ( ?Age1 < 25)')
 #         #results,query = tse.build_sparql_query_from_json(variates,constraintesR2,limit,True)
 #         #assert results == [a]
+
+import unittest
+import os
+import json
+import shutil
+import tempfile
+
+from pyramid import testing
+from pyramid.paster import get_appsettings
+
+from askomics.libaskomics.TripleStoreExplorer import TripleStoreExplorer
+from askomics.libaskomics.rdfdb.SparqlQueryBuilder import SparqlQueryBuilder
+from askomics.libaskomics.rdfdb.SparqlQueryGraph import SparqlQueryGraph
+from askomics.libaskomics.rdfdb.QueryLauncher import QueryTimeout
+
+class GraphScopingTests(unittest.TestCase):
+    """Test the scoping of the queries on many graphs"""
+
+    def setUp(self):
+        self.settings = get_appsettings('configs/tests.ini', name='main')
+        self.request = testing.DummyRequest()
+        self.request.session['username'] = 'jdoe'
+        self.request.session['admin'] = False
+
+    def test_get_graph_scoping(self):
+        sqb = SparqlQueryBuilder(self.settings, self.request.session)
+
+        self.settings['askomics.triplestore'] = 'virtuoso'
+        assert sqb.get_graph_scoping(500) == 'from'
+
+        self.settings['askomics.triplestore'] = 'fuseki'
+        self.settings['askomics.graph_scoping_threshold'] = '10'
+        assert sqb.get_graph_scoping(10) == 'from'
+        assert sqb.get_graph_scoping(11) == 'values'
+
+        self.settings['askomics.graph_scoping'] = 'values, fuseki:from'
+        assert sqb.get_graph_scoping(500) == 'from'
+        self.settings['askomics.triplestore'] = 'virtuoso'
+        assert sqb.get_graph_scoping(1) == 'values'
+
+    def test_build_recursive_block(self):
+        tse = TripleStoreExplorer(self.settings, self.request.session)
+        constraints = [[
+            '?URI1 rdf:type :Gene',
+            'FILTER ( ?a=?b )',
+            [['?URI1 :position ?p'], 'OPTIONAL'],
+            [['?URI2 rdf:type :Protein'], 'SERVICE <http://other/sparql>']
+        ], '']
+
+        assert tse.build_recursive_block('', constraints) == (
+            '?URI1 rdf:type :Gene.\n'
+            'FILTER ( ?a=?b ).\n'
+            'OPTIONAL {\n'
+            '\t?URI1 :position ?p.\n'
+            '}\n'
+            'SERVICE <http://other/sparql> {\n'
+            '\t?URI2 rdf:type :Protein.\n'
+            '}\n')
+
+        # each triple pattern may match in any graph, as with FROM
+        assert tse.build_recursive_block('', constraints, ['urn:g2', 'urn:g1']) == (
+            'GRAPH ?askomics_graph1 { ?URI1 rdf:type :Gene }\n'
+            'VALUES ?askomics_graph1 { <urn:g1> <urn:g2> }\n'
+            'FILTER ( ?a=?b ).\n'
+            'OPTIONAL {\n'
+            '\tGRAPH ?askomics_graph2 { ?URI1 :position ?p }\n'
+            '\tVALUES ?askomics_graph2 { <urn:g1> <urn:g2> }\n'
+            '}\n'
+            'SERVICE <http://other/sparql> {\n'
+            '\t?URI2 rdf:type :Protein.\n'
+            '}\n')
+
+    def test_scoped_query(self):
+        sqb = SparqlQueryBuilder(self.settings, self.request.session)
+        query = sqb.custom_query(['urn:g1'], '?a', 'GRAPH ?g { ?a ?b ?c }', scoped=True)
+        assert 'FROM' not in query
+        query = sqb.custom_query(['urn:g1'], '?a', '?a ?b ?c')
+        assert 'FROM <urn:g1>' in query
+
+        # a property path may join two graphs: FROM is kept
+        self.settings['askomics.graph_scoping'] = 'values'
+        tse = TripleStoreExplorer(self.settings, self.request.session)
+        results, query, typeQuery = tse.build_sparql_query_from_json(
+            [], [], ['urn:g1', 'urn:g2'], ['?a'], [['?a :p ?b . ?b :q ?c'], ''], -1, False)
+        assert 'FROM' not in query and 'GRAPH ?askomics_graph2 { ?b :q ?c }' in query
+        results, query, typeQuery = tse.build_sparql_query_from_json(
+            [], [], ['urn:g1', 'urn:g2'], ['?a'], [['?a :p/:q ?c'], ''], -1, False)
+        assert 'FROM <urn:g2>' in query and 'GRAPH' not in query
+
+class PaginationTests(unittest.TestCase):
+    """Test the pages of the results of the sparqlquery view"""
+
+    def setUp(self):
+        self.settings = get_appsettings('configs/tests.ini', name='main')
+        self.directory = tempfile.mkdtemp()
+        self.settings['askomics.files_dir'] = self.directory
+        self.request = testing.DummyRequest()
+        self.request.session['username'] = 'jdoe'
+        self.request.session['admin'] = False
+
+        self.body = {
+            'endpoints': [],
+            'type_endpoints': [],
+            'graphs': ['urn:g1'],
+            'variates': ['?b', '?a'],
+            'constraintesRelations': [['?a :p ?b'], ''],
+            'limit': 30
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_page_token(self):
+        tse = TripleStoreExplorer(self.settings, self.request.session)
+        fingerprint = tse.get_request_fingerprint(self.body)
+
+        token = tse.make_page_token(fingerprint, 60)
+        self.body['page_token'] = token
+        assert tse.get_request_fingerprint(self.body) == fingerprint
+        assert tse.read_page_token(token, fingerprint) == {'offset': 60, 'file': None, 'count': None}
+
+        # the next pages get the file reserved and the count of the first one
+        token = tse.make_page_token(fingerprint, 60, 'data_123.csv', 1000)
+        assert tse.read_page_token(token, fingerprint) == {'offset': 60, 'file': 'data_123.csv', 'count': 1000}
+        with self.assertRaises(ValueError):
+            tse.read_page_token(tse.make_page_token(fingerprint, 60, '../data_123.csv'), fingerprint)
+
+        self.body['variates'] = ['?a']
+        with self.assertRaises(ValueError):
+            tse.read_page_token(token, tse.get_request_fingerprint(self.body))
+        with self.assertRaises(ValueError):
+            tse.read_page_token('garbage', fingerprint)
+
+    def test_paginated_query(self):
+        tse = TripleStoreExplorer(self.settings, self.request.session)
+
+        results, query, typeQuery = tse.build_sparql_query_from_json(
+            [], [], ['urn:g1'], self.body['variates'], self.body['constraintesRelations'], 31, False, 60)
+        assert query.endswith('ORDER BY ?b ?a\nLIMIT 31\nOFFSET 60\n')
+
+        # the first page is not sorted
+        results, query, typeQuery = tse.build_sparql_query_from_json(
+            [], [], ['urn:g1'], self.body['variates'], self.body['constraintesRelations'], 31, False)
+        assert query.endswith('}\nLIMIT 31\n')
+
+        results, query, typeQuery = tse.build_sparql_query_from_json(
+            [], [], ['urn:g1'], self.body['variates'], self.body['constraintesRelations'], -1, False)
+        assert 'LIMIT' not in query
+
+    def test_reserved_csv(self):
+        tse = TripleStoreExplorer(self.settings, self.request.session)
+
+        filename = tse.save_results_request(self.body)
+        path = tse.get_user_csv_directory() + filename
+        assert not os.path.exists(path)
+        with open(path + '.json') as request_file:
+            assert json.load(request_file)['variates'] == ['?b', '?a']
+
+    def test_reserved_csv_written_once(self):
+        tse = CsvExplorer(self.settings, self.request.session)
+
+        filename = tse.save_results_request(self.body)
+        path = tse.get_user_csv_directory() + filename
+
+        # another request writes it
+        open(path + '.lock', 'w').close()
+        tse.CSV_WRITE_MAX_TIME = 0.2
+        tse.CSV_WAIT_INTERVAL = 0.05
+        assert tse.get_results_csv(filename) == path
+        assert tse.queries == 0
+        os.remove(path + '.lock')
+
+        assert tse.get_results_csv(filename) == path
+        assert tse.get_results_csv(filename) == path
+        assert tse.queries == 1
+        with open(path) as csv_file:
+            assert csv_file.read().split() == ['b', 'a', '1', '2']
+        assert sorted(os.listdir(tse.get_user_csv_directory())) == [filename]
+
+    def test_results_page(self):
+        tse = CsvExplorer(self.settings, self.request.session)
+        tse.rows = [{'b': '1', 'a': '2'}, {'b': '3', 'a': '4'}, {'a': '6'}]
+
+        # the file starts with the first page
+        filename = tse.save_results_request(self.body, [{'b': '3', 'a': '4'}])
+        assert tse.read_results_page(filename, 1, 5) == [{'b': '1', 'a': '2'}, {'a': '6'}]
+        assert tse.read_results_page(filename, 0, 2) == [{'b': '3', 'a': '4'}, {'b': '1', 'a': '2'}]
+        assert tse.read_results_page(filename, 3, 2) == []
+        assert tse.queries == 1
+
+    def test_stale_csv_marker(self):
+        tse = CsvExplorer(self.settings, self.request.session)
+
+        filename = tse.save_results_request(self.body)
+        path = tse.get_user_csv_directory() + filename
+        open(path + '.lock', 'w').close()
+        tse.CSV_WRITE_MAX_TIME = 0
+        assert tse.get_results_csv(filename) == path
+        assert tse.queries == 1
+
+class CsvExplorer(TripleStoreExplorer):
+    """Answer the results of the reserved csv files"""
+
+    queries = 0
+    rows = [{'b': '1', 'a': '2'}]
+
+    def build_sparql_query_from_json(self, *args, **kwargs):
+        self.queries += 1
+        return iter(self.rows), '', ''
+
+class TimeoutExplorer(TripleStoreExplorer):
+    """Answer the count queries after a timeout"""
+
+    def build_sparql_query_from_json(self, *args, **kwargs):
+        raise QueryTimeout("The query took more than 5s.")
+
+class CountFirstTests(unittest.TestCase):
+    """Test the count of the results before the user queries"""
+
+    def setUp(self):
+        self.settings = get_appsettings('configs/tests.ini', name='main')
+        self.request = testing.DummyRequest()
+        self.request.session['username'] = 'jdoe'
+        self.request.session['admin'] = False
+
+    def test_settings(self):
+        tse = TripleStoreExplorer(self.settings, self.request.session)
+        assert tse.get_count_first_timeout() is None
+        assert tse.get_count_first_max_rows() is None
+
+        self.settings['askomics.count_first'] = 'true'
+        self.settings['askomics.count_first_timeout'] = '2'
+        self.settings['askomics.count_first_max_rows'] = '1000000'
+        assert tse.get_count_first_timeout() == 2
+        assert tse.get_count_first_max_rows() == 1000000
+
+    def test_count_query(self):
+        tse = TripleStoreExplorer(self.settings, self.request.session)
+        results, query, typeQuery = tse.build_sparql_query_from_json(
+            [], [], ['urn:g1'], ['?b', '?a'], [['?a :p ?b'], ''], 31, False, count=True)
+
+        assert 'SELECT DISTINCT (COUNT(*) AS ?count)\n' in query
+        assert '{ SELECT DISTINCT ?b ?a WHERE {\n?a :p ?b.\n} }' in query
+        assert 'LIMIT' not in query
+
+    def test_count_timeout(self):
+        tse = TimeoutExplorer(self.settings, self.request.session)
+        assert tse.count_sparql_query_from_json([], [], ['urn:g1'], ['?a'], [['?a :p ?b'], ''], 5) is None
+
+class StaticLauncher(object):
+    """Answer the rows of the consolidated abstraction query"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def process_query(self, query, lendpoints, local=True):
+        self.queries.append((query, local))
+        return self.rows
+
+class AbstractionQueryTests(unittest.TestCase):
+    """Test the consolidated abstraction query"""
+
+    def setUp(self):
+        self.settings = get_appsettings('configs/tests.ini', name='main')
+        self.request = testing.DummyRequest()
+        self.request.session['username'] = 'jdoe'
+        self.request.session['admin'] = False
+
+    def test_query_abstraction(self):
+        sqg = SparqlQueryGraph(self.settings, self.request.session)
+        ql = StaticLauncher([
+            {'facet': 'relations', 'g': 'urn:g', 'subject': 'urn:A', 'relation': 'urn:r', 'object': 'urn:B'},
+            {'facet': 'entities', 'g': 'urn:g', 'entity': 'urn:A', 'property': 'urn:p', 'value': 'a'},
+            {'facet': 'positionable', 'entity': 'urn:A'},
+            {'facet': 'unknown', 'entity': 'urn:C'}
+        ])
+
+        data = TripleStoreExplorer.query_abstraction(sqg, ql, [], local=False)
+
+        # a single query per endpoint
+        assert len(ql.queries) == 1
+        assert ql.queries[0][1] is False
+        assert 'dc:creator "jdoe"' in ql.queries[0][0]
+
+        assert data == {
+            'relations': [{'g': 'urn:g', 'subject': 'urn:A', 'relation': 'urn:r', 'object': 'urn:B'}],
+            'entities': [{'g': 'urn:g', 'entity': 'urn:A', 'property': 'urn:p', 'value': 'a'}],
+            'attributes': [],
+            'categories': [],
+            'subclassof': [],
+            'positionable': [{'entity': 'urn:A'}]
+        }